@@ -1,9 +1,16 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import docx_processor, quiz
 #cron task cleanup
 from app.services.cleanup_service import CleanupService
+from app.services.job_service import job_manager
+from app.services.result_writer import result_writer
+from app.utils.conversion_scheduler import conversion_scheduler
+from app.utils.image_utils import raster_pool
+from app.utils.lazy_images import lazy_images
+from app.utils.soffice_pool import soffice_pool
+from app.utils.metrics import MetricsMiddleware, render_latest
+from app.utils.static_files import OutputsStaticFiles
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -16,10 +23,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Server-Timing"],
 )
 
-# Static files for serving outputs
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+# Request latency per route + Server-Timing header
+app.add_middleware(MetricsMiddleware)
+
+# Static files for serving outputs (precompressed variants, ETag / Range, cache headers)
+app.mount("/outputs", OutputsStaticFiles(directory="outputs"), name="outputs")
 
 # Include routers
 app.include_router(docx_processor.router, prefix="/api/v1")
@@ -43,14 +54,28 @@ async def startup_event():
     """Start the scheduler when the app starts"""
     print("Starting scheduler for cleanup tasks...")
     scheduler.start()
+    # Replay journal của lần chạy trước (nếu có) và bắt đầu flush nền
+    result_writer.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown the scheduler when the app shuts down"""
     print("Shutting down scheduler for cleanup tasks...")
     scheduler.shutdown()
+    job_manager.shutdown()
+    conversion_scheduler.shutdown()
+    raster_pool.shutdown()
+    soffice_pool.shutdown()
+    lazy_images.shutdown()
+    result_writer.stop()
 
 
 @app.get("/")
 async def root():
-    return {"message": "DOCX Processor Microservice"}
\ No newline at end of file
+    return {"message": "DOCX Processor Microservice"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics in text exposition format"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
\ No newline at end of file
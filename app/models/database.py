@@ -1,7 +1,12 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, Boolean, JSON
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, Boolean, JSON, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
 
@@ -15,9 +20,79 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL and DATABASE_URL.startswith("mysql://"):
     DATABASE_URL = DATABASE_URL.replace("mysql://", "mysql+pymysql://", 1)
 
+def utc_now() -> datetime:
+    """Naive UTC time truncated to seconds, the value stored in completed_at.
+
+    Set from Python on every insert path (direct and write-behind), so rows
+    are ordered by one clock whatever the database server's time zone; MySQL
+    DATETIME drops offsets and rounds fractional seconds.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def to_async_url(url: str) -> str:
+    """Map a sync DATABASE_URL to the matching async driver (aiomysql / aiosqlite)"""
+    if url.startswith("mysql+pymysql://"):
+        return url.replace("mysql+pymysql://", "mysql+aiomysql://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+# Async engine for request handlers; ASYNC_DATABASE_URL overrides the derived URL
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (to_async_url(DATABASE_URL) if DATABASE_URL else None)
+
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+# expire_on_commit=False: route handlers read attributes after commit without lazy IO
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Read replica (tùy chọn): các route chỉ đọc dùng replica, ghi luôn vào primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("mysql://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("mysql://", "mysql+pymysql://", 1)
+ASYNC_DATABASE_REPLICA_URL = os.getenv("ASYNC_DATABASE_REPLICA_URL") or (
+    to_async_url(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+)
+
+replica_engine = create_engine(DATABASE_REPLICA_URL, pool_pre_ping=True) if DATABASE_REPLICA_URL else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+
+async_replica_engine = create_async_engine(ASYNC_DATABASE_REPLICA_URL, pool_pre_ping=True) if ASYNC_DATABASE_REPLICA_URL else None
+AsyncReplicaSessionLocal = (
+    async_sessionmaker(async_replica_engine, autoflush=False, expire_on_commit=False)
+    if async_replica_engine else None
+)
+
+
+class RecentWrites:
+    """Exam UUIDs this process wrote in the last `window` seconds.
+
+    DatabaseService reads for such an exam go to the primary instead of the
+    replica, so a write is visible to the next read despite replication lag.
+    """
+
+    def __init__(self, window: float = 5.0, max_keys: int = 10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def mark(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._expiry[key] = now + self.window
+            if len(self._expiry) > self.max_keys:
+                self._expiry = {k: t for k, t in self._expiry.items() if t > now}
+
+    def is_recent(self, key: str) -> bool:
+        with self._lock:
+            expiry = self._expiry.get(key)
+        return expiry is not None and expiry > time.monotonic()
+
+
+recent_writes = RecentWrites(window=float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5")))
+
 Base = declarative_base()
 
 class TestExamRoom(Base):
@@ -49,8 +124,25 @@ class ExamResult(Base):
     security_violation_detected = Column(Boolean, default=False, nullable=False)
     activity_log = Column(JSON, nullable=True)  # Store activity log as JSON
     suspicious_activity = Column(JSON, nullable=True)  # Store suspicious activity counts as JSON
+    # Đáp án đã chọn, mỗi câu một ký tự theo thứ tự answer key ("-" = bỏ trống)
+    answers = Column(Text, nullable=True)
     
-    completed_at = Column(DateTime(timezone=True), server_default=func.now())
+    # SQLite: lưu cùng định dạng với CURRENT_TIMESTAMP (không có microsecond),
+    # để so sánh chuỗi giữa giá trị mặc định và tham số bind là đúng.
+    # default=utc_now: mọi insert dùng cùng đồng hồ UTC với result_writer
+    completed_at = Column(
+        DateTime(timezone=True).with_variant(
+            SQLITE_DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+            "sqlite"
+        ),
+        default=utc_now,
+        server_default=func.now()
+    )
+
+    # Keyset pagination / export theo (completed_at, id) trong một exam
+    __table_args__ = (
+        Index("ix_exam_results_exam_completed", "test_exam_uuid", "completed_at", "id"),
+    )
 
 class ExamTimer(Base):
     __tablename__ = "exam_timer"
@@ -60,11 +152,71 @@ class ExamTimer(Base):
     username = Column(String(255), nullable=False, index=True)
     time_start = Column(DateTime(timezone=True), server_default=func.now())
 
+def upgrade_schema(bind) -> None:
+    """Bring tables created by an older version up to the current models.
+
+    create_all only creates missing tables, so columns and indexes added to
+    an existing table are created here. On SQLite, completed_at values stored with
+    microseconds (the format used before the keyset pagination) are
+    rewritten to the CURRENT_TIMESTAMP format, so cursor comparisons see
+    old and new rows alike. Every step checks first: running it on each
+    start, from several workers at once, is harmless.
+    """
+    if "exam_results" not in inspect(bind).get_table_names():
+        return
+    # Cột thêm sau khi bảng đã được tạo (đều nullable)
+    for column, ddl in (("answers", "TEXT NULL"),):
+        if column in {c["name"] for c in inspect(bind).get_columns("exam_results")}:
+            continue
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(f"ALTER TABLE exam_results ADD COLUMN {column} {ddl}"))
+        except Exception:
+            if column not in {c["name"] for c in inspect(bind).get_columns("exam_results")}:
+                raise
+    for index in ExamResult.__table__.indexes:
+        try:
+            index.create(bind, checkfirst=True)
+        except Exception:
+            # Worker khác vừa tạo xong index
+            if index.name not in {ix["name"] for ix in inspect(bind).get_indexes("exam_results")}:
+                raise
+    if bind.dialect.name == "sqlite":
+        with bind.begin() as conn:
+            conn.execute(text(
+                "UPDATE exam_results SET completed_at = substr(replace(completed_at, 'T', ' '), 1, 19) "
+                "WHERE length(completed_at) > 19"
+            ))
+
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db():
+    """Replica session for read-only handlers, or None when no replica is configured"""
+    if ReplicaSessionLocal is None:
+        yield None
+        return
+    db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    """Async replica session for read-only handlers, or None when no replica is configured"""
+    if AsyncReplicaSessionLocal is None:
+        yield None
+        return
+    async with AsyncReplicaSessionLocal() as db:
+        yield db
@@ -1,20 +1,34 @@
 from fastapi import APIRouter, UploadFile, Form, File, HTTPException, Depends
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, UUID4
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
-from app.services.docx_service import DocxService
-from app.models.database import get_db
-from app.services.database_service import DatabaseService
+from app.services.docx_service import DocxService, InvalidUploadError, PARSER_ENGINES
+from app.utils.image_utils import ImageUtils
+from app.utils.conversion_scheduler import conversion_scheduler, ConversionQueueFullError
+from app.models.database import get_async_db
+from app.services.database_service import AsyncDatabaseService
+from app.services.job_service import job_manager, JobQueueFullError
 import shutil
 import os
 
 router = APIRouter()
 
+class ImageVariant(BaseModel):
+    name: str  # "thumb", "mobile"
+    src: str
+    width: int
+    height: int
+
 class Block(BaseModel):
     type: str
     content: Optional[str] = None
     src: Optional[str] = None
+    # Chỉ có ở block ảnh: kích thước bản đầy đủ và các bản thu nhỏ (srcset)
+    width: Optional[int] = None
+    height: Optional[int] = None
+    variants: Optional[List[ImageVariant]] = None
 
 class Option(BaseModel):
     label: str
@@ -34,6 +48,22 @@ class ProcessDocxResponse(BaseModel):
     status: str
     message: str
 
+class JobAcceptedResponse(BaseModel):
+    job_id: str
+    uuid: str
+    status: str
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    uuid: str
+    status: str  # "queued", "running", "succeeded", "failed"
+    stage: str
+    progress: float
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
 @router.post("/process-docx", response_model=ProcessDocxResponse)
 async def process_docx(
     file: UploadFile = File(...),
@@ -41,41 +71,112 @@ async def process_docx(
     username: str = Form(...),
     title: str = Form(None),
     time_limit: int = Form(None),
+    async_mode: bool = Form(False),
+    engine: str = Form("pandoc"),
     service: DocxService = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="Only DOCX files are allowed")
     
+    if engine not in PARSER_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of: {', '.join(PARSER_ENGINES)}")
+    
     if request_uuid is None:
         request_uuid = uuid.uuid4()
     
-    try:
-        # Process DOCX file (questions/answers stored in output.json)
-        await service.process_docx(file, str(request_uuid))
+    # Không ghi đè exam đã có; thư mục đã tồn tại được save_upload từ chối (409)
+    if await AsyncDatabaseService(db).get_test_exam_room_by_uuid(str(request_uuid)) is not None:
+        raise HTTPException(status_code=409, detail=f"Exam {request_uuid} already exists")
+    
+    if async_mode:
+        # Lưu file rồi trả về 202 ngay; convert + tạo exam room chạy ở background
+        try:
+            content_hash = await service.save_upload(file, str(request_uuid))
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        try:
+            job = job_manager.submit(
+                request_uuid=str(request_uuid),
+                username=username,
+                title=title or file.filename,
+                time_limit=time_limit,
+                content_hash=content_hash,
+                engine=engine
+            )
+        except JobQueueFullError as e:
+            # Thư mục vừa được save_upload tạo cho request này
+            shutil.rmtree(os.path.join("outputs", str(request_uuid)), ignore_errors=True)
+            raise HTTPException(status_code=503, detail=str(e))
         
+        return JSONResponse(
+            status_code=202,
+            content=JobAcceptedResponse(
+                job_id=job.id,
+                uuid=str(request_uuid),
+                status=job.status,
+                status_url=f"/api/v1/jobs/{job.id}"
+            ).dict()
+        )
+    
+    try:
+        # Process DOCX file (questions/answers stored in output.json);
+        # on failure process_docx removes the outputs/<uuid> it created
+        await service.process_docx(file, str(request_uuid), engine)
+    except InvalidUploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ConversionQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    
+    try:
         # Only save basic exam room info to database
-        db_service = DatabaseService(db)
-        db_service.create_test_exam_room(
+        db_service = AsyncDatabaseService(db)
+        await db_service.create_test_exam_room(
             uuid=str(request_uuid),
             username=username,
             title=title or file.filename,
             time_limit=time_limit
         )
-        
-        return ProcessDocxResponse(
-            uuid=str(request_uuid), 
-            status="success", 
-            message="DOCX processed and exam room created successfully"
-        )
     except Exception as e:
+        # Thư mục do upload này tạo, không có room thì không dùng được
+        shutil.rmtree(os.path.join("outputs", str(request_uuid)), ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    
+    return ProcessDocxResponse(
+        uuid=str(request_uuid), 
+        status="success", 
+        message="DOCX processed and exam room created successfully"
+    )
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """Poll the stage and progress of an async_mode DOCX upload.
+
+    Jobs live in the memory of the worker process that accepted the upload, so with
+    several workers a poll routed to another one returns 404 for a job that exists.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(**job.to_dict())
+
+@router.get("/image-cache/stats")
+async def get_image_cache_stats():
+    """Hit/miss counters of the converted image cache for this worker process"""
+    return ImageUtils.cache_stats()
+
+@router.get("/conversion/stats")
+async def get_conversion_stats():
+    """Queue length and busy workers of the shared image conversion pool for this worker process"""
+    return conversion_scheduler.stats()
 
 @router.delete("/test-room/{test_uuid}/{username}")
 async def delete_test_room(
     test_uuid: str,
     username: str,  # Path parameter for ownership verification
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete test exam room and all associated data (DB + files)
@@ -86,10 +187,10 @@ async def delete_test_room(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     
     # Delete from database (with ownership check)
-    deleted = db_service.delete_test_exam_room(test_uuid, username)
+    deleted = await db_service.delete_test_exam_room(test_uuid, username)
     
     if not deleted:
         raise HTTPException(
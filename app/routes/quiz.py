@@ -1,20 +1,52 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session
-import uuid
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+import base64
+import csv
+import hashlib
+import io
 import json
+import uuid
 import os
 from datetime import datetime
-from app.models.database import get_db
-from app.services.database_service import DatabaseService
+from app.models.database import AsyncSessionLocal, AsyncReplicaSessionLocal, get_async_db, get_async_read_db
+from app.services.database_service import AsyncDatabaseService, RESULT_JSON_COLUMNS
+from app.services.quiz_cache import quiz_cache
+from app.services.analytics_service import analytics_cache, compute_item_analytics, pack_answers
+from app.services.result_writer import result_writer
+from app.utils.lazy_images import lazy_images
+from fastapi.concurrency import run_in_threadpool
 
 router = APIRouter()
 
+# Số bài nộp tối đa trong một lần gọi /quiz/check-answers/batch
+BATCH_MAX_SUBMISSIONS = int(os.getenv("QUIZ_BATCH_MAX_SUBMISSIONS", "500"))
+
+# Số dòng tối đa mỗi trang của /quiz/{quiz_uuid}/results
+RESULTS_MAX_PAGE_SIZE = int(os.getenv("QUIZ_RESULTS_MAX_PAGE_SIZE", "1000"))
+
+# Cột của danh sách kết quả, theo thứ tự trả về (cột JSON nối thêm ở cuối)
+RESULT_FIELDS = [
+    "student_username", "score_percentage", "correct_answers", "total_questions", "completed_at",
+    "ip_address", "cheating_detected", "cheating_reason", "exam_cancelled", "security_violation_detected",
+]
+
+class ImageVariant(BaseModel):
+    name: str  # "thumb", "mobile"
+    src: str
+    width: int
+    height: int
+
 class Block(BaseModel):
     type: str
     content: Optional[str] = None
     src: Optional[str] = None
+    # Chỉ có ở block ảnh: kích thước bản đầy đủ và các bản thu nhỏ (srcset)
+    width: Optional[int] = None
+    height: Optional[int] = None
+    variants: Optional[List[ImageVariant]] = None
 
 class QuizOption(BaseModel):
     label: str
@@ -55,8 +87,7 @@ class SuspiciousActivity(BaseModel):
     contextMenuAttempts: int
     keyboardShortcuts: int
 
-class CheckAnswersRequest(BaseModel):
-    quiz_uuid: str
+class SubmissionAnswers(BaseModel):
     student_username: str
     answers: List[UserAnswer]
     cheating_detected: Optional[bool] = False
@@ -65,6 +96,13 @@ class CheckAnswersRequest(BaseModel):
     suspicious_activity: Optional[SuspiciousActivity] = None
     security_violation_detected: Optional[bool] = False
 
+class CheckAnswersRequest(SubmissionAnswers):
+    quiz_uuid: str
+
+class BatchCheckAnswersRequest(BaseModel):
+    quiz_uuid: str
+    submissions: List[SubmissionAnswers]
+
 class QuestionResult(BaseModel):
     question_id: int
     user_answer: str
@@ -80,6 +118,18 @@ class CheckAnswersResponse(BaseModel):
     security_notes: Optional[str] = None
     exam_status: str  # "completed", "cancelled", "flagged"
 
+class BatchSubmissionResult(BaseModel):
+    student_username: str
+    status: str  # "saved", "error"
+    result: Optional[CheckAnswersResponse] = None
+    error: Optional[str] = None
+
+class BatchCheckAnswersResponse(BaseModel):
+    quiz_uuid: str
+    saved: int
+    failed: int
+    results: List[BatchSubmissionResult]
+
 class CancelExamRequest(BaseModel):
     quiz_uuid: str
     student_username: str
@@ -99,200 +149,300 @@ class StartExamTimerResponse(BaseModel):
     is_new: bool  # True if newly created, False if already existed
 
 @router.get("/quiz/{quiz_uuid}", response_model=QuizWithExamInfoResponse)
-async def get_quiz_data(quiz_uuid: str, db: Session = Depends(get_db)):
-    """Get quiz data from output.json without correct answers"""
+async def get_quiz_data(
+    quiz_uuid: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
+    """Get quiz data without correct answers.
+
+    The questions are the pre-serialized bytes of public.json; only the exam
+    room metadata is encoded per request. Answers 304 when If-None-Match
+    carries the current ETag.
+    """
     try:
         uuid.UUID(quiz_uuid)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
     # Check if exam room exists in database
-    db_service = DatabaseService(db)
-    exam_room = db_service.get_test_exam_room_by_uuid(quiz_uuid)
+    db_service = AsyncDatabaseService(db, read_db)
+    exam_room = await db_service.get_test_exam_room_by_uuid(quiz_uuid)
     if not exam_room:
         raise HTTPException(status_code=404, detail="Exam room not found")
     
-    # Read questions from output.json file
     project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    json_path = os.path.join(project_root, "outputs", quiz_uuid, "output.json")
-    if not os.path.exists(json_path):
-        raise HTTPException(status_code=404, detail="Quiz data not found")
+    output_dir = os.path.join(project_root, "outputs", quiz_uuid)
     
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        public = quiz_cache.get_public_questions(quiz_uuid, output_dir)
+        if public is None:
+            raise HTTPException(status_code=404, detail="Quiz data not found")
+        # Đề được mở: convert nốt ảnh chưa convert (lazy mode) trước khi học sinh cần tới
+        lazy_images.schedule_prewarm(quiz_uuid)
         
-        # Filter out correct answers for exam taking
-        quiz_questions = []
-        for question in data.get("questions", []):
-            quiz_options = []
-            for option in question.get("options", []):
-                quiz_options.append(QuizOption(
-                    label=option["label"],
-                    blocks=[Block(**block) for block in option["blocks"]]
-                ))
-            
-            quiz_questions.append(QuizQuestion(
-                id=question["id"],
-                blocks=[Block(**block) for block in question["blocks"]],
-                options=quiz_options
-            ))
+        # Cùng thứ tự field với QuizWithExamInfoResponse; "questions" được nối vào cuối
+        metadata = json.dumps({
+            "exam_uuid": exam_room.uuid,
+            "title": exam_room.title,
+            "username": exam_room.username,
+            "time_limit": exam_room.time_limit,
+            "created_at": exam_room.created_at.isoformat(),
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha256(metadata + public.digest.encode()).hexdigest()[:32] + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
         
-        return QuizWithExamInfoResponse(
-            exam_uuid=exam_room.uuid,
-            title=exam_room.title,
-            username=exam_room.username,
-            time_limit=exam_room.time_limit,
-            created_at=exam_room.created_at.isoformat(),
-            questions=quiz_questions
-        )
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
         
+        body = metadata[:-1] + b',"questions":' + public.body + b"}"
+        return Response(content=body, media_type="application/json", headers=headers)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to read quiz data: {str(e)}")
 
+def grade_submission(submission: SubmissionAnswers, answer_key: Dict[int, str]) -> Tuple[CheckAnswersResponse, Dict[str, Any]]:
+    """Grade one submission against a quiz answer key (question id -> label).
+
+    Returns the API response and the ExamResult column values to store
+    (everything except test_exam_uuid and ip_address).
+    """
+    # Check each user answer
+    results = []
+    correct_count = 0
+
+    for user_answer in submission.answers:
+        question_id = user_answer.question_id
+        user_selected = user_answer.selected_option
+        correct_answer = answer_key.get(question_id, "")
+
+        is_correct = user_selected.upper() == correct_answer.upper()
+        if is_correct:
+            correct_count += 1
+
+        results.append(QuestionResult(
+            question_id=question_id,
+            user_answer=user_selected,
+            correct_answer=correct_answer,
+            is_correct=is_correct
+        ))
+
+    total_questions = len(submission.answers)
+    incorrect_count = total_questions - correct_count  # Calculate incorrect answers
+    score_percentage = (correct_count / total_questions * 100) if total_questions > 0 else 0
+
+    # Prepare security notes and determine exam status
+    security_notes = None
+    exam_status = "completed"
+    exam_cancelled = False
+
+    if submission.cheating_detected:
+        exam_status = "flagged"
+        security_notes = f"Security violation detected: {submission.cheating_reason}"
+
+        # Check if should cancel exam based on severity
+        if submission.suspicious_activity:
+            sa = submission.suspicious_activity
+            total_violations = (sa.tabSwitches + sa.devToolsAttempts + 
+                              sa.copyAttempts + sa.contextMenuAttempts + 
+                              sa.keyboardShortcuts)
+
+            # Cancel exam if too many violations (threshold: 10)
+            if total_violations >= 10:
+                exam_cancelled = True
+                exam_status = "cancelled"
+                security_notes = f"Exam cancelled due to excessive violations: {submission.cheating_reason}"
+
+            activity_summary = []
+            if sa.tabSwitches > 0:
+                activity_summary.append(f"Tab switches: {sa.tabSwitches}")
+            if sa.devToolsAttempts > 0:
+                activity_summary.append(f"DevTools attempts: {sa.devToolsAttempts}")
+            if sa.copyAttempts > 0:
+                activity_summary.append(f"Copy attempts: {sa.copyAttempts}")
+            if sa.contextMenuAttempts > 0:
+                activity_summary.append(f"Context menu attempts: {sa.contextMenuAttempts}")
+            if sa.keyboardShortcuts > 0:
+                activity_summary.append(f"Keyboard shortcuts: {sa.keyboardShortcuts}")
+
+            if activity_summary:
+                security_notes += f" | Activity: {', '.join(activity_summary)}"
+
+    # Convert activity log to dict format for database storage
+    activity_log_dict = None
+    if submission.activity_log:
+        activity_log_dict = [log.dict() for log in submission.activity_log]
+
+    # Convert suspicious activity to dict format
+    suspicious_activity_dict = None
+    if submission.suspicious_activity:
+        suspicious_activity_dict = submission.suspicious_activity.dict()
+
+    response = CheckAnswersResponse(
+        total_questions=total_questions,
+        correct_answers=correct_count,
+        incorrect_answers=incorrect_count,  # Add this field to response
+        score_percentage=round(score_percentage, 2),
+        results=results,
+        security_notes=security_notes,
+        exam_status=exam_status
+    )
+    exam_result = {
+        "student_username": submission.student_username,
+        "total_questions": total_questions,
+        "correct_answers": correct_count,
+        "score_percentage": score_percentage,
+        "cheating_detected": submission.cheating_detected or False,
+        "cheating_reason": submission.cheating_reason,
+        "exam_cancelled": exam_cancelled,
+        "security_violation_detected": submission.security_violation_detected or False,
+        "activity_log": activity_log_dict,
+        "suspicious_activity": suspicious_activity_dict,
+        "answers": pack_answers(answer_key, {a.question_id: a.selected_option for a in submission.answers}),
+    }
+    return response, exam_result
+
 @router.post("/quiz/check-answers", response_model=CheckAnswersResponse)
 async def check_quiz_answers(
     request: CheckAnswersRequest, 
     client_request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Check answers from output.json and save score to database"""
+    """Check answers against the exam answer key and save score to database"""
     try:
         uuid.UUID(request.quiz_uuid)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     
     # Check if exam room exists
-    exam_room = db_service.get_test_exam_room_by_uuid(request.quiz_uuid)
+    exam_room = await db_service.get_test_exam_room_by_uuid(request.quiz_uuid)
     if not exam_room:
         raise HTTPException(status_code=404, detail="Exam room not found")
     
-    # Check if student already submitted
-    if db_service.check_student_submitted(request.quiz_uuid, request.student_username):
+    # Check if student already submitted (write-behind buffer first, then DB)
+    if result_writer.is_pending(request.quiz_uuid, request.student_username) or \
+            await db_service.check_student_submitted(request.quiz_uuid, request.student_username):
         raise HTTPException(status_code=400, detail="test.submittedBefore")
     
-    # Read correct answers from output.json
+    # Read correct answers from answer_key.json (output.json for older exams)
     project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    json_path = os.path.join(project_root, "outputs", request.quiz_uuid, "output.json")
-    if not os.path.exists(json_path):
-        raise HTTPException(status_code=404, detail="Quiz data not found")
+    output_dir = os.path.join(project_root, "outputs", request.quiz_uuid)
     
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        # Create mapping of question_id to correct answer
-        correct_answers_map = {}
-        for question in data.get("questions", []):
-            correct_answers_map[question["id"]] = question.get("correct", "")
-        
-        # Check each user answer
-        results = []
-        correct_count = 0
-        
-        for user_answer in request.answers:
-            question_id = user_answer.question_id
-            user_selected = user_answer.selected_option
-            correct_answer = correct_answers_map.get(question_id, "")
-            
-            is_correct = user_selected.upper() == correct_answer.upper()
-            if is_correct:
-                correct_count += 1
-            
-            results.append(QuestionResult(
-                question_id=question_id,
-                user_answer=user_selected,
-                correct_answer=correct_answer,
-                is_correct=is_correct
-            ))
-        
-        total_questions = len(request.answers)
-        incorrect_count = total_questions - correct_count  # Calculate incorrect answers
-        score_percentage = (correct_count / total_questions * 100) if total_questions > 0 else 0
-        
-        # Prepare security notes and determine exam status
-        security_notes = None
-        exam_status = "completed"
-        exam_cancelled = False
-        
-        if request.cheating_detected:
-            exam_status = "flagged"
-            security_notes = f"Security violation detected: {request.cheating_reason}"
-            
-            # Check if should cancel exam based on severity
-            if request.suspicious_activity:
-                sa = request.suspicious_activity
-                total_violations = (sa.tabSwitches + sa.devToolsAttempts + 
-                                  sa.copyAttempts + sa.contextMenuAttempts + 
-                                  sa.keyboardShortcuts)
-                
-                # Cancel exam if too many violations (threshold: 10)
-                if total_violations >= 10:
-                    exam_cancelled = True
-                    exam_status = "cancelled"
-                    security_notes = f"Exam cancelled due to excessive violations: {request.cheating_reason}"
-                
-                activity_summary = []
-                if sa.tabSwitches > 0:
-                    activity_summary.append(f"Tab switches: {sa.tabSwitches}")
-                if sa.devToolsAttempts > 0:
-                    activity_summary.append(f"DevTools attempts: {sa.devToolsAttempts}")
-                if sa.copyAttempts > 0:
-                    activity_summary.append(f"Copy attempts: {sa.copyAttempts}")
-                if sa.contextMenuAttempts > 0:
-                    activity_summary.append(f"Context menu attempts: {sa.contextMenuAttempts}")
-                if sa.keyboardShortcuts > 0:
-                    activity_summary.append(f"Keyboard shortcuts: {sa.keyboardShortcuts}")
-                
-                if activity_summary:
-                    security_notes += f" | Activity: {', '.join(activity_summary)}"
+        answer_key = quiz_cache.get_answer_key(request.quiz_uuid, output_dir)
+        if answer_key is None:
+            raise HTTPException(status_code=404, detail="Quiz data not found")
         
-        # Convert activity log to dict format for database storage
-        activity_log_dict = None
-        if request.activity_log:
-            activity_log_dict = [log.dict() for log in request.activity_log]
-        
-        # Convert suspicious activity to dict format
-        suspicious_activity_dict = None
-        if request.suspicious_activity:
-            suspicious_activity_dict = request.suspicious_activity.dict()
+        response, exam_result = grade_submission(request, answer_key)
         
         # Save score to database with security information
         ip_address = client_request.client.host
-        db_service.create_exam_result(
-            test_exam_uuid=request.quiz_uuid,
-            student_username=request.student_username,
-            total_questions=total_questions,
-            correct_answers=correct_count,
-            score_percentage=score_percentage,
-            ip_address=ip_address,
-            cheating_detected=request.cheating_detected or False,
-            cheating_reason=request.cheating_reason,
-            exam_cancelled=exam_cancelled,
-            security_violation_detected=request.security_violation_detected or False,
-            activity_log=activity_log_dict,
-            suspicious_activity=suspicious_activity_dict
-        )
+        if result_writer.enabled:
+            # Ghi vào journal (fsync) rồi trả lời ngay; thread nền insert theo batch
+            row = {"test_exam_uuid": request.quiz_uuid, "ip_address": ip_address, **exam_result}
+            if not await run_in_threadpool(result_writer.submit, row):
+                raise HTTPException(status_code=400, detail="test.submittedBefore")
+        else:
+            await db_service.create_exam_result(
+                test_exam_uuid=request.quiz_uuid,
+                ip_address=ip_address,
+                **exam_result
+            )
         
-        return CheckAnswersResponse(
-            total_questions=total_questions,
-            correct_answers=correct_count,
-            incorrect_answers=incorrect_count,  # Add this field to response
-            score_percentage=round(score_percentage, 2),
-            results=results,
-            security_notes=security_notes,
-            exam_status=exam_status
-        )
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to check answers: {str(e)}")
 
+@router.post("/quiz/check-answers/batch", response_model=BatchCheckAnswersResponse)
+async def check_quiz_answers_batch(
+    request: BatchCheckAnswersRequest,
+    client_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Grade many submissions of one quiz (offline sync) and save them in one transaction.
+
+    The answer key is loaded once, existing submissions are found with one
+    query and all new results are inserted together. Per-student errors
+    (already submitted, duplicated in the batch) do not fail the batch.
+    """
+    try:
+        uuid.UUID(request.quiz_uuid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    
+    if len(request.submissions) > BATCH_MAX_SUBMISSIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_SUBMISSIONS} submissions per batch")
+    
+    db_service = AsyncDatabaseService(db)
+    
+    exam_room = await db_service.get_test_exam_room_by_uuid(request.quiz_uuid)
+    if not exam_room:
+        raise HTTPException(status_code=404, detail="Exam room not found")
+    
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output_dir = os.path.join(project_root, "outputs", request.quiz_uuid)
+    answer_key = quiz_cache.get_answer_key(request.quiz_uuid, output_dir)
+    if answer_key is None:
+        raise HTTPException(status_code=404, detail="Quiz data not found")
+    
+    # Một query IN cho tất cả học sinh trong batch
+    submitted = await db_service.get_submitted_usernames(
+        request.quiz_uuid, {s.student_username for s in request.submissions}
+    )
+    submitted |= result_writer.pending_usernames(request.quiz_uuid)
+    
+    ip_address = client_request.client.host
+    results: List[BatchSubmissionResult] = []
+    rows: List[Dict[str, Any]] = []
+    seen = set()
+    for submission in request.submissions:
+        username = submission.student_username
+        if username in submitted:
+            results.append(BatchSubmissionResult(student_username=username, status="error", error="test.submittedBefore"))
+            continue
+        if username in seen:
+            results.append(BatchSubmissionResult(student_username=username, status="error", error="test.duplicateInBatch"))
+            continue
+        seen.add(username)
+        
+        response, exam_result = grade_submission(submission, answer_key)
+        rows.append({"test_exam_uuid": request.quiz_uuid, "ip_address": ip_address, **exam_result})
+        results.append(BatchSubmissionResult(student_username=username, status="saved", result=response))
+    
+    try:
+        if result_writer.enabled:
+            accepted = await run_in_threadpool(result_writer.submit_many, rows)
+            # Bị từ chối nếu cùng học sinh vừa nộp qua request khác
+            rejected = {row["student_username"] for row, ok in zip(rows, accepted) if not ok}
+            for item in results:
+                if item.status == "saved" and item.student_username in rejected:
+                    item.status, item.result, item.error = "error", None, "test.submittedBefore"
+        else:
+            await db_service.create_exam_results_bulk(rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save results: {str(e)}")
+    
+    saved = sum(1 for item in results if item.status == "saved")
+    return BatchCheckAnswersResponse(
+        quiz_uuid=request.quiz_uuid,
+        saved=saved,
+        failed=len(results) - saved,
+        results=results
+    )
+
 @router.post("/quiz/cancel-exam")
 async def cancel_exam(
     request: CancelExamRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Cancel exam submission due to security violations"""
     try:
@@ -300,15 +450,15 @@ async def cancel_exam(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     
     # Check if exam room exists
-    exam_room = db_service.get_test_exam_room_by_uuid(request.quiz_uuid)
+    exam_room = await db_service.get_test_exam_room_by_uuid(request.quiz_uuid)
     if not exam_room:
         raise HTTPException(status_code=404, detail="Exam room not found")
     
     # Cancel exam
-    result = db_service.cancel_exam_submission(
+    result = await db_service.cancel_exam_submission(
         request.quiz_uuid, 
         request.student_username, 
         request.reason
@@ -319,71 +469,204 @@ async def cancel_exam(
     else:
         return {"message": "No submission found to cancel", "status": "not_found"}
 
+def parse_include(include: str) -> List[str]:
+    """Validate a comma-separated list of JSON result columns, in canonical order"""
+    names = {name.strip() for name in include.split(",") if name.strip()}
+    if names - set(RESULT_JSON_COLUMNS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"include must be a comma-separated subset of: {', '.join(RESULT_JSON_COLUMNS)}"
+        )
+    return [name for name in RESULT_JSON_COLUMNS if name in names]
+
+def encode_cursor(row) -> str:
+    """Opaque page cursor: the (completed_at, id) of the last row returned"""
+    raw = json.dumps([row.completed_at.isoformat() if row.completed_at else None, row.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        completed_at, result_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(completed_at), int(result_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def result_row_dict(row, include: List[str]) -> Dict[str, Any]:
+    data = {field: getattr(row, field) for field in RESULT_FIELDS}
+    for name in include:
+        data[name] = getattr(row, name)
+    return data
+
 @router.get("/quiz/{quiz_uuid}/results")
-async def get_exam_results(quiz_uuid: str, db: Session = Depends(get_db)):
-    """Get all exam results for a quiz from database"""
+async def get_exam_results(
+    quiz_uuid: str,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    include: str = "suspicious_activity",
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
+    """Get exam results for a quiz, oldest submission first.
+
+    Without limit all results are returned. With limit, results are paged by
+    (completed_at, id); pass next_cursor back as cursor for the next page.
+    include selects the JSON columns to return (suspicious_activity, activity_log).
+    """
     try:
         uuid.UUID(quiz_uuid)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
-    results = db_service.get_exam_results_by_uuid(quiz_uuid)
+    include_columns = parse_include(include)
+    if limit is not None:
+        limit = min(limit, RESULTS_MAX_PAGE_SIZE)
+    after = decode_cursor(cursor) if cursor else None
+    
+    db_service = AsyncDatabaseService(db, read_db)
+    rows = await db_service.get_exam_results_page(quiz_uuid, include_columns, limit=limit, after=after)
+    if limit is None:
+        total_submissions = len(rows)
+    else:
+        total_submissions = await db_service.count_exam_results(quiz_uuid)
     
     return {
         "exam_uuid": quiz_uuid,
-        "total_submissions": len(results),
-        "results": [
-            {
-                "student_username": result.student_username,
-                "score_percentage": result.score_percentage,
-                "correct_answers": result.correct_answers,
-                "total_questions": result.total_questions,
-                "completed_at": result.completed_at,
-                "ip_address": result.ip_address,
-                "cheating_detected": result.cheating_detected,
-                "cheating_reason": result.cheating_reason,
-                "exam_cancelled": result.exam_cancelled,
-                "security_violation_detected": result.security_violation_detected,
-                "suspicious_activity": result.suspicious_activity
-            }
-            for result in results
-        ]
+        "total_submissions": total_submissions,
+        "results": [result_row_dict(row, include_columns) for row in rows],
+        "next_cursor": encode_cursor(rows[-1]) if limit is not None and len(rows) == limit else None
     }
 
+@router.get("/quiz/{quiz_uuid}/results/export")
+async def export_exam_results(
+    quiz_uuid: str,
+    format: str = "ndjson",
+    include: str = "",
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
+    """Stream all results of a quiz as NDJSON or CSV without loading them all in memory"""
+    try:
+        uuid.UUID(quiz_uuid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be one of: ndjson, csv")
+    include_columns = parse_include(include)
+    
+    exam_room = await AsyncDatabaseService(db, read_db).get_test_exam_room_by_uuid(quiz_uuid)
+    if not exam_room:
+        raise HTTPException(status_code=404, detail="Exam room not found")
+    
+    async def ndjson_lines(rows: AsyncIterator) -> AsyncIterator[str]:
+        async for row in rows:
+            data = result_row_dict(row, include_columns)
+            if data["completed_at"] is not None:
+                data["completed_at"] = data["completed_at"].isoformat()
+            yield json.dumps(data, ensure_ascii=False) + "\n"
+    
+    async def csv_lines(rows: AsyncIterator) -> AsyncIterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(RESULT_FIELDS + include_columns)
+        async for row in rows:
+            data = result_row_dict(row, include_columns)
+            if data["completed_at"] is not None:
+                data["completed_at"] = data["completed_at"].isoformat()
+            for name in include_columns:
+                data[name] = json.dumps(data[name], ensure_ascii=False) if data[name] is not None else ""
+            writer.writerow(data.values())
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    async def body() -> AsyncIterator[str]:
+        # Session riêng: session của dependency có thể đã đóng khi response được stream
+        async with AsyncSessionLocal() as stream_db:
+            stream_read_db = AsyncReplicaSessionLocal() if AsyncReplicaSessionLocal is not None else None
+            try:
+                rows = AsyncDatabaseService(stream_db, stream_read_db).stream_exam_results(quiz_uuid, include_columns)
+                lines = csv_lines(rows) if format == "csv" else ndjson_lines(rows)
+                async for line in lines:
+                    yield line
+            finally:
+                if stream_read_db is not None:
+                    await stream_read_db.close()
+    
+    if format == "csv":
+        return StreamingResponse(
+            body(), media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="results-{quiz_uuid}.csv"'}
+        )
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 @router.get("/quiz/{quiz_uuid}/{student_username}/results")
-async def get_student_exam_result(quiz_uuid: str, student_username: str, db: Session = Depends(get_db)):
+async def get_student_exam_result(
+    quiz_uuid: str,
+    student_username: str,
+    include: str = "suspicious_activity,activity_log",
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
     """Get a specific student's exam result for a quiz from database"""
     try:
         uuid.UUID(quiz_uuid)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
-    result = db_service.get_student_exam_result(quiz_uuid, student_username)
+    include_columns = parse_include(include)
+    db_service = AsyncDatabaseService(db, read_db)
+    result = await db_service.get_student_exam_result_row(quiz_uuid, student_username, include_columns)
     
     if not result:
         raise HTTPException(status_code=404, detail="Exam result not found")
     
-    return {
-        "student_username": result.student_username,
-        "score_percentage": result.score_percentage,
-        "correct_answers": result.correct_answers,
-        "total_questions": result.total_questions,
-        "completed_at": result.completed_at,
-        "ip_address": result.ip_address,
-        "cheating_detected": result.cheating_detected,
-        "cheating_reason": result.cheating_reason,
-        "exam_cancelled": result.exam_cancelled,
-        "security_violation_detected": result.security_violation_detected,
-        "suspicious_activity": result.suspicious_activity,
-        "activity_log": result.activity_log
-    }
+    return result_row_dict(result, include_columns)
+
+@router.get("/quiz/{quiz_uuid}/analytics")
+async def get_exam_analytics(
+    quiz_uuid: str,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
+    """Item analysis of a quiz: per-question correct rate, option counts,
+    discrimination index and the score histogram.
+
+    Computed with NumPy over the stored per-question answers and cached until
+    a result is added or removed.
+    """
+    try:
+        uuid.UUID(quiz_uuid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    
+    db_service = AsyncDatabaseService(db, read_db)
+    exam_room = await db_service.get_test_exam_room_by_uuid(quiz_uuid)
+    if not exam_room:
+        raise HTTPException(status_code=404, detail="Exam room not found")
+    
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    answer_key = quiz_cache.get_answer_key(quiz_uuid, os.path.join(project_root, "outputs", quiz_uuid))
+    if answer_key is None:
+        raise HTTPException(status_code=404, detail="Quiz data not found")
+    
+    signature = await db_service.get_results_signature(quiz_uuid)
+    analytics = analytics_cache.get(quiz_uuid, signature, answer_key)
+    if analytics is None:
+        rows = await db_service.get_result_answers(quiz_uuid)
+        packed = [answers for answers, _ in rows if answers]
+        scores = [score for _, score in rows]
+        # Tính toán NumPy ngoài event loop
+        analytics = await run_in_threadpool(compute_item_analytics, answer_key, packed, scores)
+        analytics_cache.put(quiz_uuid, signature, answer_key, analytics)
+    
+    return {"exam_uuid": quiz_uuid, **analytics}
 
 @router.post("/quiz/start-timer", response_model=StartExamTimerResponse)
 async def start_exam_timer(
     request: StartExamTimerRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Start exam timer - records when student starts taking the exam. Returns existing timer if already exists."""
     try:
@@ -391,10 +674,10 @@ async def start_exam_timer(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
+    db_service = AsyncDatabaseService(db)
     
     # Check if exam room exists
-    exam_room = db_service.get_test_exam_room_by_uuid(request.uuid_exam)
+    exam_room = await db_service.get_test_exam_room_by_uuid(request.uuid_exam)
     if not exam_room:
         raise HTTPException(status_code=404, detail="Exam room not found")
     
@@ -405,7 +688,7 @@ async def start_exam_timer(
         raise HTTPException(status_code=400, detail="Invalid datetime format. Use ISO format (e.g., '2025-01-10T10:30:00Z' or '2025-01-10T10:30:00')")
     
     # Check if timer already exists for this user and exam
-    existing_timer = db_service.get_exam_timer(request.uuid_exam, request.username)
+    existing_timer = await db_service.get_exam_timer(request.uuid_exam, request.username)
     
     if existing_timer:
         # Return existing timer
@@ -419,7 +702,7 @@ async def start_exam_timer(
         )
     
     # Create new exam timer record with time_start from frontend
-    exam_timer = db_service.create_exam_timer(
+    exam_timer = await db_service.create_exam_timer(
         uuid_exam=request.uuid_exam,
         username=request.username,
         time_start=time_start
@@ -435,15 +718,20 @@ async def start_exam_timer(
     )
 
 @router.get("/quiz/{quiz_uuid}/timer/{username}")
-async def get_exam_timer(quiz_uuid: str, username: str, db: Session = Depends(get_db)):
+async def get_exam_timer(
+    quiz_uuid: str,
+    username: str,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: Optional[AsyncSession] = Depends(get_async_read_db)
+):
     """Get exam timer information for a specific user"""
     try:
         uuid.UUID(quiz_uuid)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     
-    db_service = DatabaseService(db)
-    exam_timer = db_service.get_exam_timer(quiz_uuid, username)
+    db_service = AsyncDatabaseService(db, read_db)
+    exam_timer = await db_service.get_exam_timer(quiz_uuid, username)
     
     if not exam_timer:
         raise HTTPException(status_code=404, detail="Exam timer not found")
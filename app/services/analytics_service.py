@@ -0,0 +1,140 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Ký tự cho câu không trả lời trong chuỗi đáp án đã pack
+BLANK = "-"
+
+# Tỉ lệ nhóm giỏi / nhóm yếu cho chỉ số phân biệt (Kelley, 27%)
+DISCRIMINATION_GROUP = 0.27
+
+HISTOGRAM_BINS = 10
+
+
+def pack_answers(answer_key: Mapping[int, str], selected: Mapping[int, str]) -> str:
+    """One character per question, in answer key order: the chosen label or BLANK.
+
+    selected maps question_id -> option label as submitted. Answers to
+    question ids that are not in the key are dropped.
+    """
+    packed = []
+    for question_id in answer_key:
+        label = (selected.get(question_id) or "").strip()[:1].upper()
+        packed.append(label if label.isalpha() and label.isascii() else BLANK)
+    return "".join(packed)
+
+
+def answer_matrix(packed_answers: Sequence[str], question_count: int) -> np.ndarray:
+    """(students x questions) uint8 matrix of answer characters"""
+    if not packed_answers or not question_count:
+        return np.zeros((len(packed_answers), question_count), dtype=np.uint8)
+    # Chuỗi lệch độ dài (answer key đổi sau khi nộp) được cắt / đệm BLANK
+    rows = [row[:question_count].ljust(question_count, BLANK) for row in packed_answers]
+    return np.frombuffer("".join(rows).encode("ascii"), dtype=np.uint8).reshape(len(rows), question_count)
+
+
+def compute_item_analytics(
+    answer_key: Mapping[int, str],
+    packed_answers: Sequence[str],
+    scores: Sequence[float]
+) -> Dict[str, Any]:
+    """Item analysis of one exam.
+
+    packed_answers holds the pack_answers() string of every result that has
+    one; scores holds score_percentage of all results (older results without
+    stored answers still count in the histogram).
+    """
+    question_ids = list(answer_key)
+    key = np.array([ord((answer_key[qid] or BLANK)[:1].upper()) for qid in question_ids], dtype=np.uint8)
+    matrix = answer_matrix(packed_answers, len(question_ids))
+    students = matrix.shape[0]
+
+    correct = matrix == key  # broadcast theo từng cột
+    has_key = key != ord(BLANK)
+    correct &= has_key
+    totals = correct.sum(axis=1)
+
+    correct_rate = correct.mean(axis=0) if students else np.zeros(len(question_ids))
+
+    # Chỉ số phân biệt: tỉ lệ đúng của 27% điểm cao nhất trừ 27% điểm thấp nhất
+    discrimination = np.full(len(question_ids), np.nan)
+    group = int(round(students * DISCRIMINATION_GROUP))
+    if group >= 1 and students >= 2:
+        order = np.argsort(totals, kind="stable")
+        lower, upper = correct[order[:group]], correct[order[-group:]]
+        discrimination = upper.mean(axis=0) - lower.mean(axis=0)
+
+    labels = sorted({chr(c) for c in np.unique(matrix)} - {BLANK} | {
+        answer_key[qid][:1].upper() for qid in question_ids if answer_key[qid]
+    })
+    distribution = {label: (matrix == ord(label)).sum(axis=0) for label in labels}
+    blanks = (matrix == ord(BLANK)).sum(axis=0)
+
+    questions = []
+    for index, question_id in enumerate(question_ids):
+        questions.append({
+            "question_id": question_id,
+            "correct_option": answer_key[question_id] or None,
+            "correct_rate": round(float(correct_rate[index]), 4) if students and has_key[index] else None,
+            "discrimination_index": (
+                round(float(discrimination[index]), 4)
+                if has_key[index] and not np.isnan(discrimination[index]) else None
+            ),
+            "option_counts": {label: int(counts[index]) for label, counts in distribution.items()},
+            "blank_count": int(blanks[index]),
+        })
+
+    counts, edges = np.histogram(np.asarray(scores, dtype=float), bins=HISTOGRAM_BINS, range=(0, 100))
+    return {
+        "total_results": len(scores),
+        "results_with_answers": students,
+        "mean_score": round(float(np.mean(scores)), 2) if len(scores) else None,
+        "questions": questions,
+        "score_histogram": [
+            {"from": float(edges[i]), "to": float(edges[i + 1]), "count": int(counts[i])}
+            for i in range(HISTOGRAM_BINS)
+        ],
+    }
+
+
+# (số kết quả, id lớn nhất) của exam tại thời điểm tính
+ResultsSignature = Tuple[int, Optional[int]]
+
+
+class AnalyticsCache:
+    """Process-wide LRU cache of computed analytics, keyed by exam UUID.
+
+    An entry is reused only while the exam's (result count, max result id)
+    and answer key are unchanged, so a new submission from any worker
+    invalidates it.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[ResultsSignature, Dict[int, str], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, quiz_uuid: str, signature: ResultsSignature, answer_key: Dict[int, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(quiz_uuid)
+            if entry is None or entry[0] != signature or entry[1] != answer_key:
+                return None
+            self._entries.move_to_end(quiz_uuid)
+            return entry[2]
+
+    def put(self, quiz_uuid: str, signature: ResultsSignature, answer_key: Dict[int, str], analytics: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[quiz_uuid] = (signature, answer_key, analytics)
+            self._entries.move_to_end(quiz_uuid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, quiz_uuid: str) -> None:
+        with self._lock:
+            self._entries.pop(quiz_uuid, None)
+
+
+analytics_cache = AnalyticsCache(max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", "64")))
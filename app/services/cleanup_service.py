@@ -1,12 +1,21 @@
 import os
 import shutil
+import time
 from typing import List
 from sqlalchemy.orm import Session
 from app.models.database import SessionLocal, TestExamRoom
+from app.services.job_service import job_manager
+from app.services.content_store import content_store
+from app.utils import metrics
 
 class CleanupService:
     def __init__(self):
         self.outputs_dir = "outputs"
+        self.store_max_age_days = float(os.getenv("DOCX_STORE_MAX_AGE_DAYS", "30"))
+        # Must exceed the longest upload + conversion; other workers' jobs are not in job_manager
+        self.grace_seconds = float(os.getenv("OUTPUT_CLEANUP_GRACE_SECONDS", "3600"))
+        # temp.docx is removed once processing ends, so an old one was left by a killed worker
+        self.abandoned_upload_seconds = max(self.grace_seconds, 86400)
 
     def get_db_uuids(self, db: Session) -> List[str]:
         """Get all UUIDs from TestExamRoom table"""
@@ -17,19 +26,44 @@ class CleanupService:
         """Get all folder names in outputs directory"""
         if not os.path.exists(self.outputs_dir):
             return []
-        return [f for f in os.listdir(self.outputs_dir) if os.path.isdir(os.path.join(self.outputs_dir, f))]
+        # Hidden folders (e.g. the .store content store) are not exam outputs
+        return [
+            f for f in os.listdir(self.outputs_dir)
+            if os.path.isdir(os.path.join(self.outputs_dir, f)) and not f.startswith(".")
+        ]
+
+    def is_in_use(self, folder: str, now: float) -> bool:
+        """True while an upload may still be writing or converting in this folder"""
+        folder_path = os.path.join(self.outputs_dir, folder)
+        try:
+            with os.scandir(folder_path) as entries:
+                mtimes = {e.name: e.stat(follow_symlinks=False).st_mtime for e in entries}
+            mtimes["."] = os.stat(folder_path).st_mtime
+        except FileNotFoundError:
+            return True
+        if now - max(mtimes.values()) < self.grace_seconds:
+            return True
+        return "temp.docx" in mtimes and now - mtimes["temp.docx"] < self.abandoned_upload_seconds
 
     def cleanup_extra_folders(self):
         """Check and delete folders that don't have corresponding UUID in database"""
+        with metrics.cleanup_job("cleanup_extra_folders"):
+            self._cleanup_extra_folders()
+
+    def _cleanup_extra_folders(self):
         db = SessionLocal()
         try:
             db_uuids = set(self.get_db_uuids(db))
             output_folders = set(self.get_output_folders())
             
             # Find folders that exist in outputs but not in db
-            extra_folders = output_folders - db_uuids
+            # (skip uploads whose background job has not created the room yet)
+            extra_folders = output_folders - db_uuids - set(job_manager.active_uuids())
             
+            now = time.time()
             for folder in extra_folders:
+                if self.is_in_use(folder, now):
+                    continue
                 folder_path = os.path.join(self.outputs_dir, folder)
                 try:
                     shutil.rmtree(folder_path)
@@ -38,4 +72,9 @@ class CleanupService:
                     print(f"Error deleting folder {folder_path}: {e}")
                     
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+        # Drop stored results of DOCX files nobody re-uploaded for a while
+        removed = content_store.prune(self.store_max_age_days * 86400)
+        if removed:
+            print(f"Pruned {removed} content store entries")
\ No newline at end of file
@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StoredResult(NamedTuple):
+    questions: List[Dict[str, Any]]  # Questions before image URLs are resolved (src = media filename)
+    images_map: Dict[str, str]
+    media_dir: str
+
+
+class ContentStore:
+    """Processed DOCX results keyed by the SHA-256 of the uploaded file.
+
+    Each entry holds the parsed questions (image srcs still bare filenames)
+    plus the converted media/. A repeat upload hard-links that media into the
+    new exam folder and only has to rewrite the image URLs. Keep the store on
+    the same filesystem as outputs/ so hard links work; otherwise files are
+    copied.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def lookup(self, key: str) -> Optional[StoredResult]:
+        entry_dir = self._entry_dir(key)
+        parsed_path = os.path.join(entry_dir, "parsed.json")
+        try:
+            with open(parsed_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable content store entry %s: %s", key, exc)
+            return None
+        # Đánh dấu entry vừa được dùng (phục vụ prune theo tuổi)
+        os.utime(entry_dir)
+        return StoredResult(
+            questions=data["questions"],
+            images_map=data["images_map"],
+            media_dir=os.path.join(entry_dir, "media"),
+        )
+
+    def save(self, key: str, questions: List[Dict[str, Any]], images_map: Dict[str, str], media_dir: str) -> None:
+        """Store a processed result. Concurrent saves of the same key are safe."""
+        if os.path.exists(self._entry_dir(key)):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = os.path.join(self.root, f".tmp-{key}-{uuid.uuid4().hex}")
+        try:
+            if os.path.isdir(media_dir):
+                self.link_tree(media_dir, os.path.join(tmp_dir, "media"))
+            else:
+                os.makedirs(os.path.join(tmp_dir, "media"))
+            with open(os.path.join(tmp_dir, "parsed.json"), "w", encoding="utf-8") as f:
+                json.dump({"questions": questions, "images_map": images_map}, f, ensure_ascii=False)
+            # rename là atomic: người đọc chỉ thấy entry đầy đủ hoặc không thấy gì
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError as exc:
+            if not os.path.exists(self._entry_dir(key)):
+                logger.warning("Could not store processed DOCX %s: %s", key, exc)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def link_tree(src_dir: str, dest_dir: str) -> None:
+        """Hard-link every file of src_dir into dest_dir, copying when linking fails"""
+        os.makedirs(dest_dir, exist_ok=True)
+        for filename in os.listdir(src_dir):
+            src = os.path.join(src_dir, filename)
+            if not os.path.isfile(src):
+                continue
+            dest = os.path.join(dest_dir, filename)
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copy2(src, dest)
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Remove entries not used for max_age_seconds. Returns the number removed."""
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            try:
+                if os.path.isdir(entry_dir) and os.path.getmtime(entry_dir) < cutoff:
+                    shutil.rmtree(entry_dir)
+                    removed += 1
+            except OSError as exc:
+                logger.warning("Could not prune content store entry %s: %s", entry_dir, exc)
+        return removed
+
+
+content_store = ContentStore(os.getenv("DOCX_STORE_DIR", os.path.join("outputs", ".store")))
@@ -1,12 +1,68 @@
+from sqlalchemy import select, delete, insert, and_, func, or_
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
-from app.models.database import TestExamRoom, ExamResult, ExamTimer
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Iterable, List, Optional, Dict, Any, Sequence, Set, Tuple
+from app.models.database import TestExamRoom, ExamResult, ExamTimer, recent_writes
+from app.services.quiz_cache import quiz_cache
+from app.services.exam_room_cache import ExamRoomSnapshot, exam_room_cache
+from app.services.analytics_service import ResultsSignature, analytics_cache
+from app.utils.metrics import timed_query
 from datetime import datetime
 
+# Cột trả về trong danh sách kết quả; các cột JSON (có thể rất lớn) chỉ được
+# select khi được yêu cầu
+RESULT_SUMMARY_COLUMNS = (
+    ExamResult.id,
+    ExamResult.student_username,
+    ExamResult.score_percentage,
+    ExamResult.correct_answers,
+    ExamResult.total_questions,
+    ExamResult.completed_at,
+    ExamResult.ip_address,
+    ExamResult.cheating_detected,
+    ExamResult.cheating_reason,
+    ExamResult.exam_cancelled,
+    ExamResult.security_violation_detected,
+)
+RESULT_JSON_COLUMNS = {
+    "suspicious_activity": ExamResult.suspicious_activity,
+    "activity_log": ExamResult.activity_log,
+}
+
+def exam_results_query(test_exam_uuid: str, include: Sequence[str] = ()):
+    """SELECT of the summary columns plus the requested JSON columns, in (completed_at, id) order"""
+    columns = list(RESULT_SUMMARY_COLUMNS) + [RESULT_JSON_COLUMNS[name] for name in include]
+    return select(*columns).where(ExamResult.test_exam_uuid == test_exam_uuid).order_by(
+        ExamResult.completed_at, ExamResult.id
+    )
+
 class DatabaseService:
-    def __init__(self, db: Session):
+    """Database operations on the primary session db.
+
+    With read_db (a replica session), get_test_exam_room_by_uuid,
+    get_exam_results_by_uuid, get_student_exam_result and get_exam_timer read
+    from the replica, except for exams this process wrote to recently
+    (read-your-writes). A single-row lookup that misses on the replica is
+    retried on the primary, since the row may not have replicated yet.
+    """
+
+    def __init__(self, db: Session, read_db: Optional[Session] = None):
         self.db = db
+        self.read_db = read_db
+
+    def _reader(self, test_exam_uuid: str) -> Session:
+        if self.read_db is None or recent_writes.is_recent(test_exam_uuid):
+            return self.db
+        return self.read_db
+
+    def _read_first(self, test_exam_uuid: str, model, *criteria):
+        reader = self._reader(test_exam_uuid)
+        row = reader.query(model).filter(*criteria).first()
+        if row is None and reader is not self.db:
+            row = self.db.query(model).filter(*criteria).first()
+        return row
     
+    @timed_query
     def create_test_exam_room(self, uuid: str, username: str, title: Optional[str] = None, time_limit: Optional[int] = None) -> TestExamRoom:
         """Create a new test exam room record"""
         db_exam_room = TestExamRoom(
@@ -17,13 +73,23 @@ class DatabaseService:
         )
         self.db.add(db_exam_room)
         self.db.commit()
+        recent_writes.mark(uuid)
+        exam_room_cache.invalidate(uuid)
         self.db.refresh(db_exam_room)
         return db_exam_room
     
-    def get_test_exam_room_by_uuid(self, uuid: str) -> Optional[TestExamRoom]:
-        """Get test exam room by UUID"""
-        return self.db.query(TestExamRoom).filter(TestExamRoom.uuid == uuid).first()
+    @timed_query
+    def get_test_exam_room_by_uuid(self, uuid: str) -> Optional[ExamRoomSnapshot]:
+        """Get test exam room metadata by UUID (read-through exam_room_cache)"""
+        hit, room = exam_room_cache.get(uuid)
+        if hit:
+            return room
+        row = self._read_first(uuid, TestExamRoom, TestExamRoom.uuid == uuid)
+        room = ExamRoomSnapshot.from_row(row) if row is not None else None
+        exam_room_cache.put(uuid, room)
+        return room
     
+    @timed_query
     def create_exam_result(
         self, 
         test_exam_uuid: str, 
@@ -37,7 +103,8 @@ class DatabaseService:
         exam_cancelled: bool = False,
         security_violation_detected: bool = False,
         activity_log: Optional[List[Dict[str, Any]]] = None,
-        suspicious_activity: Optional[Dict[str, int]] = None
+        suspicious_activity: Optional[Dict[str, int]] = None,
+        answers: Optional[str] = None
     ) -> ExamResult:
         """Create a new exam result record with security information"""
         db_exam_result = ExamResult(
@@ -52,13 +119,43 @@ class DatabaseService:
             exam_cancelled=exam_cancelled,
             security_violation_detected=security_violation_detected,
             activity_log=activity_log,
-            suspicious_activity=suspicious_activity
+            suspicious_activity=suspicious_activity,
+            answers=answers
         )
         self.db.add(db_exam_result)
         self.db.commit()
+        recent_writes.mark(test_exam_uuid)
         self.db.refresh(db_exam_result)
         return db_exam_result
 
+    @timed_query
+    def get_submitted_usernames(self, test_exam_uuid: str, student_usernames: Iterable[str]) -> Set[str]:
+        """Which of student_usernames already submitted this test (one IN query)"""
+        student_usernames = list(student_usernames)
+        if not student_usernames:
+            return set()
+        rows = self.db.query(ExamResult.student_username).filter(
+            ExamResult.test_exam_uuid == test_exam_uuid,
+            ExamResult.student_username.in_(student_usernames)
+        ).all()
+        return {row.student_username for row in rows}
+
+    @timed_query
+    def create_exam_results_bulk(self, results: List[Dict[str, Any]]) -> int:
+        """Insert many exam result rows (ExamResult column dicts) in one transaction"""
+        if not results:
+            return 0
+        try:
+            self.db.execute(insert(ExamResult), results)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        for test_exam_uuid in {row["test_exam_uuid"] for row in results}:
+            recent_writes.mark(test_exam_uuid)
+        return len(results)
+
+    @timed_query
     def delete_test_exam_room(self, uuid: str, username: str) -> bool:
         """
         Delete test exam room and all related results
@@ -79,19 +176,27 @@ class DatabaseService:
         # Delete the exam room
         self.db.delete(exam_room)
         self.db.commit()
+        recent_writes.mark(uuid)
+        exam_room_cache.invalidate(uuid)
+        quiz_cache.invalidate(uuid)
+        analytics_cache.invalidate(uuid)
         return True
     
+    @timed_query
     def get_exam_results_by_uuid(self, test_exam_uuid: str) -> List[ExamResult]:
         """Get all exam results for a test"""
-        return self.db.query(ExamResult).filter(ExamResult.test_exam_uuid == test_exam_uuid).all()
+        return self._reader(test_exam_uuid).query(ExamResult).filter(ExamResult.test_exam_uuid == test_exam_uuid).all()
 
+    @timed_query
     def get_student_exam_result(self, test_exam_uuid: str, student_username: str) -> Optional[ExamResult]:
         """Get a specific student's exam result"""
-        return self.db.query(ExamResult).filter(
+        return self._read_first(
+            test_exam_uuid, ExamResult,
             ExamResult.test_exam_uuid == test_exam_uuid,
             ExamResult.student_username == student_username
-        ).first()
+        )
     
+    @timed_query
     def check_student_submitted(self, test_exam_uuid: str, student_username: str) -> bool:
         """Check if student already submitted"""
         result = self.db.query(ExamResult).filter(
@@ -100,6 +205,7 @@ class DatabaseService:
         ).first()
         return result is not None
     
+    @timed_query
     def cancel_exam_submission(self, test_exam_uuid: str, student_username: str, reason: str) -> Optional[ExamResult]:
         """Cancel/mark exam as cancelled for security reasons"""
         result = self.db.query(ExamResult).filter(
@@ -112,10 +218,12 @@ class DatabaseService:
             result.cheating_detected = True
             result.cheating_reason = reason
             self.db.commit()
+            recent_writes.mark(test_exam_uuid)
             self.db.refresh(result)
         
         return result
     
+    @timed_query
     def create_exam_timer(self, uuid_exam: str, username: str, time_start: datetime) -> ExamTimer:
         """Create a new exam timer record with time_start from frontend"""
         db_exam_timer = ExamTimer(
@@ -125,19 +233,313 @@ class DatabaseService:
         )
         self.db.add(db_exam_timer)
         self.db.commit()
+        recent_writes.mark(uuid_exam)
         self.db.refresh(db_exam_timer)
         return db_exam_timer
     
+    @timed_query
     def get_exam_timer(self, uuid_exam: str, username: str) -> Optional[ExamTimer]:
         """Get exam timer by exam UUID and username"""
-        return self.db.query(ExamTimer).filter(
+        return self._read_first(
+            uuid_exam, ExamTimer,
             ExamTimer.uuid_exam == uuid_exam,
             ExamTimer.username == username
-        ).first()
+        )
     
+    @timed_query
     def get_or_create_exam_timer(self, uuid_exam: str, username: str, time_start: datetime) -> ExamTimer:
         """Get existing exam timer or create new one if not exists"""
         existing_timer = self.get_exam_timer(uuid_exam, username)
         if existing_timer:
             return existing_timer
-        return self.create_exam_timer(uuid_exam, username, time_start)
\ No newline at end of file
+        return self.create_exam_timer(uuid_exam, username, time_start)
+
+
+class AsyncDatabaseService:
+    """Same operations as DatabaseService on an AsyncSession, for async route handlers.
+
+    read_db routes reads to a replica the same way as in DatabaseService.
+    """
+
+    def __init__(self, db: AsyncSession, read_db: Optional[AsyncSession] = None):
+        self.db = db
+        self.read_db = read_db
+
+    def _reader(self, test_exam_uuid: str) -> AsyncSession:
+        if self.read_db is None or recent_writes.is_recent(test_exam_uuid):
+            return self.db
+        return self.read_db
+
+    async def _read_first(self, test_exam_uuid: str, statement):
+        reader = self._reader(test_exam_uuid)
+        row = (await reader.execute(statement)).scalars().first()
+        if row is None and reader is not self.db:
+            # Replica có thể chưa nhận bản ghi vừa ghi (ở worker khác)
+            row = (await self.db.execute(statement)).scalars().first()
+        return row
+    
+    @timed_query
+    async def create_test_exam_room(self, uuid: str, username: str, title: Optional[str] = None, time_limit: Optional[int] = None) -> TestExamRoom:
+        """Create a new test exam room record"""
+        db_exam_room = TestExamRoom(
+            uuid=uuid,
+            username=username,
+            title=title,
+            time_limit=time_limit
+        )
+        self.db.add(db_exam_room)
+        await self.db.commit()
+        recent_writes.mark(uuid)
+        exam_room_cache.invalidate(uuid)
+        await self.db.refresh(db_exam_room)
+        return db_exam_room
+    
+    @timed_query
+    async def get_test_exam_room_by_uuid(self, uuid: str) -> Optional[ExamRoomSnapshot]:
+        """Get test exam room metadata by UUID (read-through exam_room_cache)"""
+        hit, room = exam_room_cache.get(uuid)
+        if hit:
+            return room
+        row = await self._read_first(uuid, select(TestExamRoom).where(TestExamRoom.uuid == uuid).limit(1))
+        room = ExamRoomSnapshot.from_row(row) if row is not None else None
+        exam_room_cache.put(uuid, room)
+        return room
+    
+    @timed_query
+    async def create_exam_result(
+        self, 
+        test_exam_uuid: str, 
+        student_username: str, 
+        total_questions: int, 
+        correct_answers: int, 
+        score_percentage: float, 
+        ip_address: Optional[str] = None,
+        cheating_detected: bool = False,
+        cheating_reason: Optional[str] = None,
+        exam_cancelled: bool = False,
+        security_violation_detected: bool = False,
+        activity_log: Optional[List[Dict[str, Any]]] = None,
+        suspicious_activity: Optional[Dict[str, int]] = None,
+        answers: Optional[str] = None
+    ) -> ExamResult:
+        """Create a new exam result record with security information"""
+        db_exam_result = ExamResult(
+            test_exam_uuid=test_exam_uuid,
+            student_username=student_username,
+            total_questions=total_questions,
+            correct_answers=correct_answers,
+            score_percentage=score_percentage,
+            ip_address=ip_address,
+            cheating_detected=cheating_detected,
+            cheating_reason=cheating_reason,
+            exam_cancelled=exam_cancelled,
+            security_violation_detected=security_violation_detected,
+            activity_log=activity_log,
+            suspicious_activity=suspicious_activity,
+            answers=answers
+        )
+        self.db.add(db_exam_result)
+        await self.db.commit()
+        recent_writes.mark(test_exam_uuid)
+        await self.db.refresh(db_exam_result)
+        return db_exam_result
+
+    @timed_query
+    async def get_submitted_usernames(self, test_exam_uuid: str, student_usernames: Iterable[str]) -> Set[str]:
+        """Which of student_usernames already submitted this test (one IN query)"""
+        student_usernames = list(student_usernames)
+        if not student_usernames:
+            return set()
+        result = await self.db.execute(select(ExamResult.student_username).where(
+            ExamResult.test_exam_uuid == test_exam_uuid,
+            ExamResult.student_username.in_(student_usernames)
+        ))
+        return set(result.scalars().all())
+
+    @timed_query
+    async def create_exam_results_bulk(self, results: List[Dict[str, Any]]) -> int:
+        """Insert many exam result rows (ExamResult column dicts) in one transaction"""
+        if not results:
+            return 0
+        try:
+            await self.db.execute(insert(ExamResult), results)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        for test_exam_uuid in {row["test_exam_uuid"] for row in results}:
+            recent_writes.mark(test_exam_uuid)
+        return len(results)
+
+    @timed_query
+    async def delete_test_exam_room(self, uuid: str, username: str) -> bool:
+        """
+        Delete test exam room and all related results
+        Only owner (username) can delete
+        Returns True if deleted, False if not found or unauthorized
+        """
+        result = await self.db.execute(select(TestExamRoom).where(
+            TestExamRoom.uuid == uuid,
+            TestExamRoom.username == username  # Verify ownership
+        ).limit(1))
+        exam_room = result.scalars().first()
+        
+        if not exam_room:
+            return False
+        
+        # Delete all related exam results first (cascade should handle this, but explicit is better)
+        await self.db.execute(delete(ExamResult).where(ExamResult.test_exam_uuid == uuid))
+        
+        # Delete the exam room
+        await self.db.delete(exam_room)
+        await self.db.commit()
+        recent_writes.mark(uuid)
+        exam_room_cache.invalidate(uuid)
+        quiz_cache.invalidate(uuid)
+        analytics_cache.invalidate(uuid)
+        return True
+    
+    @timed_query
+    async def get_exam_results_by_uuid(self, test_exam_uuid: str) -> List[ExamResult]:
+        """Get all exam results for a test"""
+        result = await self._reader(test_exam_uuid).execute(
+            select(ExamResult).where(ExamResult.test_exam_uuid == test_exam_uuid)
+        )
+        return list(result.scalars().all())
+
+    @timed_query
+    async def get_exam_results_page(
+        self,
+        test_exam_uuid: str,
+        include: Sequence[str] = (),
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, int]] = None
+    ) -> List[Any]:
+        """Projected result rows in (completed_at, id) order.
+
+        include names the JSON columns to load (see RESULT_JSON_COLUMNS).
+        after is the (completed_at, id) of the last row of the previous page
+        (keyset pagination: no OFFSET scan).
+        """
+        statement = exam_results_query(test_exam_uuid, include)
+        if after is not None:
+            completed_at, result_id = after
+            statement = statement.where(or_(
+                ExamResult.completed_at > completed_at,
+                and_(ExamResult.completed_at == completed_at, ExamResult.id > result_id)
+            ))
+        if limit is not None:
+            statement = statement.limit(limit)
+        result = await self._reader(test_exam_uuid).execute(statement)
+        return list(result.all())
+
+    @timed_query
+    async def count_exam_results(self, test_exam_uuid: str) -> int:
+        result = await self._reader(test_exam_uuid).execute(
+            select(func.count()).select_from(ExamResult).where(ExamResult.test_exam_uuid == test_exam_uuid)
+        )
+        return result.scalar_one()
+
+    @timed_query
+    async def get_results_signature(self, test_exam_uuid: str) -> ResultsSignature:
+        """(result count, max result id): changes whenever a result is added or removed"""
+        result = await self._reader(test_exam_uuid).execute(
+            select(func.count(), func.max(ExamResult.id)).where(ExamResult.test_exam_uuid == test_exam_uuid)
+        )
+        count, max_id = result.one()
+        return count, max_id
+
+    @timed_query
+    async def get_result_answers(self, test_exam_uuid: str) -> List[Tuple[Optional[str], float]]:
+        """(packed answers, score_percentage) of every result of a test"""
+        result = await self._reader(test_exam_uuid).execute(
+            select(ExamResult.answers, ExamResult.score_percentage).where(ExamResult.test_exam_uuid == test_exam_uuid)
+        )
+        return [tuple(row) for row in result.all()]
+
+    async def stream_exam_results(self, test_exam_uuid: str, include: Sequence[str] = (), batch_size: int = 500) -> AsyncIterator[Any]:
+        """Yield projected result rows from a server-side cursor, batch_size rows at a time"""
+        statement = exam_results_query(test_exam_uuid, include).execution_options(yield_per=batch_size)
+        result = await self._reader(test_exam_uuid).stream(statement)
+        async for row in result:
+            yield row
+
+    @timed_query
+    async def get_student_exam_result_row(
+        self, test_exam_uuid: str, student_username: str, include: Sequence[str] = ()
+    ) -> Optional[Any]:
+        """Projected result row of one student (JSON columns only if included)"""
+        statement = exam_results_query(test_exam_uuid, include).where(
+            ExamResult.student_username == student_username
+        ).limit(1)
+        reader = self._reader(test_exam_uuid)
+        row = (await reader.execute(statement)).first()
+        if row is None and reader is not self.db:
+            row = (await self.db.execute(statement)).first()
+        return row
+
+    @timed_query
+    async def get_student_exam_result(self, test_exam_uuid: str, student_username: str) -> Optional[ExamResult]:
+        """Get a specific student's exam result"""
+        return await self._read_first(test_exam_uuid, select(ExamResult).where(
+            ExamResult.test_exam_uuid == test_exam_uuid,
+            ExamResult.student_username == student_username
+        ).limit(1))
+    
+    @timed_query
+    async def check_student_submitted(self, test_exam_uuid: str, student_username: str) -> bool:
+        """Check if student already submitted"""
+        result = await self.db.execute(select(ExamResult.id).where(
+            ExamResult.test_exam_uuid == test_exam_uuid,
+            ExamResult.student_username == student_username
+        ).limit(1))
+        return result.first() is not None
+    
+    @timed_query
+    async def cancel_exam_submission(self, test_exam_uuid: str, student_username: str, reason: str) -> Optional[ExamResult]:
+        """Cancel/mark exam as cancelled for security reasons"""
+        # Luôn đọc từ primary: bản ghi sẽ được sửa trong session này
+        result = (await self.db.execute(select(ExamResult).where(
+            ExamResult.test_exam_uuid == test_exam_uuid,
+            ExamResult.student_username == student_username
+        ).limit(1))).scalars().first()
+        
+        if result:
+            result.exam_cancelled = True
+            result.cheating_detected = True
+            result.cheating_reason = reason
+            await self.db.commit()
+            recent_writes.mark(test_exam_uuid)
+            await self.db.refresh(result)
+        
+        return result
+    
+    @timed_query
+    async def create_exam_timer(self, uuid_exam: str, username: str, time_start: datetime) -> ExamTimer:
+        """Create a new exam timer record with time_start from frontend"""
+        db_exam_timer = ExamTimer(
+            uuid_exam=uuid_exam,
+            username=username,
+            time_start=time_start
+        )
+        self.db.add(db_exam_timer)
+        await self.db.commit()
+        recent_writes.mark(uuid_exam)
+        await self.db.refresh(db_exam_timer)
+        return db_exam_timer
+    
+    @timed_query
+    async def get_exam_timer(self, uuid_exam: str, username: str) -> Optional[ExamTimer]:
+        """Get exam timer by exam UUID and username"""
+        return await self._read_first(uuid_exam, select(ExamTimer).where(
+            ExamTimer.uuid_exam == uuid_exam,
+            ExamTimer.username == username
+        ).limit(1))
+    
+    @timed_query
+    async def get_or_create_exam_timer(self, uuid_exam: str, username: str, time_start: datetime) -> ExamTimer:
+        """Get existing exam timer or create new one if not exists"""
+        existing_timer = await self.get_exam_timer(uuid_exam, username)
+        if existing_timer:
+            return existing_timer
+        return await self.create_exam_timer(uuid_exam, username, time_start)
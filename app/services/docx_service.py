@@ -1,19 +1,94 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
+import concurrent.futures
+import contextvars
+import hashlib
 import json
 import os
 import re
 import pypandoc
 import shutil
+import tempfile
+import zipfile
 from docx import Document
 import aiofiles
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from app.utils.image_utils import ImageUtils
+from app.services.quiz_cache import ANSWER_KEY_FILE, PUBLIC_QUESTIONS_FILE, dump_answer_key, dump_public_questions, quiz_cache
+from app.services.content_store import content_store
+from app.services.native_docx_parser import NativeDocxParser
+from app.utils import metrics
+from app.utils.precompress import write_precompressed
+from app.utils.static_files import VERSION_PARAM, content_version
+from app.utils.lazy_images import lazy_images, mark_lazy, planned_images_map
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Giới hạn upload và kiểm tra zip bomb (MB)
+MAX_UPLOAD_BYTES = int(float(os.getenv("DOCX_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+MAX_UNCOMPRESSED_BYTES = int(float(os.getenv("DOCX_MAX_UNCOMPRESSED_MB", "500")) * 1024 * 1024)
+MAX_ZIP_ENTRIES = 10000
+# Các part bắt buộc của một file .docx (OOXML)
+REQUIRED_DOCX_PARTS = ("[Content_Types].xml", "word/document.xml")
+
+# Tăng khi thay đổi pipeline làm output khác đi, để không dùng lại kết quả cũ
+PIPELINE_VERSION = 2
+
+PARSER_ENGINES = ("pandoc", "native")
+
+# Các pattern được compile một lần. Lookahead (?=...) đầu pattern cho phép
+# regex engine bỏ qua nhanh các vị trí không thể khớp.
+# "Câu 1." hoặc "Câu 1:", có thể được bọc trong \textbf{}
+_QUESTION_HEADER = re.compile(r'(?=[\\C])(?:\\textbf\{)?Câu\s+\d+[\.:](?:\})?')
+_LATEX_NOISE = re.compile(
+    r'\\(?:begin\{quote\}|end\{quote\}|begin\{enumerate\}|end\{enumerate\}|item)'
+)
+# Bỏ sau khi đã tìm nhãn đáp án (như parser cũ), chỉ trong từng đoạn text
+_PANDOC_BOUNDED = r'\pandocbounded{'
+
+# Nhãn đáp án: (\textbf{|\ul{|\underline{)* [A-D]. }*
+_OPTION_LABEL = re.compile(r'(?=[\\A-D])((?:\\textbf\{|\\ul\{|\\underline\{)*)([A-D])\.\}*')
+_BLOCK_TOKEN = re.compile(
+    r'(?=[\\$])(?:'
+    r'\\includegraphics(?:\[.*?\])?\{([^}]+?)\}'  # image, relative or absolute path
+    r'|(\$.*?\$|\\\(.+?\\\)|\\\[.+?\\\])'  # math
+    r')',
+    re.DOTALL
+)
+
+def _strip_span(text: str, start: int, end: int):
+    """Bounds of text[start:end].strip() without copying the slice"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _append_text(blocks: List[Dict], txt: str):
+    txt = txt.strip()
+    # Bỏ "}" thừa do \pandocbounded{...} để lại
+    if txt.endswith('}') and not txt.count('{') > txt.count('}'):
+        txt = txt[:-1]
+    if txt:
+        blocks.append({"type": "text", "content": txt})
+
+
+class ImageVariant(BaseModel):
+    name: str  # "thumb", "mobile"
+    src: str
+    width: int
+    height: int
 
 class Block(BaseModel):
     type: str
     content: Optional[str] = None
     src: Optional[str] = None
+    # Chỉ có ở block ảnh: kích thước bản đầy đủ và các bản thu nhỏ (srcset)
+    width: Optional[int] = None
+    height: Optional[int] = None
+    variants: Optional[List[ImageVariant]] = None
 
 class Option(BaseModel):
     label: str
@@ -28,166 +103,410 @@ class Question(BaseModel):
 class ProcessResponse(BaseModel):
     questions: List[Question]
 
+class InvalidUploadError(ValueError):
+    """The upload is too large, is not a usable DOCX file or reuses the UUID of an existing exam"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class DocxService:
-    def __init__(self):
+    def __init__(self, pipelined: Optional[bool] = None, lazy_images: Optional[bool] = None):
         self.image_utils = ImageUtils()
+        self.native_parser = NativeDocxParser()
         self.base_url = os.getenv("BASE_URL", "http://localhost:8000")
+        self.max_upload_bytes = MAX_UPLOAD_BYTES
+        # Pipelined: convert ảnh lấy thẳng từ zip song song với pandoc + parse
+        # (engine pandoc); tắt bằng DOCX_PIPELINED=0 để chạy tuần tự như cũ
+        if pipelined is None:
+            pipelined = os.getenv("DOCX_PIPELINED", "1") != "0"
+        self.pipelined = pipelined
+        # Lazy: không convert ảnh lúc upload; /outputs convert khi ảnh được GET lần đầu
+        # và pre-warm chạy nền sau DOCX_LAZY_PREWARM_DELAY giây (âm: chỉ khi đề được mở)
+        if lazy_images is None:
+            lazy_images = os.getenv("DOCX_LAZY_IMAGES", "0") == "1"
+        self.lazy_images = lazy_images
+        self.prewarm_delay = float(os.getenv("DOCX_LAZY_PREWARM_DELAY", "30"))
+
+    async def process_docx(self, file: UploadFile, request_uuid: str, engine: str = "pandoc") -> ProcessResponse:
+        content_hash = await self.save_upload(file, request_uuid)
+        try:
+            # Pandoc/soffice/regex đều là code đồng bộ: chạy trong threadpool
+            # để không chặn event loop trong lúc convert
+            return await run_in_threadpool(self.process_saved_docx, request_uuid, None, content_hash, engine)
+        except Exception:
+            # outputs/<uuid> vừa được save_upload tạo cho chính upload này
+            shutil.rmtree(os.path.join("outputs", request_uuid), ignore_errors=True)
+            raise
 
-    async def process_docx(self, file: UploadFile, request_uuid: str) -> ProcessResponse:
+    async def save_upload(self, file: UploadFile, request_uuid: str) -> str:
+        """Stream the upload to outputs/<uuid>/temp.docx and return its SHA-256 hex digest.
+
+        outputs/<uuid> is created here and must not exist yet: an existing
+        folder belongs to another exam (or an upload still in progress), so
+        InvalidUploadError(409) is raised without touching it. Raises
+        InvalidUploadError (and removes the folder it created) when the
+        upload exceeds max_upload_bytes or fails validate_docx, before any
+        conversion work starts.
+        """
         output_dir = os.path.join("outputs", request_uuid)
-        os.makedirs(output_dir, exist_ok=True)
-        
+        os.makedirs("outputs", exist_ok=True)
+        try:
+            # mkdir là atomic: hai request cùng UUID thì chỉ một request nhận được thư mục
+            os.mkdir(output_dir)
+        except FileExistsError:
+            raise InvalidUploadError(f"Exam {request_uuid} already exists", status_code=409)
+
         temp_docx_path = os.path.join(output_dir, "temp.docx")
-        async with aiofiles.open(temp_docx_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with metrics.pipeline_stage("upload_write"):
+                async with aiofiles.open(temp_docx_path, 'wb') as f:
+                    while True:
+                        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > self.max_upload_bytes:
+                            raise InvalidUploadError(
+                                f"File exceeds the maximum upload size of {self.max_upload_bytes / (1024 * 1024):g} MB",
+                                status_code=413
+                            )
+                        digest.update(chunk)
+                        await f.write(chunk)
+            await run_in_threadpool(self.validate_docx, temp_docx_path)
+        except Exception:
+            # Thư mục do chính request này tạo ở trên
+            shutil.rmtree(output_dir, ignore_errors=True)
+            raise
+        return digest.hexdigest()
 
-        tex_path = os.path.join(output_dir, "temp.tex")
-        latex_content = self.convert_docx_to_latex(temp_docx_path, tex_path, output_dir)
+    @staticmethod
+    def validate_docx(docx_path: str):
+        """Cheap OOXML sanity check: reads only the zip central directory.
+
+        Rejects non-zip files (including password-protected documents, which
+        are OLE containers), archives without the DOCX parts and archives
+        whose declared uncompressed size or entry count is excessive.
+        """
+        try:
+            with zipfile.ZipFile(docx_path) as archive:
+                entries = archive.infolist()
+        except (zipfile.BadZipFile, OSError):
+            raise InvalidUploadError("Not a valid DOCX file (not a ZIP archive)")
+        if len(entries) > MAX_ZIP_ENTRIES:
+            raise InvalidUploadError("Not a valid DOCX file (too many parts)")
+        names = {entry.filename for entry in entries}
+        missing = [part for part in REQUIRED_DOCX_PARTS if part not in names]
+        if missing:
+            raise InvalidUploadError(f"Not a valid DOCX file (missing {', '.join(missing)})")
+        if sum(entry.file_size for entry in entries) > MAX_UNCOMPRESSED_BYTES:
+            raise InvalidUploadError("DOCX content is too large once uncompressed", status_code=413)
+
+    @staticmethod
+    def store_key(content_hash: str, engine: str = "pandoc", lazy: bool = False) -> str:
+        """Content store key: the upload hash plus the engine, image mode and pipeline version that produced the result"""
+        # Entry lazy chỉ chứa ảnh gốc: không dùng chung với entry đã convert
+        mode = "-lazy" if lazy else ""
+        return f"{content_hash}-{engine}{mode}-v{PIPELINE_VERSION}"
 
-        # Đường dẫn thư mục media sẽ được tạo bởi pandoc
+    def process_saved_docx(
+        self,
+        request_uuid: str,
+        progress: Optional[Callable[[str, float], None]] = None,
+        content_hash: Optional[str] = None,
+        engine: str = "pandoc"
+    ) -> ProcessResponse:
+        """Run the conversion pipeline on a DOCX previously stored by save_upload.
+
+        progress, if given, is called with (stage, fraction done) between stages.
+        With content_hash, an identical earlier upload is reused from the
+        content store instead of being converted again. engine selects the
+        question parser: "pandoc" (DOCX → LaTeX → regex) or "native"
+        (python-docx, see NativeDocxParser).
+        """
+        if engine not in PARSER_ENGINES:
+            raise ValueError(f"Unknown parser engine: {engine}")
+
+        def report(stage: str, fraction: float):
+            if progress is not None:
+                progress(stage, fraction)
+
+        output_dir = os.path.join("outputs", request_uuid)
+        temp_docx_path = os.path.join(output_dir, "temp.docx")
+
+        if content_hash:
+            stored = content_store.lookup(self.store_key(content_hash, engine, self.lazy_images))
+            if stored is not None:
+                report("reusing_stored_result", 0.5)
+                with metrics.pipeline_stage("reuse_stored_result"):
+                    media_dir = os.path.join(output_dir, "media")
+                    if os.path.exists(media_dir):
+                        shutil.rmtree(media_dir)
+                    content_store.link_tree(stored.media_dir, media_dir)
+                    questions = [Question(**q) for q in stored.questions]
+                with metrics.pipeline_stage("update_image_srcs"):
+                    self.update_image_srcs(questions, stored.images_map, request_uuid)
+                report("writing", 0.9)
+                with metrics.pipeline_stage("write_outputs"):
+                    self.write_outputs(output_dir, request_uuid, questions)
+                os.remove(temp_docx_path)
+                self.schedule_prewarm(request_uuid)
+                return ProcessResponse(questions=questions)
+
+        tex_path = os.path.join(output_dir, "temp.tex")
+        # Đường dẫn thư mục media sẽ được tạo bởi pandoc / native parser
         image_dir = os.path.join(output_dir, "media")
-        
-        if os.path.exists(image_dir):
-            images_map = self.image_utils.convert_extracted_images(image_dir)
+
+        if engine == "native":
+            report("parsing", 0.1)
+            with metrics.pipeline_stage("parse_docx_native"):
+                questions = self.parse_docx_native(temp_docx_path, image_dir)
+            report("converting_images", 0.3)
+            with metrics.pipeline_stage("convert_extracted_images"):
+                images_map = self.convert_images(image_dir)
+        elif self.pipelined:
+            questions, images_map = self._convert_pipelined(temp_docx_path, tex_path, output_dir, image_dir, report)
         else:
-            images_map = {}
+            report("converting_latex", 0.1)
+            with metrics.pipeline_stage("convert_docx_to_latex"):
+                latex_content = self.convert_docx_to_latex(temp_docx_path, tex_path, output_dir)
+            report("converting_images", 0.3)
+            with metrics.pipeline_stage("convert_extracted_images"):
+                images_map = self.convert_images(image_dir)
+            report("parsing", 0.8)
+            with metrics.pipeline_stage("parse_latex_to_json"):
+                questions = self.parse_latex_to_json(latex_content)
 
-        questions = self.parse_latex_to_json(latex_content)
+        if content_hash:
+            # Lưu bản chưa gắn URL (src = tên file) để upload trùng dùng lại
+            with metrics.pipeline_stage("store_save"):
+                content_store.save(
+                    self.store_key(content_hash, engine, self.lazy_images),
+                    [q.dict() for q in questions],
+                    images_map,
+                    image_dir
+                )
 
-        self.update_image_srcs(questions, images_map, request_uuid)
+        with metrics.pipeline_stage("update_image_srcs"):
+            self.update_image_srcs(questions, images_map, request_uuid)
 
-        json_path = os.path.join(output_dir, "output.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump({"questions": [q.dict() for q in questions]}, f, ensure_ascii=False, indent=4)
-            f.flush()  # Force write to disk
-            os.fsync(f.fileno())  # Ensure data is written
+        report("writing", 0.9)
+        with metrics.pipeline_stage("write_outputs"):
+            self.write_outputs(output_dir, request_uuid, questions)
 
         os.remove(temp_docx_path)
         if os.path.exists(tex_path):
             os.remove(tex_path)
 
+        self.schedule_prewarm(request_uuid)
         return ProcessResponse(questions=questions)
 
-    def convert_docx_to_latex(self, docx_path: str, output_tex_path: str, output_dir: str) -> str:
+    def _convert_pipelined(
+        self,
+        docx_path: str,
+        tex_path: str,
+        output_dir: str,
+        image_dir: str,
+        report: Callable[[str, float], None]
+    ):
+        """Pandoc + LaTeX parsing on this thread while the images convert on another.
+
+        The two branches share nothing until the questions need their image
+        filenames, so the join happens right before update_image_srcs. Images
+        the LaTeX references that the image branch did not extract are then
+        picked up from word/media/, so the result matches the sequential
+        path's --extract-media.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="docx-images") as executor:
+            # copy_context: stage của thread ảnh vẫn vào Server-Timing của request
+            images_future = executor.submit(
+                contextvars.copy_context().run, self.extract_and_convert_images, docx_path, image_dir
+            )
+            report("converting_latex", 0.1)
+            with metrics.pipeline_stage("convert_docx_to_latex"):
+                latex_content = self.convert_docx_to_latex(docx_path, tex_path, output_dir, extract_media=False)
+            report("parsing", 0.3)
+            with metrics.pipeline_stage("parse_latex_to_json"):
+                questions = self.parse_latex_to_json(latex_content)
+            report("converting_images", 0.5)
+            # Lỗi ở nhánh pandoc: thoát khỏi with vẫn chờ thread ảnh xong mới raise
+            with metrics.pipeline_stage("wait_images"):
+                images_map = images_future.result()
+        with metrics.pipeline_stage("convert_missing_media"):
+            images_map = self.convert_missing_media(docx_path, output_dir, image_dir, questions, images_map)
+        return questions, images_map
+
+    def convert_missing_media(
+        self,
+        docx_path: str,
+        output_dir: str,
+        image_dir: str,
+        questions: List[Question],
+        images_map: Dict[str, str]
+    ) -> Dict[str, str]:
+        """Extract and convert images referenced by questions but absent from images_map"""
+        referenced = {
+            block.src
+            for question in questions
+            for block in question.blocks + [b for option in question.options for b in option.blocks]
+            if block.type == "image" and block.src
+        }
+        missing = sorted(src for src in referenced if src not in images_map)
+        if not missing:
+            return images_map
+        with zipfile.ZipFile(docx_path) as zf:
+            names = set(zf.namelist())
+        partnames = [f"word/media/{src}" for src in missing if f"word/media/{src}" in names]
+        if not partnames:
+            return images_map
+        # Convert riêng trong thư mục tạm: không đụng tới ảnh đã convert trong media/
+        scratch = tempfile.mkdtemp(prefix=".media-", dir=output_dir)
         try:
-            # Xóa thư mục media cũ nếu tồn tại
-            media_dir = os.path.join(output_dir, "media")
-            if os.path.exists(media_dir):
-                shutil.rmtree(media_dir)
-            
-            # Sử dụng output_dir làm base directory cho extract-media
-            extra_args = [f'--extract-media={output_dir}', '--wrap=none']
+            self.native_parser.extract_media(docx_path, partnames, scratch)
+            converted = self.convert_images(scratch)
+            os.makedirs(image_dir, exist_ok=True)
+            for filename in os.listdir(scratch):
+                os.replace(os.path.join(scratch, filename), os.path.join(image_dir, filename))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        return {**images_map, **converted}
+
+    def extract_and_convert_images(self, docx_path: str, image_dir: str) -> Dict[str, str]:
+        """Copy the body images out of the DOCX zip into image_dir and convert them.
+
+        Gives the same files and images_map as pandoc --extract-media followed
+        by convert_extracted_images, without waiting for pandoc.
+        """
+        if os.path.exists(image_dir):
+            shutil.rmtree(image_dir)
+        with metrics.pipeline_stage("extract_media"):
+            partnames = self.native_parser.body_media_parts(docx_path)
+            if not partnames:
+                return {}
+            self.native_parser.extract_media(docx_path, partnames, image_dir)
+        with metrics.pipeline_stage("convert_extracted_images"):
+            return self.convert_images(image_dir)
+
+    def convert_images(self, image_dir: str) -> Dict[str, str]:
+        """Convert image_dir to WebP, or in lazy mode only plan the WebP names"""
+        if not os.path.exists(image_dir):
+            return {}
+        if self.lazy_images:
+            return planned_images_map(image_dir)
+        return self.image_utils.convert_extracted_images(image_dir)
+
+    def schedule_prewarm(self, request_uuid: str):
+        """Lazy mode: mark the exam and convert its images in the background after prewarm_delay"""
+        mark_lazy(os.path.join("outputs", request_uuid), self.lazy_images)
+        lazy_images.forget(request_uuid)
+        if self.lazy_images and self.prewarm_delay >= 0:
+            lazy_images.schedule_prewarm(request_uuid, delay=self.prewarm_delay)
+
+    def write_outputs(self, output_dir: str, request_uuid: str, questions: List[Question]):
+        """Write output.json, answer_key.json (grading) and public.json (answer-free questions).
+
+        Only public.json is served by /outputs, so only it gets .gz / .br siblings.
+        """
+        question_dicts = [q.dict() for q in questions]
+        json_path = os.path.join(output_dir, "output.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"questions": question_dicts}, f, ensure_ascii=False, indent=4)
+            f.flush()  # Force write to disk
+            os.fsync(f.fileno())  # Ensure data is written
+        with open(os.path.join(output_dir, ANSWER_KEY_FILE), "w", encoding="utf-8") as f:
+            f.write(dump_answer_key(question_dicts))
+            f.flush()
+            os.fsync(f.fileno())
+        public_path = os.path.join(output_dir, PUBLIC_QUESTIONS_FILE)
+        with open(public_path, "wb") as f:
+            f.write(dump_public_questions(question_dicts))
+            f.flush()
+            os.fsync(f.fileno())
+        write_precompressed(public_path)
+        # Drop any parsed copy of a previous upload under the same UUID
+        quiz_cache.invalidate(request_uuid)
+
+    def convert_docx_to_latex(self, docx_path: str, output_tex_path: str, output_dir: str, extract_media: bool = True) -> str:
+        try:
+            extra_args = ['--wrap=none']
+            if extract_media:
+                # Xóa thư mục media cũ nếu tồn tại
+                media_dir = os.path.join(output_dir, "media")
+                if os.path.exists(media_dir):
+                    shutil.rmtree(media_dir)
+                # Sử dụng output_dir làm base directory cho extract-media
+                extra_args.insert(0, f'--extract-media={output_dir}')
             pypandoc.convert_file(docx_path, 'latex', outputfile=output_tex_path, extra_args=extra_args)
             with open(output_tex_path, 'r', encoding='utf-8') as f:
                 return f.read()
         except Exception as e:
             raise Exception(f"Error converting DOCX to LaTeX: {e}")
 
+    def parse_docx_native(self, docx_path: str, media_dir: str) -> List[Question]:
+        """Parse questions with python-docx and extract the images they reference into media_dir"""
+        if os.path.exists(media_dir):
+            shutil.rmtree(media_dir)
+        questions, media_parts = self.native_parser.parse(docx_path)
+        if media_parts:
+            self.native_parser.extract_media(docx_path, media_parts, media_dir)
+        return [Question(**q) for q in questions]
+
     def split_blocks(self, text: str) -> List[Dict]:
+        return self._split_span(text, 0, len(text))
+
+    @staticmethod
+    def _split_span(text: str, start: int, end: int) -> List[Dict]:
+        """split_blocks on text[start:end], slicing it only to drop \\pandocbounded{"""
+        if text.find(_PANDOC_BOUNDED, start, end) != -1:
+            # Clean up pandoc artefacts
+            text = text[start:end].replace(_PANDOC_BOUNDED, '')
+            start, end = 0, len(text)
         blocks = []
-        # Clean up pandoc artefacts
-        text = text.replace(r'\pandocbounded{', '')
-
-        # Updated pattern to handle both relative and absolute paths
-        pattern = re.compile(
-            r'\\includegraphics(?:\[.*?\])?\{([^}]+?)\}'  # Capture any path (relative or absolute)
-            r'|(\$.*?\$|\\\(.+?\\\)|\\\[.+?\\\])',  # math
-            re.DOTALL
-        )
-        last = 0
-        for m in pattern.finditer(text):
-            start, end = m.span()
-            if start > last:
-                txt = text[last:start].strip()
-                if txt.endswith('}') and not txt.count('{') > txt.count('}'): 
-                     txt = txt[:-1]
-
-                if txt:
-                    blocks.append({"type": "text", "content": txt})
+        last = start
+        for m in _BLOCK_TOKEN.finditer(text, start, end):
+            if m.start() > last:
+                _append_text(blocks, text[last:m.start()])
             if m.group(1):  # image
-                # Extract only the filename, remove full path
-                image_path = m.group(1).replace('./', '')
-                # Handle absolute paths like "outputs/uuid/media/imageX.wmf"
-                if '/' in image_path:
-                    # Extract only filename (last part after /)
-                    basename = os.path.basename(image_path)
-                else:
-                    basename = image_path
-                blocks.append({"type": "image", "src": basename})
+                # Chỉ giữ tên file (pandoc có thể ghi "./media/x" hoặc đường dẫn tuyệt đối)
+                blocks.append({"type": "image", "src": os.path.basename(m.group(1).replace('./', ''))})
             elif m.group(2):  # math
                 blocks.append({"type": "math", "content": m.group(2)})
-            last = end
-        if last < len(text):
-            txt = text[last:].strip()
-            if txt.endswith('}') and not txt.count('{') > txt.count('}'): 
-                 txt = txt[:-1]
-            if txt:
-                blocks.append({"type": "text", "content": txt})
+            last = m.end()
+        if last < end:
+            _append_text(blocks, text[last:end])
         return blocks
 
     def parse_latex_to_json(self, latex_content: str) -> List[Question]:
-        # Cải thiện regex split để bắt được "Câu 1." hoặc "Câu 1:"
-        # Chấp nhận có thể được bọc trong \textbf{} hoặc không
-        # Pattern: (StartBold)? Câu <space> <digit> <dot/colon> (EndBold)?
-        question_blocks = re.split(r'(?:\\textbf\{)?Câu\s+\d+[\.:](?:\})?', latex_content)[1:]
+        """Split pandoc LaTeX into questions.
+
+        Each question block is cleaned with one regex pass, its option labels
+        (A. B. C. D., optionally bold and/or underlined) are found
+        with one finditer, and the question/option spans are tokenized in
+        place. An underlined label marks the correct answer.
+        """
         questions = []
+        for idx, block in enumerate(_QUESTION_HEADER.split(latex_content)[1:], 1):
+            # Xóa quote/enumerate/item trong một lượt
+            clean_block = _LATEX_NOISE.sub('', block)
+            labels = list(_OPTION_LABEL.finditer(clean_block))
 
-        # Regex tìm đáp án đầu tiên (A. B. C. D.)
-        # Chấp nhận các format: \textbf{A.}, \ul{A.}, \textbf{\ul{A.}}
-        # Ta dùng pattern đơn giản hóa: (các thẻ mở)* ([A-D])\. (các thẻ đóng)*
-        # Tuy nhiên để an toàn, ta tìm kiếm pattern cốt lõi "A." được bọc hoặc không
-        first_option_pattern = re.compile(r'(?:\\textbf\{|\\ul\{|\\underline\{)*([A-D])\.(?:\})*')
-
-        # Regex split options
-        options_split_pattern = re.compile(
-            r'(?:\\textbf\{|\\ul\{|\\underline\{)*([A-D])\.(?:\})*(.*?)(?=(?:\\textbf\{|\\ul\{|\\underline\{)*[A-D]\.(?:\})*|\Z)', 
-            re.DOTALL
-        )
-
-        for idx, block in enumerate(question_blocks, 1):
-            # 1. Xóa các nhiễu format
-            clean_block = block.replace(r'\begin{quote}', '').replace(r'\end{quote}', '')
-            clean_block = clean_block.replace(r'\begin{enumerate}', '').replace(r'\end{enumerate}', '')
-            clean_block = clean_block.replace(r'\item', '')
-
-            # 2. Tìm vị trí xuất hiện đáp án đầu tiên
-            match = first_option_pattern.search(clean_block)
-            
-            if match:
-                start_index = match.start()
-                question_text = clean_block[:start_index].strip()
-                options_block = clean_block[start_index:]
-            else:
-                question_text = clean_block.strip()
-                options_block = ""
-
-            blocks = self.split_blocks(question_text)
+            question_end = labels[0].start() if labels else len(clean_block)
+            blocks = self._split_span(clean_block, *_strip_span(clean_block, 0, question_end))
 
             options = []
             correct = None
-            
-            # 3. Quét các đáp án
-            for m in options_split_pattern.finditer(options_block):
-                # Group 1: Label (A, B, C, D)
-                label = m.group(1) 
-                # Group 2: Content
-                opt_content = m.group(2).strip()
-                
-                # Check formatted (đơn giản là có label tức là có option)
-                is_correct = False
-                # Logic check correct cũ dựa vào group capture của \ul, giờ ko chắc chắn.
-                # Nếu muốn check correct: thường là đáp án có gạch chân (\ul hoặc \underline)
-                # Ta check trong chuỗi gốc match group 0 xem có chứa \ul hay \underline không
-                full_match = m.group(0) # bao gồm cả label và format prefix
-                # Lấy phần prefix trước label
-                prefix = full_match.split(label + '.')[0]
-                if r'\ul' in prefix or r'\underline' in prefix:
-                     is_correct = True
-
-                opt_blocks = self.split_blocks(opt_content)
+            for i, m in enumerate(labels):
+                # Nội dung đáp án kéo dài đến nhãn kế tiếp (hoặc hết block)
+                opt_end = labels[i + 1].start() if i + 1 < len(labels) else len(clean_block)
+                opt_blocks = self._split_span(clean_block, *_strip_span(clean_block, m.end(), opt_end))
+                label = m.group(2)
                 options.append(Option(label=label, blocks=opt_blocks))
-                if is_correct:
+                # Đáp án đúng thường được gạch chân (\ul hoặc \underline)
+                prefix = m.group(1)
+                if r'\ul' in prefix or r'\underline' in prefix:
                     correct = label
 
             questions.append(Question(
@@ -200,22 +519,49 @@ class DocxService:
         return questions
 
     def update_image_srcs(self, questions: List[Question], images_map: Dict[str, str], request_uuid: str):
+        """Turn image filenames into /outputs URLs and attach size and variants of each image.
+
+        URLs of files that exist carry ?v=<content hash>, so /outputs can let
+        clients cache them forever: a later upload under the same UUID with
+        other images gets other URLs.
+        """
+        media_dir = os.path.join("outputs", request_uuid, "media")
+        media_url = f"{self.base_url}/outputs/{request_uuid}/media"
+        described: Dict[str, Optional[Dict]] = {}
+        urls: Dict[str, str] = {}
+
+        def url(filename: str) -> str:
+            if filename not in urls:
+                path = os.path.join(media_dir, filename)
+                # Lazy mode: WebP chưa có, URL không version (được revalidate)
+                urls[filename] = (
+                    f"{media_url}/{filename}?{VERSION_PARAM}={content_version(path)}"
+                    if os.path.isfile(path) else f"{media_url}/{filename}"
+                )
+            return urls[filename]
+
+        def resolve(block: Block):
+            if block.type != "image" or not block.src:
+                return
+            filename = images_map.get(block.src, block.src)
+            block.src = url(filename)
+            # Chỉ ảnh đã convert (lazy mode: chưa có file) mới có kích thước / variants
+            if not filename.endswith(".webp"):
+                return
+            if filename not in described:
+                described[filename] = ImageUtils.describe_image(media_dir, filename)
+            info = described[filename]
+            if info is not None:
+                block.width = info["width"]
+                block.height = info["height"]
+                block.variants = [
+                    ImageVariant(name=v["name"], src=url(v["filename"]), width=v["width"], height=v["height"])
+                    for v in info["variants"]
+                ] or None
+
         for question in questions:
             for block in question.blocks:
-                if block.type == "image" and block.src:
-                    original_filename = block.src
-                    if original_filename in images_map:
-                        new_filename = images_map[original_filename]
-                        block.src = f"{self.base_url}/outputs/{request_uuid}/media/{new_filename}"
-                    else:
-                        block.src = f"{self.base_url}/outputs/{request_uuid}/media/{original_filename}"
-            
+                resolve(block)
             for option in question.options:
                 for block in option.blocks:
-                    if block.type == "image" and block.src:
-                        original_filename = block.src
-                        if original_filename in images_map:
-                            new_filename = images_map[original_filename]
-                            block.src = f"{self.base_url}/outputs/{request_uuid}/media/{new_filename}"
-                        else:
-                            block.src = f"{self.base_url}/outputs/{request_uuid}/media/{original_filename}"
\ No newline at end of file
+                    resolve(block)
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+
+
+class ExamRoomSnapshot(NamedTuple):
+    """Detached copy of a TestExamRoom row (safe to share across sessions and threads)"""
+    id: int
+    uuid: str
+    username: str
+    title: Optional[str]
+    time_limit: Optional[int]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, room) -> "ExamRoomSnapshot":
+        return cls(room.id, room.uuid, room.username, room.title, room.time_limit, room.created_at, room.updated_at)
+
+
+class ExamRoomCache:
+    """Process-wide TTL + LRU cache of exam room metadata, keyed by UUID.
+
+    Unknown UUIDs are cached too, with the shorter negative_ttl. The
+    DatabaseService create/delete methods invalidate the entry of this
+    process; other workers see the change once their entry expires.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 30.0, negative_ttl: float = 2.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # uuid -> (hết hạn lúc, snapshot hoặc None nếu room không tồn tại)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[ExamRoomSnapshot]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uuid: str) -> Tuple[bool, Optional[ExamRoomSnapshot]]:
+        """(hit, snapshot); a hit with None means the room is known not to exist"""
+        with self._lock:
+            entry = self._entries.get(uuid)
+            if entry is None:
+                return False, None
+            expires_at, room = entry
+            if expires_at <= time.monotonic():
+                del self._entries[uuid]
+                return False, None
+            self._entries.move_to_end(uuid)
+            return True, room
+
+    def put(self, uuid: str, room: Optional[ExamRoomSnapshot]) -> None:
+        ttl = self.ttl if room is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[uuid] = (time.monotonic() + ttl, room)
+            self._entries.move_to_end(uuid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, uuid: str) -> None:
+        with self._lock:
+            self._entries.pop(uuid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+exam_room_cache = ExamRoomCache(
+    max_entries=int(os.getenv("EXAM_ROOM_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("EXAM_ROOM_CACHE_TTL", "30")),
+    negative_ttl=float(os.getenv("EXAM_ROOM_CACHE_NEGATIVE_TTL", "2")),
+)
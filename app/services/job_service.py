@@ -0,0 +1,159 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from app.models.database import SessionLocal
+from app.services.database_service import DatabaseService
+from app.services.docx_service import DocxService
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFullError(Exception):
+    """Raised when too many conversion jobs are already queued or running"""
+
+
+class Job:
+    def __init__(
+        self,
+        request_uuid: str,
+        username: str,
+        title: Optional[str],
+        time_limit: Optional[int],
+        content_hash: Optional[str] = None,
+        engine: str = "pandoc"
+    ):
+        self.id = uuid.uuid4().hex
+        self.request_uuid = request_uuid
+        self.content_hash = content_hash
+        self.engine = engine
+        self.username = username
+        self.title = title
+        self.time_limit = time_limit
+        self.status = "queued"  # queued, running, succeeded, failed
+        self.stage = "queued"
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.updated_at = self.created_at
+        self.finished_monotonic: Optional[float] = None
+
+    def update(self, stage: str, progress: float):
+        self.stage = stage
+        self.progress = progress
+        self.updated_at = datetime.now(timezone.utc)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "uuid": self.request_uuid,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+class JobManager:
+    """Bounded background worker pool for DOCX conversion jobs.
+
+    Jobs live in memory only; finished jobs are kept for job_ttl seconds so
+    clients can poll their final status.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, job_ttl: float = 3600):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docx-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_monotonic is not None and now - job.finished_monotonic > self.job_ttl
+        ]:
+            del self._jobs[job_id]
+
+    def submit(
+        self,
+        request_uuid: str,
+        username: str,
+        title: Optional[str],
+        time_limit: Optional[int],
+        content_hash: Optional[str] = None,
+        engine: str = "pandoc"
+    ) -> Job:
+        """Queue processing of outputs/<request_uuid>/temp.docx"""
+        with self._lock:
+            self._prune()
+            if len(self._active_uuids()) >= self.max_pending:
+                raise JobQueueFullError("Too many DOCX conversions in progress, try again later")
+            job = Job(request_uuid, username, title, time_limit, content_hash, engine)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _active_uuids(self) -> List[str]:
+        return [job.request_uuid for job in self._jobs.values() if job.finished_monotonic is None]
+
+    def active_uuids(self) -> List[str]:
+        """Exam UUIDs whose output folder is still being produced"""
+        with self._lock:
+            return self._active_uuids()
+
+    def _run(self, job: Job):
+        job.status = "running"
+        try:
+            DocxService().process_saved_docx(
+                job.request_uuid,
+                progress=job.update,
+                content_hash=job.content_hash,
+                engine=job.engine
+            )
+
+            # Exam room chỉ được tạo khi convert thành công
+            job.update("creating_room", 0.95)
+            db = SessionLocal()
+            try:
+                DatabaseService(db).create_test_exam_room(
+                    uuid=job.request_uuid,
+                    username=job.username,
+                    title=job.title,
+                    time_limit=job.time_limit
+                )
+            finally:
+                db.close()
+
+            job.status = "succeeded"
+            job.update("done", 1.0)
+        except Exception as e:
+            logger.exception("DOCX job %s failed", job.id)
+            job.status = "failed"
+            job.error = f"Processing failed: {str(e)}"
+            job.updated_at = datetime.now(timezone.utc)
+            # outputs/<uuid> được tạo bởi save_upload của chính upload này (UUID đã có thì bị từ chối)
+            shutil.rmtree(os.path.join("outputs", job.request_uuid), ignore_errors=True)
+        finally:
+            job.finished_monotonic = time.monotonic()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager(
+    max_workers=int(os.getenv("DOCX_JOB_WORKERS", "2")),
+    max_pending=int(os.getenv("DOCX_JOB_QUEUE_LIMIT", "16")),
+)
@@ -0,0 +1,350 @@
+import os
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+from typing import Any, Dict, List, Optional, Tuple
+
+from docx import Document
+from docx.oxml.ns import qn
+
+# Thay cho một ảnh/công thức trong chuỗi text phẳng của tài liệu
+_OBJ = "\ufffc"
+
+_M = "{http://schemas.openxmlformats.org/officeDocument/2006/math}"
+_A_BLIP = "{http://schemas.openxmlformats.org/drawingml/2006/main}blip"
+_V_IMAGEDATA = "{urn:schemas-microsoft-com:vml}imagedata"
+_R_EMBED = qn("r:embed")
+_R_ID = qn("r:id")
+
+_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+_REL_TYPE_IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+_DOCUMENT_RELS = "word/_rels/document.xml.rels"
+# Các part pandoc đọc (thân văn bản + footnote/endnote); header/footer bị pandoc bỏ qua
+_PANDOC_RELS = (_DOCUMENT_RELS, "word/_rels/footnotes.xml.rels", "word/_rels/endnotes.xml.rels")
+
+_W_P = qn("w:p")
+_W_R = qn("w:r")
+_W_TBL = qn("w:tbl")
+_W_T = qn("w:t")
+_W_TAB = qn("w:tab")
+_W_BR = qn("w:br")
+_W_CR = qn("w:cr")
+_W_DRAWING = qn("w:drawing")
+_W_PICT = qn("w:pict")
+_W_OBJECT = qn("w:object")
+_W_RPR = qn("w:rPr")
+_W_U = qn("w:u")
+_W_VAL = qn("w:val")
+_W_RSTYLE = qn("w:rStyle")
+# Nội dung không hiển thị hoặc không thuộc dòng chữ của đoạn
+_W_SKIP = {qn("w:pPr"), qn("w:del"), qn("w:moveFrom"), qn("w:proofErr")}
+
+# "Câu 1." / "Câu 1:" ở đầu đoạn
+_QUESTION_HEADER = re.compile(r"^[ \t]*Câu[ \t]+\d+[ \t]*[.:]", re.MULTILINE)
+# Nhãn đáp án: đầu đoạn hoặc sau khoảng trắng/ảnh
+_OPTION_LABEL = re.compile(r"(?:^|(?<=[\s" + _OBJ + r"]))([A-D])\.", re.MULTILINE)
+
+_MATH_SYMBOLS = {
+    "∫": r"\int", "∑": r"\sum", "∏": r"\prod", "π": r"\pi", "α": r"\alpha", "β": r"\beta",
+    "γ": r"\gamma", "δ": r"\delta", "Δ": r"\Delta", "ε": r"\varepsilon", "θ": r"\theta",
+    "λ": r"\lambda", "μ": r"\mu", "σ": r"\sigma", "φ": r"\varphi", "ω": r"\omega", "Ω": r"\Omega",
+    "≤": r"\le", "≥": r"\ge", "≠": r"\ne", "≈": r"\approx", "±": r"\pm", "∓": r"\mp",
+    "×": r"\times", "÷": r"\div", "·": r"\cdot", "∞": r"\infty", "→": r"\to", "⇒": r"\Rightarrow",
+    "⇔": r"\Leftrightarrow", "∈": r"\in", "∉": r"\notin", "⊂": r"\subset", "∪": r"\cup",
+    "∩": r"\cap", "∅": r"\emptyset", "ℝ": r"\mathbb{R}", "°": r"^{\circ}", "∠": r"\angle",
+    "⊥": r"\perp", "∥": r"\parallel", "′": "'", "−": "-",
+}
+_ACCENTS = {"̂": r"\hat", "̃": r"\tilde", "⃗": r"\overrightarrow", "→": r"\overrightarrow",
+            "̅": r"\overline", "¯": r"\overline", "̇": r"\dot", "̈": r"\ddot"}
+_FUNCTIONS = {"sin", "cos", "tan", "cot", "log", "ln", "lim", "exp", "max", "min"}
+
+
+def _m(tag: str) -> str:
+    return _M + tag
+
+
+class OmmlToLatex:
+    """Translate Office Math (OMML) elements to LaTeX source"""
+
+    def convert(self, element) -> str:
+        return self._children(element).strip()
+
+    def _children(self, element) -> str:
+        return "".join(self._node(child) for child in element)
+
+    def _child(self, element, tag: str) -> str:
+        child = element.find(_m(tag))
+        return self._children(child) if child is not None else ""
+
+    def _prop(self, element, pr_tag: str, prop_tag: str, default: Optional[str]) -> Optional[str]:
+        pr = element.find(_m(pr_tag))
+        if pr is not None:
+            prop = pr.find(_m(prop_tag))
+            if prop is not None:
+                return prop.get(_m("val"), default)
+        return default
+
+    def _node(self, el) -> str:
+        tag = el.tag
+        if not isinstance(tag, str) or not tag.startswith(_M) or tag.endswith("Pr"):
+            return ""
+        name = tag[len(_M):]
+        if name == "r":
+            text = "".join(t.text or "" for t in el.iter(_m("t")))
+            if text.strip() in _FUNCTIONS:
+                return "\\" + text.strip() + " "
+            return "".join(_MATH_SYMBOLS.get(ch, ch) for ch in text)
+        if name == "f":
+            return r"\frac{%s}{%s}" % (self._child(el, "num"), self._child(el, "den"))
+        if name == "sSup":
+            return "{%s}^{%s}" % (self._child(el, "e"), self._child(el, "sup"))
+        if name == "sSub":
+            return "{%s}_{%s}" % (self._child(el, "e"), self._child(el, "sub"))
+        if name == "sSubSup":
+            return "{%s}_{%s}^{%s}" % (self._child(el, "e"), self._child(el, "sub"), self._child(el, "sup"))
+        if name == "sPre":
+            return "{}_{%s}^{%s}{%s}" % (self._child(el, "sub"), self._child(el, "sup"), self._child(el, "e"))
+        if name == "rad":
+            degree = self._child(el, "deg")
+            body = self._child(el, "e")
+            return r"\sqrt[%s]{%s}" % (degree, body) if degree else r"\sqrt{%s}" % body
+        if name == "d":
+            begin = self._prop(el, "dPr", "begChr", "(")
+            end = self._prop(el, "dPr", "endChr", ")")
+            sep = self._prop(el, "dPr", "sepChr", "|")
+            parts = [self._children(e) for e in el.findall(_m("e"))]
+            left = {"{": r"\{", "": "."}.get(begin, begin)
+            right = {"}": r"\}", "": "."}.get(end, end)
+            return r"\left%s %s \right%s" % (left, sep.join(parts), right)
+        if name == "nary":
+            op = self._prop(el, "naryPr", "chr", "∫")
+            latex = _MATH_SYMBOLS.get(op, op)
+            sub, sup = self._child(el, "sub"), self._child(el, "sup")
+            if sub:
+                latex += "_{%s}" % sub
+            if sup:
+                latex += "^{%s}" % sup
+            return latex + "{%s}" % self._child(el, "e")
+        if name == "func":
+            return "%s{%s}" % (self._child(el, "fName").strip(), self._child(el, "e"))
+        if name == "acc":
+            accent = self._prop(el, "accPr", "chr", "̂")
+            return "%s{%s}" % (_ACCENTS.get(accent, r"\hat"), self._child(el, "e"))
+        if name == "bar":
+            pos = self._prop(el, "barPr", "pos", "bot")
+            return "%s{%s}" % (r"\overline" if pos == "top" else r"\underline", self._child(el, "e"))
+        if name == "limLow":
+            return "{%s}_{%s}" % (self._child(el, "e"), self._child(el, "lim"))
+        if name == "limUpp":
+            return r"\overset{%s}{%s}" % (self._child(el, "lim"), self._child(el, "e"))
+        if name == "eqArr":
+            rows = [self._children(e) for e in el.findall(_m("e"))]
+            return r"\begin{array}{l} %s \end{array}" % r" \\ ".join(rows)
+        if name == "m":
+            rows = [" & ".join(self._children(e) for e in mr.findall(_m("e"))) for mr in el.findall(_m("mr"))]
+            return r"\begin{matrix} %s \end{matrix}" % r" \\ ".join(rows)
+        # box, borderBox, groupChr, phant, e, oMath...: chỉ lấy nội dung con
+        return self._children(el)
+
+
+class NativeDocxParser:
+    """Parse "Câu N." multiple-choice questions straight from DOCX XML.
+
+    Alternative to the pandoc → LaTeX → regex pipeline. The correct option is
+    the one whose "X." label is underlined in Word; OMML equations become
+    math blocks and embedded pictures become image blocks whose src is the
+    media filename, matching what pandoc's --extract-media produces.
+    """
+
+    def __init__(self):
+        self.omml = OmmlToLatex()
+
+    def parse(self, docx_path: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Return (questions as dicts, media part names referenced by them)"""
+        document = Document(docx_path)
+        underlined_styles = self._underlined_styles(document)
+        rels = document.part.rels
+
+        chars: List[str] = []
+        underline: List[bool] = []
+        objects: Dict[int, Dict[str, Any]] = {}
+        media: Dict[str, str] = {}  # tên file -> part name trong zip
+
+        def emit_text(text: str, is_underlined: bool):
+            chars.append(text)
+            underline.extend([is_underlined] * len(text))
+
+        def emit_object(block: Dict[str, Any]):
+            objects[len(underline)] = block
+            emit_text(_OBJ, False)
+
+        def image_block(r_id: Optional[str]) -> Optional[Dict[str, Any]]:
+            rel = rels.get(r_id) if r_id else None
+            if rel is None or rel.is_external:
+                return None
+            partname = str(rel.target_part.partname).lstrip("/")
+            filename = posixpath.basename(partname)
+            media[filename] = partname
+            return {"type": "image", "src": filename}
+
+        def walk_run(run):
+            is_underlined = self._run_underlined(run, underlined_styles)
+            for child in run:
+                tag = child.tag
+                if tag == _W_T:
+                    emit_text(child.text or "", is_underlined)
+                elif tag == _W_TAB:
+                    emit_text("\t", False)
+                elif tag in (_W_BR, _W_CR):
+                    emit_text("\n", False)
+                elif tag in (_W_DRAWING, _W_PICT, _W_OBJECT):
+                    for pic in child.iter(_A_BLIP, _V_IMAGEDATA):
+                        block = image_block(pic.get(_R_EMBED) or pic.get(_R_ID))
+                        if block:
+                            emit_object(block)
+                            break
+
+        def walk_inline(element):
+            for child in element:
+                tag = child.tag
+                if tag == _W_R:
+                    walk_run(child)
+                elif tag == _m("oMath"):
+                    emit_object({"type": "math", "content": "$%s$" % self.omml.convert(child)})
+                elif tag == _m("oMathPara"):
+                    for math in child.iter(_m("oMath")):
+                        emit_object({"type": "math", "content": "\\[%s\\]" % self.omml.convert(math)})
+                elif tag not in _W_SKIP:
+                    # hyperlink, ins, smartTag, sdt/sdtContent...
+                    walk_inline(child)
+
+        def walk_block(element):
+            for child in element:
+                if child.tag == _W_P:
+                    walk_inline(child)
+                    emit_text("\n", False)
+                elif child.tag == _W_TBL:
+                    for cell_paragraph in child.iter(_W_P):
+                        walk_inline(cell_paragraph)
+                        emit_text("\n", False)
+
+        walk_block(document.element.body)
+        text = "".join(chars)
+
+        questions = []
+        headers = list(_QUESTION_HEADER.finditer(text))
+        for idx, header in enumerate(headers, 1):
+            end = headers[idx].start() if idx < len(headers) else len(text)
+            questions.append(self._parse_question(idx, text, underline, objects, header.end(), end))
+
+        used = {
+            block["src"]
+            for question in questions
+            for blocks in [question["blocks"]] + [o["blocks"] for o in question["options"]]
+            for block in blocks
+            if block["type"] == "image"
+        }
+        return questions, [media[name] for name in sorted(used)]
+
+    def _parse_question(self, idx, text, underline, objects, start, end) -> Dict[str, Any]:
+        # Nhãn phải xuất hiện theo thứ tự A, B, C, D
+        labels = []
+        expected = "A"
+        for match in _OPTION_LABEL.finditer(text, start, end):
+            if match.group(1) == expected:
+                labels.append(match)
+                expected = chr(ord(expected) + 1)
+                if expected > "D":
+                    break
+
+        question_end = labels[0].start() if labels else end
+        options = []
+        correct = None
+        for i, match in enumerate(labels):
+            option_end = labels[i + 1].start() if i + 1 < len(labels) else end
+            label = match.group(1)
+            options.append({
+                "label": label,
+                "blocks": self._blocks(text, objects, match.end(), option_end)
+            })
+            if any(underline[match.start():match.end()]):
+                correct = label
+
+        return {
+            "id": idx,
+            "blocks": self._blocks(text, objects, start, question_end),
+            "options": options,
+            "correct": correct
+        }
+
+    @staticmethod
+    def _blocks(text: str, objects: Dict[int, Dict[str, Any]], start: int, end: int) -> List[Dict[str, Any]]:
+        blocks = []
+        last = start
+        pos = text.find(_OBJ, start, end)
+        while pos != -1:
+            segment = text[last:pos].strip()
+            if segment:
+                blocks.append({"type": "text", "content": segment})
+            blocks.append(dict(objects[pos]))
+            last = pos + 1
+            pos = text.find(_OBJ, last, end)
+        segment = text[last:end].strip()
+        if segment:
+            blocks.append({"type": "text", "content": segment})
+        return blocks
+
+    @staticmethod
+    def _underlined_styles(document) -> set:
+        styles = set()
+        for style in document.styles:
+            try:
+                if style.font.underline:
+                    styles.add(style.style_id)
+            except AttributeError:
+                continue
+        return styles
+
+    @staticmethod
+    def _run_underlined(run, underlined_styles: set) -> bool:
+        rpr = run.find(_W_RPR)
+        if rpr is None:
+            return False
+        u = rpr.find(_W_U)
+        if u is not None:
+            return u.get(_W_VAL, "single") != "none"
+        rstyle = rpr.find(_W_RSTYLE)
+        return rstyle is not None and rstyle.get(_W_VAL) in underlined_styles
+
+    @staticmethod
+    def extract_media(docx_path: str, partnames: List[str], media_dir: str) -> None:
+        """Write the referenced media parts to media_dir under their original filenames"""
+        os.makedirs(media_dir, exist_ok=True)
+        with zipfile.ZipFile(docx_path) as zf:
+            for partname in partnames:
+                with zf.open(partname) as src, open(os.path.join(media_dir, posixpath.basename(partname)), "wb") as dst:
+                    dst.write(src.read())
+
+    @staticmethod
+    def body_media_parts(docx_path: str) -> List[str]:
+        """Image parts related to the document body, textboxes included, and to the
+        foot/endnotes (not headers/footers), in rels order.
+
+        These are the images pandoc --extract-media writes, under the same
+        basenames.
+        """
+        with zipfile.ZipFile(docx_path) as zf:
+            names = set(zf.namelist())
+            rels_parts = [ElementTree.fromstring(zf.read(part)) for part in _PANDOC_RELS if part in names]
+        partnames = []
+        for rels in rels_parts:
+            for rel in rels.iter(_REL):
+                if rel.get("Type") != _REL_TYPE_IMAGE or rel.get("TargetMode") == "External":
+                    continue
+                # Target tương đối với thư mục word/ (hoặc tuyệt đối bắt đầu bằng "/")
+                target = rel.get("Target", "")
+                partname = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+                if partname in names and partname not in partnames:
+                    partnames.append(partname)
+        return partnames
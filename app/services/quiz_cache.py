@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# (st_mtime_ns, st_ino, st_size) của output.json tại thời điểm parse
+FileSignature = Tuple[int, int, int]
+
+# File nhỏ cạnh output.json, chỉ chứa đáp án: chấm bài không cần parse nội dung câu hỏi
+ANSWER_KEY_FILE = "answer_key.json"
+# Mảng câu hỏi đã bỏ đáp án, serialize sẵn cho GET /quiz/{quiz_uuid}
+PUBLIC_QUESTIONS_FILE = "public.json"
+
+
+def public_question(question: Dict[str, Any]) -> Dict[str, Any]:
+    """The question as students see it: no correct answer"""
+    return {
+        "id": question["id"],
+        "blocks": question["blocks"],
+        "options": [
+            {"label": option["label"], "blocks": option["blocks"]}
+            for option in question.get("options", [])
+        ],
+    }
+
+
+def dump_public_questions(questions: List[Dict[str, Any]]) -> bytes:
+    """Compact UTF-8 JSON array of the answer-free questions"""
+    return json.dumps(
+        [public_question(question) for question in questions], ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dump_answer_key(questions: List[Dict[str, Any]]) -> str:
+    """Serialize the answer key of processed questions as compact JSON.
+
+    Format: {"ids": [1, 2, ...], "correct": ["A", "C", ...]} (parallel arrays,
+    "" where no answer was marked).
+    """
+    return json.dumps(
+        {
+            "ids": [question["id"] for question in questions],
+            "correct": [question.get("correct") or "" for question in questions],
+        },
+        separators=(",", ":"),
+    )
+
+
+def load_answer_key(data: Dict[str, Any]) -> Dict[int, str]:
+    return dict(zip(data["ids"], data["correct"]))
+
+
+class PublicQuestions(NamedTuple):
+    signature: FileSignature
+    body: bytes  # JSON array, như trong public.json
+    digest: str  # sha256 của body
+
+
+class CachedQuiz(NamedTuple):
+    signature: FileSignature
+    questions: List[Dict[str, Any]]  # Payload câu hỏi đã bỏ đáp án đúng
+    answer_key: Dict[int, str]  # question_id -> correct
+
+
+class QuizCache:
+    """Process-wide LRU cache of parsed output.json files, keyed by exam UUID.
+
+    An entry is only reused while the file's mtime/inode/size are unchanged,
+    so a re-processed exam is picked up even without explicit invalidation.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, CachedQuiz]" = OrderedDict()
+        self._answer_keys: "OrderedDict[str, Tuple[FileSignature, Dict[int, str]]]" = OrderedDict()
+        self._public: "OrderedDict[str, PublicQuestions]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(json_path: str) -> FileSignature:
+        st = os.stat(json_path)
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    @staticmethod
+    def _build(signature: FileSignature, data: Dict[str, Any]) -> CachedQuiz:
+        questions = []
+        answer_key = {}
+        for question in data.get("questions", []):
+            questions.append(public_question(question))
+            answer_key[question["id"]] = question.get("correct") or ""
+        return CachedQuiz(signature=signature, questions=questions, answer_key=answer_key)
+
+    def get(self, quiz_uuid: str, json_path: str) -> Optional[CachedQuiz]:
+        """Return the cached quiz for quiz_uuid, (re)loading json_path if stale.
+
+        Returns None if the file does not exist.
+        """
+        try:
+            signature = self._signature(json_path)
+        except FileNotFoundError:
+            self.invalidate(quiz_uuid)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(quiz_uuid)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(quiz_uuid)
+                return entry
+
+        # Parse ngoài lock để các exam khác không phải chờ
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entry = self._build(signature, data)
+
+        with self._lock:
+            self._entries[quiz_uuid] = entry
+            self._entries.move_to_end(quiz_uuid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_answer_key(self, quiz_uuid: str, output_dir: str) -> Optional[Dict[int, str]]:
+        """Return question_id -> correct for the exam stored in output_dir.
+
+        Reads the compact answer_key.json written by DocxService; exams
+        processed before it existed fall back to parsing output.json.
+        Returns None if neither file exists.
+        """
+        key_path = os.path.join(output_dir, ANSWER_KEY_FILE)
+        try:
+            signature = self._signature(key_path)
+        except FileNotFoundError:
+            entry = self.get(quiz_uuid, os.path.join(output_dir, "output.json"))
+            return entry.answer_key if entry is not None else None
+
+        with self._lock:
+            cached = self._answer_keys.get(quiz_uuid)
+            if cached is not None and cached[0] == signature:
+                self._answer_keys.move_to_end(quiz_uuid)
+                return cached[1]
+
+        with open(key_path, "r", encoding="utf-8") as f:
+            answer_key = load_answer_key(json.load(f))
+
+        with self._lock:
+            self._answer_keys[quiz_uuid] = (signature, answer_key)
+            self._answer_keys.move_to_end(quiz_uuid)
+            while len(self._answer_keys) > self.max_entries:
+                self._answer_keys.popitem(last=False)
+        return answer_key
+
+    def get_public_questions(self, quiz_uuid: str, output_dir: str) -> Optional[PublicQuestions]:
+        """Serialized answer-free questions of the exam stored in output_dir.
+
+        Reads public.json as bytes (no parsing); exams processed before it
+        existed are serialized once from output.json. Returns None if
+        neither file exists.
+        """
+        public_path = os.path.join(output_dir, PUBLIC_QUESTIONS_FILE)
+        try:
+            signature = self._signature(public_path)
+        except FileNotFoundError:
+            entry = self.get(quiz_uuid, os.path.join(output_dir, "output.json"))
+            if entry is None:
+                return None
+            signature, body = entry.signature, None
+        else:
+            entry = None
+
+        with self._lock:
+            cached = self._public.get(quiz_uuid)
+            if cached is not None and cached.signature == signature:
+                self._public.move_to_end(quiz_uuid)
+                return cached
+
+        if entry is not None:
+            body = json.dumps(entry.questions, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        else:
+            with open(public_path, "rb") as f:
+                body = f.read()
+        public = PublicQuestions(signature, body, hashlib.sha256(body).hexdigest())
+
+        with self._lock:
+            self._public[quiz_uuid] = public
+            self._public.move_to_end(quiz_uuid)
+            while len(self._public) > self.max_entries:
+                self._public.popitem(last=False)
+        return public
+
+    def invalidate(self, quiz_uuid: str) -> None:
+        """Drop the cached entries for quiz_uuid, if any"""
+        with self._lock:
+            self._entries.pop(quiz_uuid, None)
+            self._answer_keys.pop(quiz_uuid, None)
+            self._public.pop(quiz_uuid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._answer_keys.clear()
+            self._public.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+quiz_cache = QuizCache(max_entries=int(os.getenv("QUIZ_CACHE_SIZE", "128")))
@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, IO, List, Optional, Set, Tuple
+from sqlalchemy.exc import DataError, IntegrityError
+from app.models.database import SessionLocal, utc_now
+from app.services.database_service import DatabaseService
+
+logger = logging.getLogger(__name__)
+
+IS_WINDOWS = sys.platform == "win32"
+
+if not IS_WINDOWS:
+    import fcntl
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """Journals written before completed_at was stored as naive UTC carry a +00:00 offset"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class ResultWriter:
+    """Write-behind buffer for ExamResult inserts.
+
+    submit() appends the row to a journal segment (fsync'd) and returns; a
+    background thread inserts buffered rows in one bulk insert when
+    batch_size rows are waiting or every flush_interval seconds. After a
+    successful insert the sealed segments are deleted. On start, segments
+    left by a crashed process are replayed; rows whose student already has
+    a result in the database are dropped, so a crash between commit and
+    segment deletion does not duplicate results.
+
+    Each process writes its own segments and holds an flock on them, so
+    several uvicorn workers can share journal_dir without replaying each
+    other's live journals.
+
+    A batch the database rejects (IntegrityError / DataError, e.g. the exam
+    room was deleted meanwhile) is retried row by row; rows that still fail
+    go to a quarantine-*.jsonl file in journal_dir and are logged instead of
+    blocking every later flush. Other errors (database unreachable) keep
+    the whole batch buffered for the next flush.
+    """
+
+    def __init__(self, journal_dir: str, batch_size: int = 200, flush_interval: float = 2.0, enabled: bool = False):
+        self.journal_dir = journal_dir
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._keys: Set[Tuple[str, str]] = set()  # (test_exam_uuid, student_username) chưa vào DB
+        self._segment: Optional[IO[str]] = None
+        self._sealed: List[IO[str]] = []
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    # --- journal ---
+
+    def _open_segment(self) -> IO[str]:
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = os.path.join(self.journal_dir, f"results-{os.getpid()}-{time.time_ns()}.jsonl")
+        segment = open(path, "a", encoding="utf-8")
+        if not IS_WINDOWS:
+            fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return segment
+
+    def _seal_segment(self):
+        """Close the current segment for appends; it is deleted once its rows are in the DB"""
+        if self._segment is not None:
+            self._sealed.append(self._segment)
+            self._segment = None
+
+    @staticmethod
+    def _remove_segment(segment: IO[str]):
+        try:
+            os.remove(segment.name)
+        except FileNotFoundError:
+            pass
+        segment.close()  # đóng file = nhả flock
+
+    def _replay(self):
+        """Load segments of dead processes into the buffer"""
+        if not os.path.isdir(self.journal_dir):
+            return
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not (name.startswith("results-") and name.endswith(".jsonl")):
+                continue
+            segment = open(os.path.join(self.journal_dir, name), "r+", encoding="utf-8")
+            if not IS_WINDOWS:
+                try:
+                    fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    segment.close()  # segment của worker khác đang chạy
+                    continue
+            rows = []
+            for line in segment:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # Dòng cuối bị cắt do crash giữa lúc ghi: bỏ qua
+                    logger.warning("Skipping truncated line in result journal %s", name)
+            for row in rows:
+                key = (row["test_exam_uuid"], row["student_username"])
+                if key not in self._keys:
+                    self._keys.add(key)
+                    self._pending.append(row)
+            self._sealed.append(segment)
+            logger.info("Replaying %d buffered exam results from %s", len(rows), name)
+
+    # --- public API ---
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        with self._lock:
+            self._replay()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+        if self._pending:
+            self._wakeup.set()
+
+    def stop(self):
+        """Flush what is buffered and stop the background thread"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def is_pending(self, test_exam_uuid: str, student_username: str) -> bool:
+        with self._lock:
+            return (test_exam_uuid, student_username) in self._keys
+
+    def pending_usernames(self, test_exam_uuid: str) -> Set[str]:
+        with self._lock:
+            return {username for exam_uuid, username in self._keys if exam_uuid == test_exam_uuid}
+
+    def submit(self, row: Dict[str, Any]) -> bool:
+        """Durably buffer one ExamResult row (column dict).
+
+        Returns False, without writing, if the same student already has a
+        buffered result for this test. Blocks on fsync: call it from a
+        worker thread, not the event loop.
+        """
+        return self.submit_many([row])[0]
+
+    def submit_many(self, rows: List[Dict[str, Any]]) -> List[bool]:
+        """Buffer several rows with one fsync; returns per row whether it was accepted"""
+        completed_at = utc_now().isoformat()
+        with self._lock:
+            accepted = []
+            flags = []
+            for row in rows:
+                key = (row["test_exam_uuid"], row["student_username"])
+                flags.append(key not in self._keys)
+                if not flags[-1]:
+                    continue
+                self._keys.add(key)
+                # Giữ thời điểm nộp thật, không phải thời điểm flush
+                accepted.append({**row, "completed_at": row.get("completed_at") or completed_at})
+            if not accepted:
+                return flags
+            if self._segment is None:
+                self._segment = self._open_segment()
+            self._segment.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in accepted))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._pending.extend(accepted)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return flags
+
+    def flush(self) -> int:
+        """Insert everything buffered so far. Returns the number of rows inserted."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                self._seal_segment()
+                sealed, self._sealed = self._sealed, []
+            if not rows:
+                for segment in sealed:
+                    self._remove_segment(segment)
+                return 0
+            try:
+                try:
+                    inserted = self._insert(rows)
+                except (IntegrityError, DataError):
+                    logger.warning("Bulk insert of %d buffered exam results was rejected, retrying row by row", len(rows))
+                    inserted = self._insert_row_by_row(rows)
+            except Exception:
+                logger.exception("Flushing %d buffered exam results failed, will retry", len(rows))
+                with self._lock:
+                    self._pending[:0] = rows
+                    self._sealed[:0] = sealed
+                return 0
+            for segment in sealed:
+                self._remove_segment(segment)
+            with self._lock:
+                for row in rows:
+                    self._keys.discard((row["test_exam_uuid"], row["student_username"]))
+            return inserted
+
+    def _insert_row_by_row(self, rows: List[Dict[str, Any]]) -> int:
+        """Insert rows one at a time and quarantine those the database still rejects"""
+        inserted = 0
+        rejected = []
+        for row in rows:
+            try:
+                inserted += self._insert([row])
+            except (IntegrityError, DataError) as exc:
+                logger.error(
+                    "Exam result of %s for %s was rejected by the database and quarantined: %s",
+                    row["student_username"], row["test_exam_uuid"], exc
+                )
+                rejected.append(row)
+        if rejected:
+            self._quarantine(rejected)
+        return inserted
+
+    def _quarantine(self, rows: List[Dict[str, Any]]):
+        """Keep rejected rows on disk for inspection; quarantine files are never replayed"""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = os.path.join(self.journal_dir, f"quarantine-{os.getpid()}-{time.time_ns()}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> int:
+        db = SessionLocal()
+        try:
+            db_service = DatabaseService(db)
+            by_exam: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            for row in rows:
+                by_exam[row["test_exam_uuid"]].append(row)
+            new_rows = []
+            for exam_uuid, exam_rows in by_exam.items():
+                # Bỏ các dòng đã có trong DB (replay sau khi crash giữa commit và xóa journal)
+                existing = db_service.get_submitted_usernames(exam_uuid, {r["student_username"] for r in exam_rows})
+                new_rows.extend(
+                    {**r, "completed_at": _naive_utc(datetime.fromisoformat(r["completed_at"]))}
+                    for r in exam_rows if r["student_username"] not in existing
+                )
+            return db_service.create_exam_results_bulk(new_rows)
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+
+result_writer = ResultWriter(
+    journal_dir=os.getenv("RESULT_JOURNAL_DIR", os.path.join("outputs", ".result-journal")),
+    batch_size=int(os.getenv("RESULT_WRITE_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("RESULT_WRITE_FLUSH_SECONDS", "2")),
+    enabled=os.getenv("RESULT_WRITE_BEHIND", "0") == "1",
+)
@@ -0,0 +1,228 @@
+import concurrent.futures
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.utils import metrics
+
+_CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+_CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+_CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+class ConversionQueueFullError(Exception):
+    """Raised when the image conversion queue stays full for longer than the admission timeout"""
+
+
+def _read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """CPU quota of this container in CPUs (cgroup v2 or v1), None when unlimited"""
+    cpu_max = _read_first_line(_CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max":
+            try:
+                return int(quota) / int(period or "100000")
+            except ValueError:
+                return None
+        return None
+    quota, period = _read_first_line(_CGROUP_V1_QUOTA), _read_first_line(_CGROUP_V1_PERIOD)
+    try:
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+    except ValueError:
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: affinity mask capped by the cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows / macOS
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+class _Task:
+    __slots__ = ("future", "fn", "args")
+
+    def __init__(self, future: concurrent.futures.Future, fn: Callable, args: Tuple):
+        self.future = future
+        self.fn = fn
+        self.args = args
+
+
+class ConversionBatch:
+    """Tasks of one upload. Obtained from ConversionScheduler.batch()."""
+
+    def __init__(self, scheduler: "ConversionScheduler"):
+        self._scheduler = scheduler
+
+    def submit(self, fn: Callable, *args: Any) -> concurrent.futures.Future:
+        return self._scheduler._enqueue(self, fn, args)
+
+    def map(self, fn: Callable, iterable: Iterable) -> List[Any]:
+        futures = [self.submit(fn, item) for item in iterable]
+        return [future.result() for future in futures]
+
+    def __enter__(self) -> "ConversionBatch":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # Task chưa chạy (lỗi giữa chừng / không ai chờ) bị hủy, không chiếm worker
+        self._scheduler._cancel(self)
+
+
+class ConversionScheduler:
+    """Process-wide pool of image conversion workers shared by all uploads.
+
+    Each upload opens a batch; workers take tasks from the open batches in
+    round-robin order, so a small upload is not stuck behind a large one.
+    At most queue_limit tasks wait at a time. A new batch is admitted only
+    when the queue has room, waiting up to queue_timeout seconds (0 fails
+    immediately) before raising ConversionQueueFullError; tasks of an
+    admitted batch simply wait for room. Worker threads start on first use.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_limit: int = 256, queue_timeout: float = 30.0):
+        self.workers = max(1, workers or available_cpus())
+        self.queue_limit = max(1, queue_limit)
+        self.queue_timeout = queue_timeout
+        # batch -> task đang chờ; thứ tự = lượt phục vụ round-robin
+        self._queues: "OrderedDict[ConversionBatch, Deque[_Task]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._queued = 0
+        self._active = 0
+        self._open_batches = 0
+        self._completed = 0
+        self._rejected = 0
+        self._closed = False
+
+    def batch(self) -> ConversionBatch:
+        """Admit a new upload, waiting up to queue_timeout for queue room"""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            while self._queued >= self.queue_limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._rejected += 1
+                    metrics.conversion_rejected()
+                    raise ConversionQueueFullError("Too many images waiting for conversion, try again later")
+                self._cond.wait(remaining)
+            self._open_batches += 1
+            self._start_workers()
+        return ConversionBatch(self)
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._work, name=f"conversion-{len(self._threads)}", daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _enqueue(self, batch: ConversionBatch, fn: Callable, args: Tuple) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._cond:
+            while self._queued >= self.queue_limit and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Conversion scheduler is shut down")
+            self._queues.setdefault(batch, deque()).append(_Task(future, fn, args))
+            self._queued += 1
+            self._report()
+            self._cond.notify_all()
+        return future
+
+    def _cancel(self, batch: ConversionBatch) -> None:
+        with self._cond:
+            tasks = self._queues.pop(batch, ())
+            for task in tasks:
+                task.future.cancel()
+            self._queued -= len(tasks)
+            self._open_batches -= 1
+            self._report()
+            self._cond.notify_all()
+
+    def _next_task(self) -> _Task:
+        # Lấy 1 task của batch đầu hàng rồi đưa batch đó xuống cuối (round-robin)
+        batch, tasks = self._queues.popitem(last=False)
+        task = tasks.popleft()
+        if tasks:
+            self._queues[batch] = tasks
+        self._queued -= 1
+        return task
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queues and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                task = self._next_task()
+                self._active += 1
+                self._report()
+                # Có chỗ trống trong hàng đợi: đánh thức upload đang chờ
+                self._cond.notify_all()
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.fn(*task.args))
+                    except BaseException as exc:
+                        task.future.set_exception(exc)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._completed += 1
+                    self._report()
+
+    def _report(self) -> None:
+        metrics.conversion_scheduler_state(self._queued, self._active)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue length and busy workers of this process"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": self._queued,
+                "queue_limit": self.queue_limit,
+                "open_batches": self._open_batches,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        """Cancel waiting tasks and stop the workers once their current task is done"""
+        with self._cond:
+            self._closed = True
+            for tasks in self._queues.values():
+                for task in tasks:
+                    task.future.cancel()
+            self._queues.clear()
+            self._queued = 0
+            self._report()
+            self._cond.notify_all()
+
+
+conversion_scheduler = ConversionScheduler(
+    workers=int(os.getenv("CONVERSION_WORKERS", "0")) or None,
+    queue_limit=int(os.getenv("CONVERSION_QUEUE_LIMIT", "256")),
+    queue_timeout=float(os.getenv("CONVERSION_QUEUE_TIMEOUT", "30")),
+)
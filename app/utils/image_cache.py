@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IS_WINDOWS = sys.platform == "win32"
+
+if not IS_WINDOWS:
+    import fcntl
+
+
+class ImageCache:
+    """On-disk cache of converted WebP files, shared by all exams and workers.
+
+    Keys are the SHA-256 of the source image bytes plus a string describing
+    the conversion settings, so changing the pipeline never serves stale
+    output. Files are written via rename (readers never see partial files),
+    recency is tracked with mtime, and eviction runs under an flock so
+    several uvicorn workers can share one directory. Hit/miss counters are
+    per process.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0  # IMAGE_CACHE_MAX_MB=0 tắt cache
+        self.hits = 0
+        self.misses = 0
+        self._approx_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source_path: str, settings: str) -> str:
+        digest = hashlib.sha256(settings.encode("utf-8"))
+        digest.update(b"\0")
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.webp")
+
+    def get(self, key: str, dest_path: str) -> bool:
+        """Copy the cached WebP for key to dest_path. Returns False on a miss."""
+        cached = self._path(key)
+        try:
+            shutil.copyfile(cached, dest_path)
+            os.utime(cached)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, webp_path: str) -> None:
+        """Store a freshly converted WebP under key"""
+        cached = self._path(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_path = f"{cached}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(webp_path, tmp_path)
+            os.replace(tmp_path, cached)
+        except OSError as exc:
+            logger.warning("Could not store %s in image cache: %s", webp_path, exc)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        size = os.path.getsize(cached)
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._total_bytes()
+            else:
+                self._approx_bytes += size
+            over_limit = self._approx_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith(".webp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _total_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    @contextmanager
+    def _evict_lock(self) -> Iterator[None]:
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            if not IS_WINDOWS:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if not IS_WINDOWS:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache is under 90% of max_bytes"""
+        with self._evict_lock():
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self._approx_bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "enabled": self.enabled,
+        }
+
+
+image_cache = ImageCache(
+    root=os.getenv("IMAGE_CACHE_DIR", os.path.join("outputs", ".image-cache")),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
@@ -1,11 +1,20 @@
 import concurrent.futures
 import logging
+import multiprocessing
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
-from typing import Dict, List, Tuple
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils import metrics
+from app.utils.conversion_scheduler import ConversionBatch, conversion_scheduler
+from app.utils.image_cache import image_cache
+from app.utils.raster_webp import RASTER_EXTS, convert_raster_to_webp, image_size, write_variants
+from app.utils.soffice_pool import soffice_pool
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +24,86 @@ IS_WINDOWS = sys.platform == "win32"
 # Upscale lên 3x (= ~288 DPI equivalent) để text/ký hiệu toán sắc nét.
 _SOFFICE_UPSCALE = "300%"
 
+_VECTOR_EXTS = (".wmf", ".emf")
+
+# Mô tả thiết lập convert cho từng đường; là một phần của key ImageCache.
+# Đổi tham số convert thì phải đổi chuỗi tương ứng.
+_CACHE_SETTINGS = {
+    "soffice": f"soffice-png|trim|lanczos-{_SOFFICE_UPSCALE}|unsharp-0x1+0.5+0|border-12|webp-lossless-q100",
+    "magick_vector": "magick-density-300|trim|lanczos-200%|unsharp-0x1+0.5+0|border-12|alpha-remove|webp-lossless-q100",
+    "raster": "webp-lossless-q100",
+}
+
+
+RASTER_ENGINES = ("pillow", "magick")
+
+# Bản thu nhỏ (lossy) sinh thêm cho mỗi ảnh đã convert: (tên, chiều rộng tối đa, quality).
+# Bản gốc lossless vẫn là "src"; client chọn bản phù hợp màn hình qua Block.variants
+IMAGE_VARIANTS = (("thumb", 160, 70), ("mobile", 480, 80))
+
+
+class RasterPool:
+    """Lazily started process pool for the Pillow raster path.
+
+    Encoding WebP holds the GIL for most of the work, so it runs in child
+    processes; the ConversionScheduler threads only submit and wait, which
+    keeps the number of conversions in flight bounded by the scheduler.
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        self.processes = processes
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args) -> concurrent.futures.Future:
+        with self._lock:
+            if self._executor is None:
+                # forkserver: không fork process đang có nhiều thread (uvicorn, scheduler)
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes or conversion_scheduler.workers, mp_context=context
+                )
+            return self._executor.submit(fn, *args)
+
+    def reset(self) -> None:
+        """Drop a broken pool (a child crashed); the next submit starts a new one"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        self.reset()
+
+
+raster_pool = RasterPool(processes=int(os.getenv("RASTER_PROCESSES", "0")) or None)
+
 
 class ImageUtils:
+    def __init__(
+        self,
+        soffice_batch: Optional[bool] = None,
+        raster_engine: Optional[str] = None,
+        variants: Optional[bool] = None
+    ):
+        # Batch mode gom tất cả WMF/EMF của một tài liệu vào ít lần gọi soffice
+        # (xem SofficePool); tắt bằng SOFFICE_BATCH=0 để quay về 1 process/ảnh
+        if soffice_batch is None:
+            soffice_batch = os.getenv("SOFFICE_BATCH", "1") != "0"
+        self.soffice_batch = soffice_batch
+        # PNG/JPEG/GIF: Pillow trong process pool (mặc định), ImageMagick khi Pillow
+        # không xử lý được; RASTER_ENGINE=magick để luôn dùng ImageMagick
+        if raster_engine is None:
+            raster_engine = os.getenv("RASTER_ENGINE", "pillow")
+        if raster_engine not in RASTER_ENGINES:
+            raise ValueError(f"Unknown raster engine: {raster_engine}")
+        self.raster_engine = raster_engine
+        # IMAGE_VARIANTS=0: chỉ sinh bản WebP đầy đủ như trước
+        if variants is None:
+            variants = os.getenv("IMAGE_VARIANTS", "1") != "0"
+        self.variants = variants
+
     def convert_extracted_images(self, image_dir: str = "media") -> Dict[str, str]:
         if not os.path.exists(image_dir):
             logger.error("Image directory does not exist: %s", image_dir)
@@ -33,23 +120,194 @@ class ImageUtils:
             webp_path = os.path.join(image_dir, webp_filename)
             tasks.append((filepath, webp_path, filename))
 
-        def _convert_wmf_with_soffice(filepath: str, webp_path: str) -> bool:
-            tmp_dir = tempfile.mkdtemp(prefix="lo_")
-            try:
-                base_name = os.path.splitext(os.path.basename(filepath))[0]
-                png_path = os.path.join(tmp_dir, f"{base_name}.png")
+        results: Dict[str, bool] = {}
+        cache_keys: Dict[str, str] = {}
+        if image_cache.enabled:
+            # Ảnh trùng (logo, công thức...) đã convert ở đề khác: copy thẳng WebP
+            pending = []
+            for filepath, webp_path, original_filename in tasks:
+                key = image_cache.key(filepath, self._cache_settings(filepath))
+                if image_cache.get(key, webp_path):
+                    results[filepath] = True
+                else:
+                    cache_keys[filepath] = key
+                    pending.append((filepath, webp_path, original_filename))
+        else:
+            pending = tasks
+
+        use_batch = self.soffice_batch and not IS_WINDOWS
+        vector_tasks = [t for t in pending if use_batch and self._is_vector(t[0])]
+        other_tasks = [t for t in pending if not (use_batch and self._is_vector(t[0]))]
+
+        # Pool dùng chung cho cả process (xem ConversionScheduler): nhiều upload
+        # cùng lúc không nhân số process convert lên theo số upload
+        with conversion_scheduler.batch() as batch:
+            other_futures = [batch.submit(self.convert_task, t[0], t[1]) for t in other_tasks]
+            if vector_tasks:
+                results.update(self._convert_vectors_batched(vector_tasks, batch))
+            for (filepath, _, _), future in zip(other_tasks, other_futures):
+                results[filepath] = future.result()
+
+        for filepath, webp_path, _ in pending:
+            if results.get(filepath) and filepath in cache_keys:
+                image_cache.put(cache_keys[filepath], webp_path)
+
+        for filepath, webp_path, original_filename in tasks:
+            if results.get(filepath):
+                images_map[original_filename] = os.path.basename(webp_path)
+                try:
+                    os.remove(filepath)
+                except OSError as exc:
+                    logger.warning("Could not delete original file %s: %s", filepath, exc)
+            else:
+                images_map[original_filename] = original_filename
+                logger.warning("Kept original file due to conversion failure: %s", original_filename)
+
+        if self.variants:
+            self.write_variants([webp_path for filepath, webp_path, _ in tasks if results.get(filepath)])
+
+        return images_map
+
+    def write_variants(self, webp_paths: List[str]) -> None:
+        """Write the IMAGE_VARIANTS of converted images next to them (best effort)"""
+        if not webp_paths:
+            return
+        with conversion_scheduler.batch() as batch:
+            futures = [batch.submit(self._write_variants_task, webp_path) for webp_path in webp_paths]
+            for future in futures:
+                future.result()
+
+    @staticmethod
+    def _write_variants_task(webp_path: str) -> bool:
+        try:
+            with metrics.image_conversion("pillow_variants"):
+                raster_pool.submit(write_variants, os.path.abspath(webp_path), IMAGE_VARIANTS).result(timeout=40)
+            return True
+        except Exception as exc:
+            metrics.subprocess_failed("pillow")
+            logger.error("Could not write variants of %s: %s", webp_path, exc)
+            return False
+
+    @staticmethod
+    def describe_image(media_dir: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Size of media_dir/filename and of the variants written for it.
+
+        Returns {"width", "height", "variants": [{"name", "filename", "width", "height"}]},
+        or None when the file cannot be read.
+        """
+        size = image_size(os.path.join(media_dir, filename))
+        if size is None:
+            return None
+        stem = os.path.splitext(filename)[0]
+        variants = []
+        for name, _, _ in IMAGE_VARIANTS:
+            variant_filename = f"{stem}.{name}.webp"
+            variant_size = image_size(os.path.join(media_dir, variant_filename))
+            if variant_size is not None:
+                variants.append({
+                    "name": name, "filename": variant_filename,
+                    "width": variant_size[0], "height": variant_size[1],
+                })
+        return {"width": size[0], "height": size[1], "variants": variants}
+
+    @staticmethod
+    def _is_vector(filepath: str) -> bool:
+        return os.path.splitext(filepath)[1].lower() in _VECTOR_EXTS
+
+    def _cache_settings(self, filepath: str) -> str:
+        if not self._is_vector(filepath):
+            return _CACHE_SETTINGS["raster"]
+        return _CACHE_SETTINGS["magick_vector" if IS_WINDOWS else "soffice"]
+
+    @staticmethod
+    def cache_stats() -> Dict[str, Any]:
+        """Hit/miss counters (this process) and size of the converted image cache"""
+        return image_cache.stats()
+
+    def _convert_vectors_batched(
+        self,
+        vector_tasks: List[Tuple[str, str, str]],
+        batch: ConversionBatch,
+    ) -> Dict[str, bool]:
+        """WMF/EMF → PNG qua SofficePool (ít lần gọi soffice), rồi PNG → WebP song song"""
+        tmp_dir = tempfile.mkdtemp(prefix="lo_batch_")
+        try:
+            png_map = soffice_pool.convert_to_png([t[0] for t in vector_tasks], tmp_dir)
+            futures = {
+                filepath: batch.submit(self._soffice_png_to_webp, png_map[filepath], webp_path, filepath)
+                for filepath, webp_path, _ in vector_tasks
+                if filepath in png_map
+            }
+            return {
+                filepath: (filepath in futures and futures[filepath].result())
+                for filepath, _, _ in vector_tasks
+            }
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _soffice_png_to_webp(self, png_path: str, webp_path: str, filepath: str) -> bool:
+        """Hậu xử lý PNG do soffice xuất ra thành WebP"""
+        try:
+            with metrics.image_conversion("convert"):
+                subprocess.run(
+                    [
+                        "convert",
+                        png_path,
+                        # Trim canvas thừa của soffice
+                        "-trim",
+                        "+repage",
+                        # Upscale 3x với Lanczos (tốt nhất cho text/line art)
+                        # soffice xuất 96 DPI → sau upscale ~288 DPI
+                        "-filter", "Lanczos",
+                        "-resize", _SOFFICE_UPSCALE,
+                        # Sharpen nhẹ sau upscale để text sắc nét hơn
+                        "-unsharp", "0x1+0.5+0",
+                        # Padding nhỏ
+                        "-bordercolor", "white",
+                        "-border", "12",
+                        # Lossless WebP để không mất chất lượng
+                        "-define", "webp:lossless=true",
+                        "-quality", "100",
+                        webp_path,
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    timeout=60,
+                )
+            return True
+        except subprocess.CalledProcessError as exc:
+            metrics.subprocess_failed("convert")
+            logger.error("ImageMagick conversion failed for %s: %s", filepath, exc.stderr)
+            return False
+        except subprocess.TimeoutExpired:
+            metrics.subprocess_timed_out("convert")
+            logger.error("ImageMagick conversion timeout for %s", filepath)
+            return False
+        except Exception as exc:
+            metrics.subprocess_failed("convert")
+            logger.error("Unexpected ImageMagick conversion error for %s: %s", filepath, exc)
+            return False
+
+    def _convert_wmf_with_soffice(self, filepath: str, webp_path: str) -> bool:
+        """Một lần gọi soffice với profile mới cho mỗi ảnh (đường cũ, khi SOFFICE_BATCH=0)"""
+        tmp_dir = tempfile.mkdtemp(prefix="lo_")
+        try:
+            base_name = os.path.splitext(os.path.basename(filepath))[0]
+            png_path = os.path.join(tmp_dir, f"{base_name}.png")
 
-                profile_dir = os.path.join(tmp_dir, "profile")
-                os.makedirs(profile_dir, exist_ok=True)
+            profile_dir = os.path.join(tmp_dir, "profile")
+            os.makedirs(profile_dir, exist_ok=True)
 
-                env = os.environ.copy()
-                env["HOME"] = tmp_dir
-                env["JAVA_HOME"] = "/usr/lib/jvm/default-java"
-                env["JRE_HOME"] = "/usr/lib/jvm/default-java"
-                env["PATH"] = f"{env.get('PATH', '')}:/usr/lib/jvm/default-java/bin"
+            env = os.environ.copy()
+            env["HOME"] = tmp_dir
+            env["JAVA_HOME"] = "/usr/lib/jvm/default-java"
+            env["JRE_HOME"] = "/usr/lib/jvm/default-java"
+            env["PATH"] = f"{env.get('PATH', '')}:/usr/lib/jvm/default-java/bin"
 
-                user_installation = f"-env:UserInstallation=file://{profile_dir}"
+            user_installation = f"-env:UserInstallation=file://{profile_dir}"
 
+            with metrics.image_conversion("soffice"):
                 result = subprocess.run(
                     [
                         "soffice",
@@ -72,92 +330,92 @@ class ImageUtils:
                     env=env,
                 )
 
-                if not os.path.exists(png_path):
-                    logger.error(
-                        "soffice conversion failed for %s.\nstdout: %s\nstderr: %s",
-                        filepath,
-                        result.stdout,
-                        result.stderr,
-                    )
-                    return False
+            if not os.path.exists(png_path):
+                metrics.subprocess_failed("soffice")
+                logger.error(
+                    "soffice conversion failed for %s.\nstdout: %s\nstderr: %s",
+                    filepath,
+                    result.stdout,
+                    result.stderr,
+                )
+                return False
 
-                subprocess.run(
-                    [
-                        "convert",
-                        png_path,
-                        # Trim canvas thừa của soffice
+            return self._soffice_png_to_webp(png_path, webp_path, filepath)
+
+        except subprocess.TimeoutExpired:
+            metrics.subprocess_timed_out("soffice")
+            logger.error("soffice conversion timeout for %s", filepath)
+            return False
+        except Exception as exc:
+            metrics.subprocess_failed("soffice")
+            logger.error("Unexpected soffice conversion error for %s: %s", filepath, exc)
+            return False
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _convert_raster_pillow(self, filepath: str, webp_path: str) -> bool:
+        """PNG/JPEG/GIF → lossless WebP in the raster process pool; False means use ImageMagick"""
+        try:
+            with metrics.image_conversion("pillow"):
+                # Đường dẫn tuyệt đối: process con giữ cwd lúc pool được tạo
+                ok = raster_pool.submit(
+                    convert_raster_to_webp, os.path.abspath(filepath), os.path.abspath(webp_path)
+                ).result(timeout=40)
+        except BrokenProcessPool:
+            metrics.subprocess_failed("pillow")
+            logger.error("Raster process pool crashed on %s, falling back to ImageMagick", filepath)
+            raster_pool.reset()
+            return False
+        except Exception as exc:
+            metrics.subprocess_failed("pillow")
+            logger.error("Pillow conversion error for %s: %s", filepath, exc)
+            return False
+        if not ok:
+            logger.info("Pillow cannot convert %s, falling back to ImageMagick", filepath)
+        return ok
+
+    def convert_task(self, filepath: str, webp_path: str) -> bool:
+        ext = os.path.splitext(filepath)[1].lower()
+        if self.raster_engine == "pillow" and ext in RASTER_EXTS and self._convert_raster_pillow(filepath, webp_path):
+            return True
+        tool = "magick" if IS_WINDOWS else "convert"
+        try:
+            if IS_WINDOWS:
+                if ext in _VECTOR_EXTS:
+                    cmd = [
+                        "magick",
+                        # density cao để render vector WMF sắc nét
+                        "-density", "300",
+                        filepath,
                         "-trim",
                         "+repage",
-                        # Upscale 3x với Lanczos (tốt nhất cho text/line art)
-                        # soffice xuất 96 DPI → sau upscale ~288 DPI
                         "-filter", "Lanczos",
-                        "-resize", _SOFFICE_UPSCALE,
-                        # Sharpen nhẹ sau upscale để text sắc nét hơn
+                        "-resize", "200%",
                         "-unsharp", "0x1+0.5+0",
-                        # Padding nhỏ
                         "-bordercolor", "white",
                         "-border", "12",
-                        # Lossless WebP để không mất chất lượng
+                        "-alpha", "remove",
                         "-define", "webp:lossless=true",
                         "-quality", "100",
                         webp_path,
-                    ],
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=60,
-                )
-                return True
-
-            except subprocess.CalledProcessError as exc:
-                logger.error("ImageMagick conversion failed for %s: %s", filepath, exc.stderr)
-                return False
-            except subprocess.TimeoutExpired:
-                logger.error("soffice conversion timeout for %s", filepath)
-                return False
-            except Exception as exc:
-                logger.error("Unexpected soffice conversion error for %s: %s", filepath, exc)
-                return False
-            finally:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-
-        def convert_task(filepath: str, webp_path: str) -> bool:
-            ext = os.path.splitext(filepath)[1].lower()
-            try:
-                if IS_WINDOWS:
-                    if ext in [".wmf", ".emf"]:
-                        cmd = [
-                            "magick",
-                            # density cao để render vector WMF sắc nét
-                            "-density", "300",
-                            filepath,
-                            "-trim",
-                            "+repage",
-                            "-filter", "Lanczos",
-                            "-resize", "200%",
-                            "-unsharp", "0x1+0.5+0",
-                            "-bordercolor", "white",
-                            "-border", "12",
-                            "-alpha", "remove",
-                            "-define", "webp:lossless=true",
-                            "-quality", "100",
-                            webp_path,
-                        ]
-                    else:
-                        cmd = [
-                            "magick",
-                            filepath,
-                            "-define", "webp:lossless=true",
-                            "-quality", "100",
-                            webp_path,
-                        ]
+                    ]
+                else:
+                    cmd = [
+                        "magick",
+                        filepath,
+                        "-define", "webp:lossless=true",
+                        "-quality", "100",
+                        webp_path,
+                    ]
+                with metrics.image_conversion(tool):
                     subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=90)
-                    return True
+                return True
 
-                if ext in [".wmf", ".emf"]:
-                    return _convert_wmf_with_soffice(filepath, webp_path)
+            if ext in _VECTOR_EXTS:
+                return self._convert_wmf_with_soffice(filepath, webp_path)
 
-                # PNG/JPG/GIF → WebP lossless
+            # PNG/JPG/GIF → WebP lossless
+            with metrics.image_conversion(tool):
                 subprocess.run(
                     [
                         "convert",
@@ -171,30 +429,17 @@ class ImageUtils:
                     text=True,
                     timeout=40,
                 )
-                return True
-
-            except subprocess.CalledProcessError as exc:
-                logger.error("Conversion failed for %s: %s", filepath, exc.stderr)
-                return False
-            except subprocess.TimeoutExpired:
-                logger.error("Conversion timeout for %s", filepath)
-                return False
-            except Exception as exc:
-                logger.error("Unexpected conversion error for %s: %s", filepath, exc)
-                return False
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            results = list(executor.map(lambda t: convert_task(t[0], t[1]), tasks))
-
-        for i, (filepath, webp_path, original_filename) in enumerate(tasks):
-            if results[i]:
-                images_map[original_filename] = os.path.basename(webp_path)
-                try:
-                    os.remove(filepath)
-                except OSError as exc:
-                    logger.warning("Could not delete original file %s: %s", filepath, exc)
-            else:
-                images_map[original_filename] = original_filename
-                logger.warning("Kept original file due to conversion failure: %s", original_filename)
+            return True
 
-        return images_map
\ No newline at end of file
+        except subprocess.CalledProcessError as exc:
+            metrics.subprocess_failed(tool)
+            logger.error("Conversion failed for %s: %s", filepath, exc.stderr)
+            return False
+        except subprocess.TimeoutExpired:
+            metrics.subprocess_timed_out(tool)
+            logger.error("Conversion timeout for %s", filepath)
+            return False
+        except Exception as exc:
+            metrics.subprocess_failed(tool)
+            logger.error("Unexpected conversion error for %s: %s", filepath, exc)
+            return False
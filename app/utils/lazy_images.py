@@ -0,0 +1,219 @@
+import concurrent.futures
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from app.utils.image_utils import ImageUtils
+
+logger = logging.getLogger(__name__)
+
+WEBP_SUFFIX = ".webp"
+# Thư mục tạm bắt đầu bằng "." nên không bao giờ được phục vụ qua /outputs
+_SCRATCH_PREFIX = ".lazy-"
+# Đánh dấu exam được xử lý ở lazy mode (outputs/<uuid>/.lazy-images).
+# Exam xử lý bình thường có ảnh convert lỗi thì giữ URL ảnh gốc, không convert lại
+LAZY_MARKER = ".lazy-images"
+# Pre-warm convert theo từng nhóm: request đang chờ một ảnh chỉ phải đợi nhóm của nó
+PREWARM_CHUNK = 16
+
+
+def planned_images_map(image_dir: str) -> Dict[str, str]:
+    """images_map for lazy mode: every media file is (or will be) served as <stem>.webp"""
+    if not os.path.isdir(image_dir):
+        return {}
+    return {
+        filename: f"{os.path.splitext(filename)[0]}{WEBP_SUFFIX}"
+        for filename in os.listdir(image_dir)
+        if not filename.startswith(".") and os.path.isfile(os.path.join(image_dir, filename))
+    }
+
+
+def is_lazy(output_dir: str) -> bool:
+    return os.path.exists(os.path.join(output_dir, LAZY_MARKER))
+
+
+def mark_lazy(output_dir: str, lazy: bool) -> None:
+    marker = os.path.join(output_dir, LAZY_MARKER)
+    if lazy:
+        with open(marker, "w", encoding="utf-8"):
+            pass
+    elif os.path.exists(marker):
+        os.remove(marker)
+
+
+def pending_sources(media_dir: str) -> List[str]:
+    """Media files that have not been converted to WebP yet"""
+    try:
+        names = os.listdir(media_dir)
+    except OSError:
+        return []
+    return sorted(
+        name for name in names
+        if not name.startswith(".")
+        and not name.lower().endswith(WEBP_SUFFIX)
+        and os.path.isfile(os.path.join(media_dir, name))
+    )
+
+
+class LazyImageConverter:
+    """Converts media of lazily processed exams when they are first needed.
+
+    With DOCX_LAZY_IMAGES=1, DocxService stops after parsing: output.json
+    already points at <stem>.webp, while media/ still holds the originals
+    and the exam folder carries LAZY_MARKER.
+    The /outputs handler calls ensure_webp on a missing WebP, and pre-warm
+    converts whatever is left of an exam in the background.
+
+    Conversions of the same file are single-flight inside a process. Every
+    conversion runs in a private scratch directory and is moved into place
+    with os.replace, so another worker process converting the same file
+    never exposes a half-written WebP.
+    """
+
+    def __init__(self, image_utils: Optional[ImageUtils] = None, max_warmed: int = 4096):
+        # Ảnh convert muộn không có variants: output.json đã được ghi từ trước
+        self.image_utils = image_utils or ImageUtils(variants=False)
+        self.max_warmed = max(1, max_warmed)
+        # webp path -> Future(đường dẫn file sẽ phục vụ) của lần convert đang chạy
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        # exam đã pre-warm (hoặc đang chờ) trong process này
+        self._warmed: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="lazy-prewarm")
+
+    @staticmethod
+    def find_source(media_dir: str, webp_name: str) -> Optional[str]:
+        stem = os.path.splitext(webp_name)[0]
+        for name in pending_sources(media_dir):
+            if os.path.splitext(name)[0] == stem:
+                return name
+        return None
+
+    def ensure_webp(self, media_dir: str, webp_name: str) -> Optional[str]:
+        """Path of the file to serve for media_dir/webp_name, converting it if needed.
+
+        Returns the original image when conversion failed (so it can still be
+        shown), or None when there is nothing to serve.
+        """
+        webp_path = os.path.join(media_dir, webp_name)
+        if os.path.isfile(webp_path):
+            return webp_path
+        if not is_lazy(os.path.dirname(media_dir)):
+            return None
+        source = self.find_source(media_dir, webp_name)
+        if source is None:
+            return None
+        return self.convert(media_dir, [source]).get(source)
+
+    def convert(self, media_dir: str, sources: List[str]) -> Dict[str, str]:
+        """Convert sources (filenames in media_dir); returns source -> path to serve"""
+        owned: Dict[str, concurrent.futures.Future] = {}
+        waiting: Dict[str, concurrent.futures.Future] = {}
+        with self._lock:
+            for source in sources:
+                webp_path = os.path.join(media_dir, f"{os.path.splitext(source)[0]}{WEBP_SUFFIX}")
+                future = self._inflight.get(webp_path)
+                if future is None:
+                    future = owned[source] = self._inflight[webp_path] = concurrent.futures.Future()
+                else:
+                    waiting[source] = future
+
+        results: Dict[str, str] = {}
+        try:
+            if owned:
+                results.update(self._convert_now(media_dir, list(owned)))
+        finally:
+            with self._lock:
+                for source, future in owned.items():
+                    webp_path = os.path.join(media_dir, f"{os.path.splitext(source)[0]}{WEBP_SUFFIX}")
+                    self._inflight.pop(webp_path, None)
+                    future.set_result(results.get(source))
+        for source, future in waiting.items():
+            served = future.result()
+            if served is not None:
+                results[source] = served
+        return results
+
+    def _convert_now(self, media_dir: str, sources: List[str]) -> Dict[str, str]:
+        scratch = tempfile.mkdtemp(prefix=_SCRATCH_PREFIX, dir=media_dir)
+        served: Dict[str, str] = {}
+        try:
+            for source in sources:
+                try:
+                    shutil.copy2(os.path.join(media_dir, source), scratch)
+                except OSError:
+                    # Process khác vừa convert xong và xóa file gốc
+                    pass
+            images_map = self.image_utils.convert_extracted_images(scratch)
+            for source in sources:
+                webp_name = f"{os.path.splitext(source)[0]}{WEBP_SUFFIX}"
+                webp_path = os.path.join(media_dir, webp_name)
+                if images_map.get(source) == webp_name:
+                    os.replace(os.path.join(scratch, webp_name), webp_path)
+                    try:
+                        os.remove(os.path.join(media_dir, source))
+                    except OSError:
+                        pass
+                if os.path.isfile(webp_path):
+                    served[source] = webp_path
+                elif os.path.isfile(os.path.join(media_dir, source)):
+                    served[source] = os.path.join(media_dir, source)
+            return served
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def prewarm(self, request_uuid: str) -> int:
+        """Convert every pending image of an exam; returns how many were converted"""
+        media_dir = os.path.join("outputs", request_uuid, "media")
+        if not is_lazy(os.path.dirname(media_dir)):
+            return 0
+        sources = pending_sources(media_dir)
+        if not sources:
+            return 0
+        converted = 0
+        for start in range(0, len(sources), PREWARM_CHUNK):
+            served = self.convert(media_dir, sources[start:start + PREWARM_CHUNK])
+            converted += sum(1 for path in served.values() if path.endswith(WEBP_SUFFIX))
+        return converted
+
+    def schedule_prewarm(self, request_uuid: str, delay: float = 0) -> None:
+        """Queue prewarm(request_uuid) once per exam and process (after delay seconds)"""
+        with self._lock:
+            if request_uuid in self._warmed:
+                self._warmed.move_to_end(request_uuid)
+                return
+            self._warmed[request_uuid] = True
+            while len(self._warmed) > self.max_warmed:
+                self._warmed.popitem(last=False)
+        if delay > 0:
+            timer = threading.Timer(delay, self._submit_prewarm, (request_uuid,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._submit_prewarm(request_uuid)
+
+    def _submit_prewarm(self, request_uuid: str) -> None:
+        self._executor.submit(self._prewarm_logged, request_uuid)
+
+    def _prewarm_logged(self, request_uuid: str) -> None:
+        try:
+            converted = self.prewarm(request_uuid)
+            if converted:
+                logger.info("Pre-warmed %d images of %s", converted, request_uuid)
+        except Exception:
+            logger.exception("Pre-warm of %s failed", request_uuid)
+
+    def forget(self, request_uuid: str) -> None:
+        """A new upload reuses request_uuid: allow it to be pre-warmed again"""
+        with self._lock:
+            self._warmed.pop(request_uuid, None)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+lazy_images = LazyImageConverter()
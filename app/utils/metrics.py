@@ -0,0 +1,229 @@
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets cho các bước convert (có thể mất vài chục giây với soffice)
+_PIPELINE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+PIPELINE_STAGE_DURATION = Histogram(
+    "docx_pipeline_stage_duration_seconds",
+    "Duration of each DocxService pipeline stage",
+    ["stage"],
+    buckets=_PIPELINE_BUCKETS,
+)
+IMAGE_CONVERSION_DURATION = Histogram(
+    "image_conversion_duration_seconds",
+    "Duration of one image conversion call by tool (soffice runs may cover a whole batch)",
+    ["path"],
+    buckets=_PIPELINE_BUCKETS,
+)
+SUBPROCESS_FAILURES = Counter(
+    "subprocess_failures_total",
+    "External converter runs that exited with an error or could not start",
+    ["tool"],
+)
+SUBPROCESS_TIMEOUTS = Counter(
+    "subprocess_timeouts_total",
+    "External converter runs killed after their timeout",
+    ["tool"],
+)
+CONVERSION_QUEUE_DEPTH = Gauge(
+    "image_conversion_queue_depth",
+    "Image conversion tasks waiting in the shared ConversionScheduler",
+    multiprocess_mode="livesum",
+)
+CONVERSION_ACTIVE_WORKERS = Gauge(
+    "image_conversion_active_workers",
+    "ConversionScheduler workers currently converting an image",
+    multiprocess_mode="livesum",
+)
+CONVERSION_REJECTED = Counter(
+    "image_conversion_rejected_total",
+    "Uploads refused because the conversion queue stayed full",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duration of DatabaseService / AsyncDatabaseService operations",
+    ["operation"],
+)
+CLEANUP_DURATION = Histogram(
+    "cleanup_job_duration_seconds",
+    "Duration of scheduled cleanup jobs",
+    ["job"],
+    buckets=_PIPELINE_BUCKETS,
+)
+
+# Các bước đã đo trong request hiện tại, trả về qua header Server-Timing.
+# Được set bởi MetricsMiddleware; code chạy ngoài request (job nền, scheduler)
+# thấy None và chỉ ghi vào histogram.
+_server_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timings", default=None)
+
+
+def add_server_timing(name: str, seconds: float) -> None:
+    timings = _server_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def pipeline_stage(stage: str) -> Iterator[None]:
+    """Time a DocxService stage into the histogram and the Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PIPELINE_STAGE_DURATION.labels(stage=stage).observe(elapsed)
+        add_server_timing(stage, elapsed)
+
+
+@contextmanager
+def image_conversion(path: str) -> Iterator[None]:
+    """Time one converter call (soffice, convert or magick)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        IMAGE_CONVERSION_DURATION.labels(path=path).observe(time.perf_counter() - start)
+
+
+def conversion_scheduler_state(queued: int, active: int) -> None:
+    CONVERSION_QUEUE_DEPTH.set(queued)
+    CONVERSION_ACTIVE_WORKERS.set(active)
+
+
+def conversion_rejected() -> None:
+    CONVERSION_REJECTED.inc()
+
+
+def subprocess_failed(tool: str) -> None:
+    SUBPROCESS_FAILURES.labels(tool=tool).inc()
+
+
+def subprocess_timed_out(tool: str) -> None:
+    SUBPROCESS_TIMEOUTS.labels(tool=tool).inc()
+
+
+def timed_query(func: Callable) -> Callable:
+    """Record a database service method under its name (sync or async)"""
+    operation = func.__name__
+
+    def record(start: float):
+        elapsed = time.perf_counter() - start
+        DB_QUERY_DURATION.labels(operation=operation).observe(elapsed)
+        add_server_timing(f"db_{operation}", elapsed)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(start)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(start)
+    return wrapper
+
+
+@contextmanager
+def cleanup_job(job: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        CLEANUP_DURATION.labels(job=job).observe(time.perf_counter() - start)
+
+
+def _route_label(scope) -> str:
+    # Dùng template của route (/quiz/{quiz_uuid}) để số label không tăng theo UUID
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        # route.path không có prefix của include_router (/api/v1): lấy prefix
+        # từ path thực tế, bỏ đi số segment của template
+        template_segments = route.path.count("/")
+        prefix = scope["path"].rstrip("/").split("/")[:-template_segments]
+        return "/".join(prefix) + route.path
+    if scope.get("root_path"):
+        return f"{scope['root_path']}/{{path}}"  # mounted app, e.g. /outputs
+    return "unmatched"
+
+
+def _server_timing_header(timings: List[Tuple[str, float]], total: float) -> bytes:
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency histogram and a Server-Timing header.
+
+    Written as plain ASGI (not BaseHTTPMiddleware) so the timings list set in
+    the context var is the one the route handler and its threadpool calls see.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: List[Tuple[str, float]] = []
+        token = _server_timings.set(timings)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing_header(timings, time.perf_counter() - start)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _server_timings.reset(token)
+            HTTP_REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=_route_label(scope),
+                status=str(status["code"]),
+            ).observe(time.perf_counter() - start)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Exposition text for /metrics; aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
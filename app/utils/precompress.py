@@ -0,0 +1,39 @@
+import gzip
+import os
+from typing import List
+
+try:
+    import brotli  # tùy chọn: pip install brotli
+except ImportError:
+    brotli = None
+
+# File nhỏ hơn ngưỡng này không đáng nén
+MIN_SIZE = 1024
+
+# (Content-Encoding, phần mở rộng của file nén), theo thứ tự ưu tiên khi phục vụ
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def write_precompressed(path: str) -> List[str]:
+    """Write .gz (and .br when brotli is installed) siblings of path.
+
+    The static handler for /outputs serves them to clients that accept the
+    encoding. Returns the paths written.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_SIZE:
+        return []
+
+    written = []
+    # mtime=0: cùng nội dung thì cùng bytes (ETag ổn định)
+    variants = [(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + ".br", brotli.compress(data, quality=11)))
+    for target, compressed in variants:
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, target)
+        written.append(target)
+    return written
@@ -0,0 +1,91 @@
+"""PNG/JPEG/GIF → lossless WebP with Pillow, and downscaled variants of converted images.
+
+Runs inside the raster process pool of ImageUtils, so this module only
+imports Pillow (child processes start fast and load nothing else of the app).
+"""
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+from PIL import Image
+
+RASTER_EXTS = (".png", ".jpg", ".jpeg", ".gif")
+
+# Mode Pillow ghi được thẳng ra WebP; mode khác (16-bit, float...) để ImageMagick xử lý
+_DIRECT_MODES = {"RGB", "RGBA"}
+_CONVERTIBLE_MODES = {"1", "L", "LA", "P", "PA", "CMYK", "YCbCr"}
+
+
+def _webp_ready(frame: Image.Image) -> Image.Image:
+    if frame.mode in _DIRECT_MODES:
+        return frame
+    has_alpha = frame.mode in ("LA", "PA") or "transparency" in frame.info
+    return frame.convert("RGBA" if has_alpha else "RGB")
+
+
+def convert_raster_to_webp(filepath: str, webp_path: str) -> bool:
+    """Write webp_path like `convert filepath -define webp:lossless=true -quality 100`.
+
+    Pixels are kept as they are (no EXIF rotation, no resize), animated GIFs
+    stay animated. Returns False for images Pillow should not handle (unusual
+    modes, decode errors), so the caller can fall back to ImageMagick.
+    """
+    tmp_path = f"{webp_path}.{os.getpid()}.tmp"
+    try:
+        with Image.open(filepath) as image:
+            if image.mode not in _DIRECT_MODES | _CONVERTIBLE_MODES:
+                return False
+            options = {"format": "WEBP", "lossless": True, "quality": 100}
+            if getattr(image, "n_frames", 1) > 1:
+                frames = []
+                durations = []
+                for index in range(image.n_frames):
+                    image.seek(index)
+                    frames.append(_webp_ready(image.copy()))
+                    durations.append(image.info.get("duration", 100))
+                frames[0].save(
+                    tmp_path, save_all=True, append_images=frames[1:], duration=durations,
+                    loop=image.info.get("loop", 0), **options
+                )
+            else:
+                _webp_ready(image).save(tmp_path, **options)
+        os.replace(tmp_path, webp_path)
+        return True
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    """(width, height) from the image header, None when unreadable"""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def write_variants(webp_path: str, specs: Sequence[Tuple[str, int, int]]) -> Dict[str, str]:
+    """Write downscaled lossy copies <stem>.<name>.webp of a converted image.
+
+    specs is a sequence of (name, max_width, quality). A variant is only
+    written when the image is wider than max_width. Returns name -> filename
+    of the variants written.
+    """
+    written = {}
+    stem = os.path.splitext(webp_path)[0]
+    with Image.open(webp_path) as image:
+        image.load()
+        width, height = image.size
+        for name, max_width, quality in specs:
+            if width <= max_width:
+                continue
+            size = (max_width, max(1, round(height * max_width / width)))
+            target = f"{stem}.{name}.webp"
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            image.resize(size, Image.LANCZOS).save(tmp_path, format="WEBP", quality=quality, method=6)
+            os.replace(tmp_path, target)
+            written[name] = os.path.basename(target)
+    return written
@@ -0,0 +1,212 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+IS_WINDOWS = sys.platform == "win32"
+
+
+class SofficePool:
+    """Pool of warm LibreOffice user profiles for batched headless conversions.
+
+    The expensive part of a cold ``soffice --headless`` start is building a
+    fresh user profile. Each slot keeps its profile on disk between calls and
+    converts a whole batch of files per invocation, so a document with many
+    WMF/EMF equations pays the start-up cost once per batch instead of once
+    per image. A slot holds at most one running soffice at a time (LibreOffice
+    locks its profile), hung runs are killed after a timeout, and a slot whose
+    run crashed gets its profile wiped before the next use.
+
+    Profiles live under profile_root/<pid>/: uvicorn workers each have their
+    own slots and never start soffice on a profile another process is using.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        profile_root: Optional[str] = None,
+        batch_size: int = 20,
+        base_timeout: float = 60,
+        per_file_timeout: float = 5,
+    ):
+        self.size = max(1, size)
+        self.profile_root = profile_root or os.path.join(tempfile.gettempdir(), "tekutoko_lo_profiles")
+        self.batch_size = max(1, batch_size)
+        self.base_timeout = base_timeout
+        self.per_file_timeout = per_file_timeout
+        self._slots: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.size):
+            self._slots.put(slot)
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+    def _process_root(self) -> str:
+        # Lấy pid lúc dùng, không lúc khởi tạo: worker được fork sau khi import vẫn có thư mục riêng
+        return os.path.join(self.profile_root, str(os.getpid()))
+
+    def _slot_dir(self, slot: int) -> str:
+        return os.path.join(self._process_root(), f"slot-{slot}")
+
+    def _reset_slot(self, slot: int) -> None:
+        """Throw away a slot's profile so the next run starts from a clean one"""
+        shutil.rmtree(self._slot_dir(slot), ignore_errors=True)
+        with self._lock:
+            self.restarts += 1
+
+    def _env(self, slot_dir: str) -> Dict[str, str]:
+        env = os.environ.copy()
+        env["HOME"] = slot_dir
+        env["JAVA_HOME"] = "/usr/lib/jvm/default-java"
+        env["JRE_HOME"] = "/usr/lib/jvm/default-java"
+        env["PATH"] = f"{env.get('PATH', '')}:/usr/lib/jvm/default-java/bin"
+        return env
+
+    def _run(self, slot: int, filepaths: List[str], outdir: str) -> bool:
+        """Run one soffice invocation for filepaths. Returns False on crash/hang."""
+        slot_dir = self._slot_dir(slot)
+        profile_dir = os.path.join(slot_dir, "profile")
+        os.makedirs(profile_dir, exist_ok=True)
+
+        cmd = [
+            "soffice",
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--nofirststartwizard",
+            "--norestore",
+            f"-env:UserInstallation=file://{profile_dir}",
+            "--convert-to",
+            "png",
+            "--outdir",
+            outdir,
+            *filepaths,
+        ]
+        timeout = self.base_timeout + self.per_file_timeout * len(filepaths)
+
+        # Own process group so a hung soffice.bin child can be killed too
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                env=self._env(slot_dir),
+                start_new_session=not IS_WINDOWS,
+            )
+        except OSError as exc:
+            metrics.subprocess_failed("soffice")
+            logger.error("Could not start soffice on slot %d: %s", slot, exc)
+            return False
+        try:
+            with metrics.image_conversion("soffice"):
+                stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            metrics.subprocess_timed_out("soffice")
+            logger.error("soffice hung on slot %d after %.0fs (%d files), killing", slot, timeout, len(filepaths))
+            self._kill(proc)
+            return False
+
+        if proc.returncode != 0:
+            metrics.subprocess_failed("soffice")
+            logger.error(
+                "soffice exited with %s on slot %d.\nstdout: %s\nstderr: %s",
+                proc.returncode,
+                slot,
+                stdout,
+                stderr,
+            )
+            return False
+        return True
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen) -> None:
+        try:
+            if IS_WINDOWS:
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        proc.communicate()
+
+    @staticmethod
+    def _png_path(filepath: str, outdir: str) -> str:
+        return os.path.join(outdir, f"{os.path.splitext(os.path.basename(filepath))[0]}.png")
+
+    def _batches(self, filepaths: List[str]) -> List[List[str]]:
+        """Split into batches of batch_size whose PNG output names do not collide"""
+        batches: List[List[str]] = []
+        for filepath in filepaths:
+            stem = os.path.splitext(os.path.basename(filepath))[0]
+            for batch in batches:
+                if len(batch) < self.batch_size and all(
+                    os.path.splitext(os.path.basename(p))[0] != stem for p in batch
+                ):
+                    batch.append(filepath)
+                    break
+            else:
+                batches.append([filepath])
+        return batches
+
+    def _convert_batch(self, batch: List[str], outdir: str) -> Dict[str, str]:
+        converted: Dict[str, str] = {}
+        pending = batch
+        # Lần 1: cả batch; lần 2: phần còn thiếu sau khi reset profile;
+        # cuối cùng từng file một để một file lỗi không kéo cả batch theo
+        for attempt in range(3):
+            if not pending:
+                break
+            groups = [pending] if attempt < 2 else [[p] for p in pending]
+            for group in groups:
+                slot = self._slots.get()
+                try:
+                    if not self._run(slot, group, outdir):
+                        self._reset_slot(slot)
+                finally:
+                    self._slots.put(slot)
+            for filepath in pending:
+                png_path = self._png_path(filepath, outdir)
+                if os.path.exists(png_path):
+                    converted[filepath] = png_path
+            pending = [p for p in pending if p not in converted]
+        for filepath in pending:
+            logger.error("soffice could not convert %s", filepath)
+        return converted
+
+    def convert_to_png(self, filepaths: List[str], outdir: str) -> Dict[str, str]:
+        """Convert filepaths to PNG in outdir.
+
+        Returns a mapping of source path -> PNG path for every file that was
+        converted; files missing from the result failed even after retries.
+        """
+        batches = self._batches(filepaths)
+        if not batches:
+            return {}
+        converted: Dict[str, str] = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.size, len(batches))) as executor:
+            for result in executor.map(lambda b: self._convert_batch(b, outdir), batches):
+                converted.update(result)
+        return converted
+
+    def shutdown(self) -> None:
+        """Remove this process's profiles (they are never reused by a later process)"""
+        shutil.rmtree(self._process_root(), ignore_errors=True)
+
+
+soffice_pool = SofficePool(
+    size=int(os.getenv("SOFFICE_POOL_SIZE", "2")),
+    profile_root=os.getenv("SOFFICE_PROFILE_DIR") or None,
+    batch_size=int(os.getenv("SOFFICE_BATCH_SIZE", "20")),
+)
@@ -0,0 +1,225 @@
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from app.utils.conversion_scheduler import ConversionQueueFullError
+from app.utils.lazy_images import WEBP_SUFFIX, lazy_images
+from app.utils.precompress import ENCODINGS
+
+# URL media có ?v=<hash nội dung> (update_image_srcs) thì cache vĩnh viễn được:
+# cùng UUID có thể bị xóa rồi upload lại với ảnh khác dưới cùng tên file
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# JSON / text: cho phép cache nhưng luôn hỏi lại bằng ETag
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# File nội bộ của pipeline / chấm bài, không phục vụ ra ngoài.
+# output.json có đáp án đúng ("correct"); client lấy câu hỏi qua public.json / GET /quiz
+PRIVATE_FILES = {
+    "answer_key.json", "temp.docx", "temp.tex",
+    "output.json", *(f"output.json{suffix}" for _, suffix in ENCODINGS),
+}
+
+COMPRESSIBLE_SUFFIXES = {".json", ".txt", ".svg", ".html", ".css", ".js"}
+
+VERSION_PARAM = "v"
+VERSION_LENGTH = 16
+
+_HASH_CHUNK = 1024 * 1024
+
+
+class ServedFile(NamedTuple):
+    path: str
+    stat_result: os.stat_result
+    etag: str
+
+
+class FileVariants(NamedTuple):
+    signature: Tuple[int, int]  # (st_mtime_ns, st_size) của file gốc
+    identity: ServedFile
+    encoded: Dict[str, ServedFile]  # Content-Encoding -> file nén sẵn
+
+
+def content_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_version(path: str) -> str:
+    """Value of the ?v= query that makes a media URL cacheable forever (a prefix of its ETag)"""
+    return content_digest(path)[:VERSION_LENGTH]
+
+
+def _content_etag(path: str) -> str:
+    return f'"{content_digest(path)[:32]}"'
+
+
+def _accepted_encodings(request_headers: Headers) -> set:
+    accepted = set()
+    for item in request_headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class OutputsStaticFiles(StaticFiles):
+    """StaticFiles for /outputs with precompressed variants and cache headers.
+
+    - .br / .gz siblings written at processing time (see write_precompressed)
+      are served to clients that accept them, with Vary: Accept-Encoding.
+    - ETags are strong and content based (same bytes, same tag on every pod);
+      they are computed once per file version in the worker thread that
+      stats the file.
+    - Files under immutable_dirs (converted media) requested with the
+      ?v=<content_version> of their current bytes get an immutable
+      Cache-Control. Everything else, including media URLs without (or with
+      a stale) version, must be revalidated against the ETag.
+    - Dot-directories (content store, image cache, journals) and pipeline
+      internals are never served.
+
+    - A missing <uuid>/media/<name>.webp whose original is still in media/
+      (DOCX_LAZY_IMAGES) is converted on the first request, see
+      LazyImageConverter. If conversion fails the original is sent, without
+      the immutable Cache-Control.
+
+    Range and If-Range are handled by FileResponse, conditional requests by
+    StaticFiles.is_not_modified against the ETag set here.
+    """
+
+    def __init__(self, *args, immutable_dirs: Tuple[str, ...] = ("media",), max_entries: int = 4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable_dirs = set(immutable_dirs)
+        self.max_entries = max(1, max_entries)
+        self._variants: "OrderedDict[str, FileVariants]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        parts = path.split(os.sep)
+        if any(part.startswith(".") for part in parts) or parts[-1] in PRIVATE_FILES:
+            raise HTTPException(status_code=404)
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            if exc.status_code != 404 or not self.is_lazy_media(parts):
+                raise
+        return await self.lazy_media_response(parts, scope)
+
+    @staticmethod
+    def is_lazy_media(parts) -> bool:
+        return len(parts) == 3 and parts[1] == "media" and parts[2].lower().endswith(WEBP_SUFFIX)
+
+    async def lazy_media_response(self, parts, scope: Scope) -> Response:
+        media_dir = os.path.join(self.directory, parts[0], "media")
+        try:
+            served_path = await run_in_threadpool(lazy_images.ensure_webp, media_dir, parts[2])
+        except ConversionQueueFullError:
+            raise HTTPException(status_code=503)
+        if served_path is None:
+            raise HTTPException(status_code=404)
+        stat_result = await run_in_threadpool(os.stat, served_path)
+        response = await run_in_threadpool(self.file_response, served_path, stat_result, scope)
+        if not served_path.endswith(WEBP_SUFFIX):
+            # Ảnh gốc thay cho WebP convert lỗi: không cho cache vĩnh viễn dưới URL .webp
+            response.headers["cache-control"] = REVALIDATE_CACHE_CONTROL
+        return response
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        # Chạy trong worker thread: tính ETag / tìm file nén ở đây, không block event loop
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self.variants(full_path, stat_result)
+        return full_path, stat_result
+
+    def variants(self, full_path: str, stat_result: os.stat_result) -> FileVariants:
+        signature = (stat_result.st_mtime_ns, stat_result.st_size)
+        with self._lock:
+            cached = self._variants.get(full_path)
+            if cached is not None and cached.signature == signature:
+                self._variants.move_to_end(full_path)
+                return cached
+
+        encoded = {}
+        if os.path.splitext(full_path)[1].lower() in COMPRESSIBLE_SUFFIXES:
+            for encoding, suffix in ENCODINGS:
+                try:
+                    sibling_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # Bỏ qua file nén cũ hơn file gốc
+                if sibling_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+                    encoded[encoding] = ServedFile(full_path + suffix, sibling_stat, _content_etag(full_path + suffix))
+        entry = FileVariants(signature, ServedFile(full_path, stat_result, _content_etag(full_path)), encoded)
+
+        with self._lock:
+            self._variants[full_path] = entry
+            self._variants.move_to_end(full_path)
+            while len(self._variants) > self.max_entries:
+                self._variants.popitem(last=False)
+        return entry
+
+    def cache_control(self, full_path: str, etag: str, scope: Scope) -> str:
+        directory = os.path.basename(os.path.dirname(full_path))
+        if directory in self.immutable_dirs:
+            version = QueryParams(scope.get("query_string", b"")).get(VERSION_PARAM)
+            if version and len(version) == VERSION_LENGTH and etag.strip('"').startswith(version):
+                return IMMUTABLE_CACHE_CONTROL
+        return REVALIDATE_CACHE_CONTROL
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        entry = self.variants(full_path, stat_result)
+
+        served, encoding = entry.identity, None
+        accepted = _accepted_encodings(request_headers)
+        for name, _ in ENCODINGS:
+            if name in entry.encoded and name in accepted:
+                served, encoding = entry.encoded[name], name
+                break
+
+        headers = {"etag": served.etag, "cache-control": self.cache_control(full_path, entry.identity.etag, scope)}
+        if os.path.splitext(full_path)[1].lower() in COMPRESSIBLE_SUFFIXES:
+            headers["vary"] = "Accept-Encoding"
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        response = FileResponse(
+            served.path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=served.stat_result,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
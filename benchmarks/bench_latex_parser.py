@@ -0,0 +1,101 @@
+"""Compare the original regex LaTeX parser with the single-pass tokenizer.
+
+Usage:
+    python -m benchmarks.bench_latex_parser --sizes 50 500 2000 --repeat 5 --json bench_latex.json
+
+Synthetic pandoc-style LaTeX is generated for each question count, so the
+growth of both implementations can be compared. Pure Python, no pandoc needed.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from app.services.docx_service import DocxService
+from tests import latex_parser_reference
+
+_TEXT = [
+    "Cho hàm số", "Tính tích phân", "Trong không gian Oxyz, cho", "Giá trị lớn nhất của",
+    "bằng", "là", "có tọa độ là", "thỏa mãn điều kiện", "Mệnh đề nào dưới đây đúng?",
+]
+_MATH = [r"$x^2 + 1$", r"$\int_0^1 f(x)\,dx$", r"\(y = 2x - 3\)", r"\[\frac{a}{b}\]", r"$\sqrt{3}$"]
+_LABEL_WRAPPERS = ["{}", r"\textbf{{{}}}", r"\ul{{{}}}", r"\textbf{{\ul{{{}}}}}", r"\underline{{{}}}"]
+
+
+def _fragment(rng: random.Random, image_no: List[int]) -> str:
+    kind = rng.random()
+    if kind < 0.25:
+        image_no[0] += 1
+        return r"\pandocbounded{\includegraphics[keepaspectratio]{/tmp/x/media/image%d.wmf}}" % image_no[0]
+    if kind < 0.35:
+        image_no[0] += 1
+        return r"\includegraphics[width=3.7in,height=1.2in]{./media/image%d.png}" % image_no[0]
+    if kind < 0.6:
+        return rng.choice(_MATH)
+    return rng.choice(_TEXT)
+
+
+def synthetic_latex(question_count: int, seed: int = 0) -> str:
+    """Pandoc-like LaTeX with question_count questions of four options each"""
+    rng = random.Random(seed)
+    image_no = [0]
+    parts = []
+    for number in range(1, question_count + 1):
+        header = rng.choice([r"\textbf{Câu %d:}", r"\textbf{Câu %d.}", "Câu %d."]) % number
+        stem = " ".join(_fragment(rng, image_no) for _ in range(rng.randint(2, 8)))
+        correct = rng.choice("ABCD")
+        options = []
+        for label in "ABCD":
+            wrapper = rng.choice(_LABEL_WRAPPERS[1:3]) if label != correct else rng.choice(_LABEL_WRAPPERS[2:])
+            content = " ".join(_fragment(rng, image_no) for _ in range(rng.randint(1, 3)))
+            options.append(f"{wrapper.format(label + '.')} {content}.")
+        if rng.random() < 0.5:
+            body = "\\begin{quote}\n" + "\n\n".join(options) + "\n\\end{quote}"
+        else:
+            body = "\\begin{enumerate}\n" + "\n".join("\\item " + o for o in options) + "\n\\end{enumerate}"
+        parts.append(f"{header} {stem}\n\n{body}\n")
+    return "\n".join(parts)
+
+
+def _time(fn, latex: str, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(latex)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 250, 500, 1000, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    service = DocxService()
+    results: Dict[int, Dict] = {}
+    for size in args.sizes:
+        latex = synthetic_latex(size)
+        reference = statistics.median(_time(latex_parser_reference.parse_latex_to_json, latex, args.repeat))
+        tokenizer = statistics.median(_time(service.parse_latex_to_json, latex, args.repeat))
+        results[size] = {
+            "latex_bytes": len(latex.encode("utf-8")),
+            "reference_s": reference,
+            "tokenizer_s": tokenizer,
+            "speedup": reference / tokenizer if tokenizer else None,
+        }
+        print(f"{size:>6} questions: reference {reference * 1000:8.1f} ms, "
+              f"tokenizer {tokenizer * 1000:8.1f} ms ({results[size]['speedup']:.2f}x)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Time each stage of the DOCX → output.json pipeline on generated exams.
+
+Usage:
+    python -m benchmarks.bench_pipeline --questions 50 200 --repeat 3 --json bench_pipeline.json
+    python -m benchmarks.bench_pipeline --docx code/test.docx --compare baseline.json
+    python -m benchmarks.bench_pipeline --sequential --json sequential.json
+
+Stages mirror DocxService.process_saved_docx: upload_write (save_upload),
+convert_docx_to_latex, convert_extracted_images, parse_latex_to_json,
+update_image_srcs and write_outputs, timed one after another. end_to_end is
+the wall time of process_saved_docx itself, pipelined (images converted from
+the zip while pandoc runs) unless --sequential is given. The image cache is disabled unless
+--image-cache is given, so every run converts. With --compare, stage medians
+are checked against an earlier --json file and the exit code is 1 when one
+regressed by more than --threshold.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import pypandoc
+from fastapi import UploadFile
+
+from app.services.docx_service import DocxService
+from app.utils.image_cache import image_cache
+from benchmarks.docx_generator import generate_exam_docx
+
+STAGES = [
+    "upload_write",
+    "convert_docx_to_latex",
+    "convert_extracted_images",
+    "parse_latex_to_json",
+    "update_image_srcs",
+    "write_outputs",
+]
+
+
+def run_pipeline(service: DocxService, docx_bytes: bytes) -> Dict[str, float]:
+    """One pass over the pipeline in the current directory; returns seconds per stage"""
+    timings: Dict[str, float] = {}
+    request_uuid = str(uuid.uuid4())
+    output_dir = os.path.join("outputs", request_uuid)
+
+    start = time.perf_counter()
+    upload = UploadFile(io.BytesIO(docx_bytes), filename="exam.docx")
+    asyncio.run(service.save_upload(upload, request_uuid))
+    timings["upload_write"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    latex = service.convert_docx_to_latex(
+        os.path.join(output_dir, "temp.docx"), os.path.join(output_dir, "temp.tex"), output_dir
+    )
+    timings["convert_docx_to_latex"] = time.perf_counter() - start
+
+    image_dir = os.path.join(output_dir, "media")
+    start = time.perf_counter()
+    images_map = service.image_utils.convert_extracted_images(image_dir) if os.path.exists(image_dir) else {}
+    timings["convert_extracted_images"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    questions = service.parse_latex_to_json(latex)
+    timings["parse_latex_to_json"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    service.update_image_srcs(questions, images_map, request_uuid)
+    timings["update_image_srcs"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    service.write_outputs(output_dir, request_uuid, questions)
+    timings["write_outputs"] = time.perf_counter() - start
+
+    timings["total"] = sum(timings[stage] for stage in STAGES)
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    request_uuid = str(uuid.uuid4())
+    asyncio.run(service.save_upload(UploadFile(io.BytesIO(docx_bytes), filename="exam.docx"), request_uuid))
+    start = time.perf_counter()
+    service.process_saved_docx(request_uuid)
+    timings["end_to_end"] = time.perf_counter() - start
+    shutil.rmtree(os.path.join("outputs", request_uuid), ignore_errors=True)
+    return timings
+
+
+def bench_case(name: str, docx_path: str, repeat: int, meta: Dict, pipelined: bool = True) -> Dict:
+    with open(docx_path, "rb") as f:
+        docx_bytes = f.read()
+    service = DocxService(pipelined=pipelined)
+    runs = [run_pipeline(service, docx_bytes) for _ in range(repeat)]
+    median = {stage: statistics.median(run[stage] for run in runs) for stage in STAGES + ["total", "end_to_end"]}
+    print(f"{name}: total {median['total']:.3f}s  end_to_end {median['end_to_end']:.3f}s  " + "  ".join(
+        f"{stage}={median[stage] * 1000:.1f}ms" for stage in STAGES
+    ))
+    return {"docx_bytes": len(docx_bytes), **meta, "runs": runs, "median_s": median}
+
+
+def compare(results: Dict[str, Dict], baseline_path: str, threshold: float) -> List[str]:
+    """Stages whose median got slower than the baseline by more than threshold (fraction)"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["cases"]
+    regressions = []
+    for name, case in results.items():
+        if name not in baseline:
+            continue
+        for stage, seconds in case["median_s"].items():
+            before = baseline[name]["median_s"].get(stage)
+            # Bỏ qua các stage quá nhanh (< 1ms): nhiễu đo lớn hơn chênh lệch
+            if before and before >= 0.001 and seconds > before * (1 + threshold):
+                regressions.append(f"{name}/{stage}: {before * 1000:.1f}ms -> {seconds * 1000:.1f}ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docx", nargs="*", default=[], help="Existing DOCX files to benchmark as well")
+    parser.add_argument("--questions", type=int, nargs="*", default=[50, 200], help="Generated exam sizes")
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--png-ratio", type=float, default=0.2)
+    parser.add_argument("--wmf-ratio", type=float, default=0.3)
+    parser.add_argument("--math-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--image-cache", action="store_true", help="Keep the converted image cache enabled")
+    parser.add_argument("--sequential", action="store_true", help="Time end_to_end with DOCX_PIPELINED=0 behaviour")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    if not args.image_cache:
+        image_cache.enabled = False
+
+    docx_paths = [os.path.abspath(path) for path in args.docx]
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    cwd = os.getcwd()
+    cases: Dict[str, Dict] = {}
+    try:
+        # DocxService ghi vào outputs/ tương đối: chạy trong thư mục tạm
+        os.chdir(work_dir)
+        for questions in args.questions:
+            docx_path = os.path.join(work_dir, f"generated_{questions}.docx")
+            info = generate_exam_docx(
+                docx_path, questions, args.options, args.png_ratio, args.wmf_ratio, args.math_ratio, seed=args.seed
+            )
+            meta = {"questions": questions, "images": info["images"]}
+            cases[f"generated_{questions}"] = bench_case(
+                f"generated_{questions}", docx_path, args.repeat, meta, pipelined=not args.sequential
+            )
+        for docx_path in docx_paths:
+            name = os.path.basename(docx_path)
+            cases[name] = bench_case(name, docx_path, args.repeat, {}, pipelined=not args.sequential)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandoc": pypandoc.get_pandoc_version(),
+            "soffice": shutil.which("soffice") is not None,
+            "imagemagick": shutil.which("convert") is not None,
+            "image_cache": args.image_cache,
+            "pipelined": not args.sequential,
+        },
+        "settings": {
+            "options": args.options, "png_ratio": args.png_ratio, "wmf_ratio": args.wmf_ratio,
+            "math_ratio": args.math_ratio, "seed": args.seed, "repeat": args.repeat,
+        },
+        "cases": cases,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        regressions = compare(cases, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
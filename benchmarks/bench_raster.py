@@ -0,0 +1,104 @@
+"""Compare PNG → WebP conversion: Pillow process pool vs one ImageMagick process per image.
+
+Usage:
+    python -m benchmarks.bench_raster --images 200 --repeat 3 --json bench_raster.json
+
+Generates --images small PNGs (formula-sized text snippets, like the inline
+images of a typical exam) and converts them with convert_extracted_images
+for each raster engine. The magick engine is skipped when ImageMagick is
+not on PATH. The image cache is disabled so every run converts.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageDraw
+
+from app.utils.conversion_scheduler import conversion_scheduler
+from app.utils.image_cache import image_cache
+from app.utils.image_utils import ImageUtils, raster_pool
+
+_SNIPPETS = ["x^2+1", "f(x)=2x-3", "sqrt(a+b)", "A = {1; 2}", "int_0^1 x dx", "y' = 3x^2", "log_2 8", "(-1; 2)"]
+
+
+def generate_pngs(dest: str, count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        width, height = rng.randint(60, 240), rng.randint(24, 64)
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((4, height // 3), rng.choice(_SNIPPETS), fill="black")
+        draw.line((2, height - 4, width - 2, height - 4), fill=(rng.randint(0, 200), 0, 0))
+        path = os.path.join(dest, f"image{index + 1}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def run_once(source_dir: str, engine: str) -> float:
+    work_dir = tempfile.mkdtemp(prefix="bench_raster_")
+    try:
+        for name in os.listdir(source_dir):
+            shutil.copy(os.path.join(source_dir, name), work_dir)
+        start = time.perf_counter()
+        images_map = ImageUtils(raster_engine=engine, variants=False).convert_extracted_images(work_dir)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for original, converted in images_map.items() if original == converted)
+        if failed:
+            print(f"{engine}: {failed} images were not converted", file=sys.stderr)
+        return elapsed
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    image_cache.enabled = False
+    engines = ["pillow"]
+    if shutil.which("convert") is not None or shutil.which("magick") is not None:
+        engines.append("magick")
+    else:
+        print("ImageMagick not found, timing the pillow engine only", file=sys.stderr)
+
+    source_dir = tempfile.mkdtemp(prefix="bench_raster_src_")
+    results: Dict[str, Dict] = {}
+    try:
+        generate_pngs(source_dir, args.images, args.seed)
+        # Lần chạy đầu khởi động process pool; không tính vào kết quả
+        run_once(source_dir, "pillow")
+        for engine in engines:
+            timings = [run_once(source_dir, engine) for _ in range(args.repeat)]
+            results[engine] = {
+                "runs": timings,
+                "median_s": statistics.median(timings),
+                "per_image_ms": statistics.median(timings) / max(args.images, 1) * 1000,
+            }
+            print(f"{engine:>7}: median {results[engine]['median_s']:.2f}s "
+                  f"({results[engine]['per_image_ms']:.1f} ms/image, {args.images} images, "
+                  f"{conversion_scheduler.workers} workers)")
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+        raster_pool.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": args.images, "workers": conversion_scheduler.workers, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Compare WMF/EMF conversion: one soffice process per image vs SofficePool batches.
+
+Usage:
+    python -m benchmarks.bench_soffice code/test.docx --repeat 3 --json bench_soffice.json
+
+Every WMF/EMF under word/media/ of the DOCX is extracted into a scratch
+directory and converted with both paths. Requires soffice and ImageMagick.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from typing import Dict, List, Optional
+
+from app.utils.image_utils import ImageUtils
+from app.utils.soffice_pool import SofficePool
+import app.utils.image_utils as image_utils_module
+
+
+def extract_vectors(docx_path: str, dest: str) -> List[str]:
+    names = []
+    with zipfile.ZipFile(docx_path) as zf:
+        for name in zf.namelist():
+            if name.startswith("word/media/") and name.lower().endswith((".wmf", ".emf")):
+                target = os.path.join(dest, os.path.basename(name))
+                with zf.open(name) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                names.append(target)
+    return names
+
+
+def run_once(docx_path: str, batch: bool) -> float:
+    work_dir = tempfile.mkdtemp(prefix="bench_soffice_")
+    try:
+        extract_vectors(docx_path, work_dir)
+        utils = ImageUtils(soffice_batch=batch)
+        start = time.perf_counter()
+        utils.convert_extracted_images(work_dir)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("docx", help="DOCX file with WMF/EMF images")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if shutil.which("soffice") is None or shutil.which("convert") is None:
+        print("soffice and ImageMagick 'convert' must be on PATH", file=sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory() as probe:
+        image_count = len(extract_vectors(args.docx, probe))
+
+    # Pool riêng cho benchmark, profile tạo mới để lần chạy đầu tính cả warm-up
+    profile_root = tempfile.mkdtemp(prefix="bench_lo_profiles_")
+    image_utils_module.soffice_pool = SofficePool(
+        size=args.pool_size, profile_root=profile_root, batch_size=args.batch_size
+    )
+
+    results: Dict[str, Dict] = {}
+    try:
+        for label, batch in (("per_image", False), ("pool_batched", True)):
+            timings = [run_once(args.docx, batch) for _ in range(args.repeat)]
+            results[label] = {
+                "runs": timings,
+                "median_s": statistics.median(timings),
+                "per_image_ms": statistics.median(timings) / max(image_count, 1) * 1000,
+            }
+            print(f"{label:>14}: median {results[label]['median_s']:.2f}s "
+                  f"({results[label]['per_image_ms']:.0f} ms/image, {image_count} images)")
+    finally:
+        shutil.rmtree(profile_root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"docx": args.docx, "images": image_count, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
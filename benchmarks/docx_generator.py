@@ -0,0 +1,186 @@
+"""Generate synthetic exam DOCX files shaped like the uploads the service receives.
+
+Usage:
+    python -m benchmarks.docx_generator exam.docx --questions 200 --png-ratio 0.2 --wmf-ratio 0.5
+
+Questions are "Câu N." paragraphs followed by one paragraph per option
+("A." .. ); the correct label is bold + underlined, as teachers mark it.
+Question stems and options can embed PNG images (Pillow), WMF images (a
+small placeable metafile with a few shapes) and OMML math.
+"""
+import argparse
+import io
+import random
+import struct
+import sys
+from typing import Dict, List, Optional
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.part import Part
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.oxml.shape import CT_Inline
+from docx.shared import Inches
+from PIL import Image, ImageDraw
+
+_WORDS = [
+    "Cho", "hàm", "số", "tích", "phân", "giá", "trị", "lớn", "nhất", "của", "biểu",
+    "thức", "trong", "không", "gian", "tọa", "độ", "điểm", "đường", "thẳng", "bằng",
+]
+_LABELS = "ABCD"  # the parsers only recognise A-D
+
+
+def make_png(seed: int, size: int = 160) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size // 2), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x0, y0 = rng.randrange(size), rng.randrange(size // 2)
+        draw.line((x0, y0, rng.randrange(size), rng.randrange(size // 2)), fill=(0, 0, rng.randrange(256)), width=2)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_wmf(seed: int, width: int = 1440, height: int = 720) -> bytes:
+    """Placeable WMF with a rectangle and an ellipse (what MathType/Equation objects look like to pandoc)"""
+    rng = random.Random(seed)
+    records = []
+
+    def record(function: int, *params: int):
+        records.append(struct.pack("<IH", 3 + len(params), function) + struct.pack(f"<{len(params)}h", *params))
+
+    record(0x020B, 0, 0)  # META_SETWINDOWORG
+    record(0x020C, height, width)  # META_SETWINDOWEXT
+    record(0x041B, rng.randrange(height // 2), rng.randrange(width // 2), rng.randrange(height // 2), rng.randrange(width // 2))  # META_RECTANGLE b,r,t,l
+    record(0x0418, height - 10, width - 10, height // 2, width // 2)  # META_ELLIPSE
+    record(0x0000)  # META_EOF
+    body = b"".join(records)
+
+    max_record = max(len(r) for r in records) // 2
+    header = struct.pack("<HHHIHIH", 1, 9, 0x0300, (18 + len(body)) // 2, 0, max_record, 0)
+    placeable = struct.pack("<IHhhhhHI", 0x9AC6CDD7, 0, 0, 0, width, height, 1440, 0)
+    checksum = 0
+    for (word,) in struct.iter_unpack("<H", placeable[:20]):
+        checksum ^= word
+    return placeable + struct.pack("<H", checksum) + header + body
+
+
+def _omml(rng: random.Random) -> str:
+    base, power = rng.choice("xyzab"), rng.randint(2, 5)
+    return (
+        f'<m:oMath {nsdecls("m", "w")}>'
+        f'<m:sSup><m:e><m:r><m:t>{base}</m:t></m:r></m:e><m:sup><m:r><m:t>{power}</m:t></m:r></m:sup></m:sSup>'
+        f'<m:r><m:t>+</m:t></m:r>'
+        f'<m:f><m:num><m:r><m:t>{rng.randint(1, 9)}</m:t></m:r></m:num><m:den><m:r><m:t>{rng.randint(2, 9)}</m:t></m:r></m:den></m:f>'
+        f'</m:oMath>'
+    )
+
+
+class ExamDocxGenerator:
+    """Builds one exam document; image_count keeps media part names unique"""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.document = Document()
+        self.image_count = 0
+        self.shape_id = 1000
+
+    def add_png(self, paragraph):
+        self.image_count += 1
+        run = paragraph.add_run()
+        run.add_picture(io.BytesIO(make_png(self.image_count)), width=Inches(1.2))
+
+    def add_wmf(self, paragraph):
+        self.image_count += 1
+        part_name = PackURI(f"/word/media/gen_image{self.image_count}.wmf")
+        part = Part(part_name, "image/x-wmf", make_wmf(self.image_count), self.document.part.package)
+        r_id = self.document.part.relate_to(part, RT.IMAGE)
+        self.shape_id += 1
+        inline = CT_Inline.new_pic_inline(self.shape_id, r_id, part_name.filename, Inches(0.8), Inches(0.4))
+        paragraph.add_run()._r.add_drawing(inline)
+
+    def add_math(self, paragraph):
+        paragraph._p.append(parse_xml(_omml(self.rng)))
+
+    def add_content(self, paragraph, png_ratio: float, wmf_ratio: float, math_ratio: float):
+        paragraph.add_run(" " + " ".join(self.rng.choice(_WORDS) for _ in range(self.rng.randint(3, 12))) + " ")
+        if self.rng.random() < math_ratio:
+            self.add_math(paragraph)
+            paragraph.add_run(" ")
+        if self.rng.random() < wmf_ratio:
+            self.add_wmf(paragraph)
+        if self.rng.random() < png_ratio:
+            self.add_png(paragraph)
+
+    def build(
+        self,
+        questions: int,
+        options: int = 4,
+        png_ratio: float = 0.2,
+        wmf_ratio: float = 0.3,
+        math_ratio: float = 0.3,
+        option_image_ratio: float = 0.1
+    ) -> List[str]:
+        """Add questions to the document and return the answer key (one label per question)"""
+        answer_key = []
+        for number in range(1, questions + 1):
+            stem = self.document.add_paragraph()
+            stem.add_run(f"Câu {number}.").bold = True
+            self.add_content(stem, png_ratio, wmf_ratio, math_ratio)
+
+            correct = self.rng.choice(_LABELS[:options])
+            answer_key.append(correct)
+            for label in _LABELS[:options]:
+                paragraph = self.document.add_paragraph()
+                label_run = paragraph.add_run(f"{label}.")
+                label_run.bold = True
+                label_run.underline = label == correct
+                self.add_content(paragraph, 0.0, option_image_ratio, math_ratio)
+        return answer_key
+
+    def save(self, path: str):
+        self.document.save(path)
+
+
+def generate_exam_docx(
+    path: str,
+    questions: int = 50,
+    options: int = 4,
+    png_ratio: float = 0.2,
+    wmf_ratio: float = 0.3,
+    math_ratio: float = 0.3,
+    option_image_ratio: float = 0.1,
+    seed: int = 0
+) -> Dict:
+    """Write a synthetic exam to path; returns its answer key and image count"""
+    generator = ExamDocxGenerator(seed)
+    answer_key = generator.build(questions, options, png_ratio, wmf_ratio, math_ratio, option_image_ratio)
+    generator.save(path)
+    return {"answer_key": answer_key, "images": generator.image_count}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="DOCX file to write")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--options", type=int, default=4, choices=range(2, 5))
+    parser.add_argument("--png-ratio", type=float, default=0.2, help="Share of questions with a PNG image")
+    parser.add_argument("--wmf-ratio", type=float, default=0.3, help="Share of questions with a WMF image")
+    parser.add_argument("--math-ratio", type=float, default=0.3, help="Share of stems/options with OMML math")
+    parser.add_argument("--option-image-ratio", type=float, default=0.1, help="Share of options with a WMF image")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    info = generate_exam_docx(
+        args.output, args.questions, args.options, args.png_ratio, args.wmf_ratio,
+        args.math_ratio, args.option_image_ratio, args.seed
+    )
+    print(f"Wrote {args.output}: {args.questions} questions, {info['images']} images")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# app.models.database builds its engines at import time; default to a
+# throwaway SQLite file so the suite runs without a MySQL server
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="tekutoko_test_"), "test.db")
+)
@@ -0,0 +1,27 @@
+from app.services.analytics_service import compute_item_analytics, pack_answers
+
+def test_pack_answers_follows_answer_key_order():
+    key = {1: "A", 2: "C", 5: "B"}
+    assert pack_answers(key, {5: "b", 1: "A", 9: "D"}) == "A-B"
+    assert pack_answers(key, {2: "", 1: "1"}) == "---"
+
+def test_item_analytics_on_small_cohort():
+    key = {1: "A", 2: "B", 3: ""}
+    # q1: mọi người đúng; q2: chỉ hai người giỏi nhất đúng; q3: không có đáp án
+    packed = ["AB-", "ABC", "AC-", "A--"] + ["AD-"] * 4
+    scores = [100.0, 100.0, 50.0, 50.0, 50.0, 50.0, 50.0, 50.0, 0.0]
+    analytics = compute_item_analytics(key, packed, scores)
+
+    q1, q2, q3 = analytics["questions"]
+    assert q1["correct_rate"] == 1.0 and q1["discrimination_index"] == 0.0
+    assert q2["correct_rate"] == 0.25 and q2["discrimination_index"] == 1.0
+    assert q2["option_counts"] == {"A": 0, "B": 2, "C": 1, "D": 4} and q2["blank_count"] == 1
+    assert q3["correct_rate"] is None and q3["option_counts"]["C"] == 1 and q3["blank_count"] == 7
+    assert analytics["total_results"] == 9 and analytics["results_with_answers"] == 8
+    histogram = {bucket["from"]: bucket["count"] for bucket in analytics["score_histogram"]}
+    assert histogram[0.0] == 1 and histogram[50.0] == 6 and histogram[90.0] == 2
+
+def test_item_analytics_without_results():
+    analytics = compute_item_analytics({1: "A"}, [], [])
+    assert analytics["questions"][0]["correct_rate"] is None
+    assert analytics["mean_score"] is None
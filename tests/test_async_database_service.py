@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.models.database import Base
+from app.services.database_service import AsyncDatabaseService
+
+async def _run_scenario():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with session_factory() as db:
+        service = AsyncDatabaseService(db)
+        room = await service.create_test_exam_room("room-1", "teacher", "Exam", 45)
+        assert room.id is not None
+        assert (await service.get_test_exam_room_by_uuid("room-1")).title == "Exam"
+
+        assert not await service.check_student_submitted("room-1", "alice")
+        await service.create_exam_result("room-1", "alice", 10, 7, 70.0, suspicious_activity={"tabSwitches": 1})
+        assert await service.check_student_submitted("room-1", "alice")
+        assert len(await service.get_exam_results_by_uuid("room-1")) == 1
+
+        rows = [
+            {"test_exam_uuid": "room-1", "student_username": name, "total_questions": 10,
+             "correct_answers": 5, "score_percentage": 50.0, "activity_log": [{"type": "blur"}]}
+            for name in ("bob", "carol")
+        ]
+        assert await service.create_exam_results_bulk(rows) == 2
+        assert await service.get_submitted_usernames("room-1", ["alice", "bob", "dave"]) == {"alice", "bob"}
+        assert len(await service.get_exam_results_by_uuid("room-1")) == 3
+
+        # Keyset pages in (completed_at, id) order, JSON columns only when requested
+        first = await service.get_exam_results_page("room-1", limit=2)
+        assert not hasattr(first[0], "activity_log")
+        rest = await service.get_exam_results_page("room-1", ["activity_log"], limit=2, after=(first[-1].completed_at, first[-1].id))
+        assert [row.student_username for row in first + rest] == ["alice", "bob", "carol"]
+        assert rest[-1].activity_log == [{"type": "blur"}]
+        assert await service.count_exam_results("room-1") == 3
+        assert [row.student_username async for row in service.stream_exam_results("room-1", batch_size=2)] == ["alice", "bob", "carol"]
+
+        cancelled = await service.cancel_exam_submission("room-1", "alice", "tab switching")
+        assert cancelled.exam_cancelled and cancelled.cheating_reason == "tab switching"
+
+        timer = await service.get_or_create_exam_timer("room-1", "alice", datetime(2025, 1, 10, 10, 30))
+        again = await service.get_or_create_exam_timer("room-1", "alice", datetime(2025, 1, 10, 11, 0))
+        assert again.id == timer.id
+
+        assert not await service.delete_test_exam_room("room-1", "someone-else")
+        assert await service.delete_test_exam_room("room-1", "teacher")
+        assert await service.get_test_exam_room_by_uuid("room-1") is None
+        assert await service.get_exam_results_by_uuid("room-1") == []
+
+    await engine.dispose()
+
+def test_async_database_service_roundtrip():
+    asyncio.run(_run_scenario())
@@ -0,0 +1,42 @@
+import os
+import time
+import uuid
+from app.models.database import SessionLocal
+from app.services.cleanup_service import CleanupService
+from app.services.database_service import DatabaseService
+
+def _folder(tmp_path, age_seconds, *files):
+    name = str(uuid.uuid4())
+    folder = tmp_path / "outputs" / name
+    os.makedirs(folder)
+    mtime = time.time() - age_seconds
+    for filename in files:
+        (folder / filename).write_bytes(b"x")
+        os.utime(folder / filename, (mtime, mtime))
+    os.utime(folder, (mtime, mtime))
+    return name
+
+def test_cleanup_keeps_folders_other_workers_may_still_be_using(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = CleanupService()
+    hour = service.grace_seconds
+
+    with_room = _folder(tmp_path, 2 * hour, "output.json")
+    db = SessionLocal()
+    try:
+        DatabaseService(db).create_test_exam_room(with_room, "teacher")
+    finally:
+        db.close()
+    # Upload vừa lưu trên worker khác, chưa có room
+    just_saved = _folder(tmp_path, 60, "temp.docx")
+    # Đang convert lâu hơn grace window nhưng temp.docx vẫn còn
+    converting = _folder(tmp_path, 2 * hour, "temp.docx")
+    # Worker bị kill giữa chừng: temp.docx bỏ lại hơn một ngày
+    abandoned = _folder(tmp_path, 2 * 86400, "temp.docx")
+    orphan = _folder(tmp_path, 2 * hour, "output.json")
+
+    service.cleanup_extra_folders()
+
+    assert sorted(os.listdir(tmp_path / "outputs")) == sorted([with_room, just_saved, converting])
+    assert abandoned not in os.listdir(tmp_path / "outputs")
+    assert orphan not in os.listdir(tmp_path / "outputs")
@@ -0,0 +1,55 @@
+import asyncio
+import io
+import json
+import os
+from fastapi import UploadFile
+from app.services import docx_service
+from app.services.content_store import ContentStore
+from app.services.docx_service import DocxService
+from app.utils.image_cache import image_cache
+
+def _image_srcs(output_dir):
+    with open(os.path.join(output_dir, "output.json"), encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+    return [
+        b["src"] for q in questions
+        for b in q["blocks"] + [b for o in q["options"] for b in o["blocks"]]
+        if b["type"] == "image"
+    ]
+
+def test_identical_upload_reuses_stored_result_under_its_own_uuid(tmp_path, monkeypatch):
+    from benchmarks.docx_generator import generate_exam_docx
+    generate_exam_docx(str(tmp_path / "exam.docx"), questions=6, png_ratio=1.0, wmf_ratio=0, option_image_ratio=0, seed=1)
+    data = (tmp_path / "exam.docx").read_bytes()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(image_cache, "enabled", False)
+    monkeypatch.setattr(docx_service, "content_store", ContentStore(str(tmp_path / "store")))
+    service = DocxService(lazy_images=False)
+
+    def upload(request_uuid):
+        content_hash = asyncio.run(service.save_upload(UploadFile(io.BytesIO(data), filename="exam.docx"), request_uuid))
+        service.process_saved_docx(request_uuid, content_hash=content_hash, engine="native")
+        return content_hash
+
+    content_hash = upload("first")
+    first_srcs = _image_srcs("outputs/first")
+    assert len(first_srcs) == 6
+    assert all(src.startswith(f"{service.base_url}/outputs/first/media/") for src in first_srcs)
+    assert docx_service.content_store.lookup(service.store_key(content_hash, "native")) is not None
+
+    # Lần hai không được parse / convert lại
+    def not_again(*args, **kwargs):
+        raise AssertionError("identical upload was processed again")
+    monkeypatch.setattr(service, "parse_docx_native", not_again)
+    monkeypatch.setattr(service, "convert_images", not_again)
+    upload("second")
+
+    second_srcs = _image_srcs("outputs/second")
+    assert second_srcs == [src.replace("/outputs/first/", "/outputs/second/") for src in first_srcs]
+    stored_media = os.path.join("store", service.store_key(content_hash, "native"), "media")
+    for src in second_srcs:
+        filename, _, version = src.rsplit("/", 1)[1].partition("?v=")
+        assert version
+        # media/ của exam mới là hard link tới bản trong store
+        assert os.path.samefile(os.path.join("outputs", "second", "media", filename), os.path.join(stored_media, filename))
+    assert not os.path.exists("outputs/second/temp.docx")
@@ -0,0 +1,36 @@
+import threading
+import pytest
+from app.utils.conversion_scheduler import ConversionQueueFullError, ConversionScheduler
+
+def test_batches_are_served_round_robin_and_queue_limit_fails_fast():
+    scheduler = ConversionScheduler(workers=1, queue_limit=6, queue_timeout=0)
+    gate = threading.Event()
+    order = []
+
+    def convert(name):
+        gate.wait(5)
+        order.append(name)
+        return name
+
+    with scheduler.batch() as big, scheduler.batch() as small:
+        # Worker duy nhất bị giữ ở task đầu tiên, các task sau nằm trong hàng đợi
+        futures = [big.submit(convert, "big-0")]
+        while scheduler.stats()["active"] == 0:
+            pass
+        futures += [big.submit(convert, f"big-{i}") for i in range(1, 5)]
+        futures += [small.submit(convert, f"small-{i}") for i in range(2)]
+        assert scheduler.stats()["queued"] == 6
+
+        # Hàng đợi đầy: upload mới bị từ chối ngay (queue_timeout=0)
+        with pytest.raises(ConversionQueueFullError):
+            scheduler.batch()
+        assert scheduler.stats()["rejected"] == 1
+
+        gate.set()
+        assert [f.result(5) for f in futures][-2:] == ["small-0", "small-1"]
+
+    # Upload nhỏ xen kẽ với upload lớn thay vì chờ nó xong
+    assert order[:5] == ["big-0", "big-1", "small-0", "big-2", "small-1"]
+    stats = scheduler.stats()
+    assert (stats["queued"], stats["open_batches"]) == (0, 0)
+    scheduler.shutdown()
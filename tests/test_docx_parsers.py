@@ -0,0 +1,113 @@
+import json
+import os
+import pytest
+from app.services.docx_service import DocxService, Question
+from app.services.native_docx_parser import NativeDocxParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = [
+    (os.path.join(ROOT, "code", "test.docx"), os.path.join(ROOT, "tests", "golden", "test_docx.json")),
+]
+
+def _summary(questions):
+    """Structure both engines must agree on (text/math rendering may differ)"""
+    return [{
+        "id": q.id,
+        "correct": q.correct,
+        "options": [o.label for o in q.options],
+        "images": [b.src for b in q.blocks if b.type == "image"],
+        "option_images": {
+            o.label: [b.src for b in o.blocks if b.type == "image"]
+            for o in q.options if any(b.type == "image" for b in o.blocks)
+        },
+    } for q in questions]
+
+def _golden(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("docx_path,golden_path", CORPUS)
+def test_native_engine_matches_golden(docx_path, golden_path, tmp_path):
+    questions, media_parts = NativeDocxParser().parse(docx_path)
+    assert _summary([Question(**q) for q in questions]) == _golden(golden_path)
+
+    NativeDocxParser.extract_media(docx_path, media_parts, str(tmp_path))
+    referenced = {
+        b["src"] for q in questions
+        for b in q["blocks"] + [b for o in q["options"] for b in o["blocks"]]
+        if b["type"] == "image"
+    }
+    assert referenced <= set(os.listdir(tmp_path))
+
+@pytest.mark.parametrize("docx_path,golden_path", CORPUS)
+def test_pandoc_engine_matches_golden(docx_path, golden_path, tmp_path):
+    pypandoc = pytest.importorskip("pypandoc")
+    try:
+        pypandoc.get_pandoc_version()
+    except OSError:
+        pytest.skip("pandoc is not installed")
+    service = DocxService()
+    latex = service.convert_docx_to_latex(docx_path, str(tmp_path / "temp.tex"), str(tmp_path))
+    assert _summary(service.parse_latex_to_json(latex)) == _golden(golden_path)
+
+@pytest.mark.parametrize("docx_path,golden_path", CORPUS)
+def test_pipelined_media_matches_pandoc_extract_media(docx_path, golden_path, tmp_path):
+    pypandoc = pytest.importorskip("pypandoc")
+    try:
+        pypandoc.get_pandoc_version()
+    except OSError:
+        pytest.skip("pandoc is not installed")
+    service = DocxService()
+    latex = service.convert_docx_to_latex(docx_path, str(tmp_path / "a.tex"), str(tmp_path / "a"))
+    # Chế độ pipelined: ảnh lấy thẳng từ zip, pandoc không extract
+    NativeDocxParser.extract_media(docx_path, NativeDocxParser.body_media_parts(docx_path), str(tmp_path / "b"))
+    latex_only = service.convert_docx_to_latex(docx_path, str(tmp_path / "b.tex"), str(tmp_path), extract_media=False)
+
+    assert sorted(os.listdir(tmp_path / "b")) == sorted(os.listdir(tmp_path / "a" / "media"))
+    assert _summary(service.parse_latex_to_json(latex_only)) == _summary(service.parse_latex_to_json(latex))
+
+def test_native_engine_reads_generated_exam(tmp_path):
+    from benchmarks.docx_generator import generate_exam_docx
+    docx_path = str(tmp_path / "generated.docx")
+    info = generate_exam_docx(docx_path, questions=25, png_ratio=0.5, wmf_ratio=0.5, math_ratio=0.5, seed=3)
+
+    questions, media_parts = NativeDocxParser().parse(docx_path)
+    assert [q["correct"] for q in questions] == info["answer_key"]
+    assert all(len(q["options"]) == 4 for q in questions)
+    assert len(media_parts) == info["images"]
+
+def test_pipelined_path_converts_note_and_unlisted_images(tmp_path, monkeypatch):
+    import zipfile
+    from PIL import Image
+    from benchmarks.docx_generator import generate_exam_docx
+    from app.utils.image_cache import image_cache
+    monkeypatch.setattr(image_cache, "enabled", False)
+    docx_path = str(tmp_path / "exam.docx")
+    generate_exam_docx(docx_path, questions=1, png_ratio=1.0, wmf_ratio=0, option_image_ratio=0, seed=1)
+    Image.new("RGB", (30, 10), "blue").save(tmp_path / "note.png")
+    with zipfile.ZipFile(docx_path, "a") as zf:
+        # Ảnh trong footnote (footnotes.xml.rels) và ảnh không có trong rels nào
+        zf.write(tmp_path / "note.png", "word/media/note.png")
+        zf.write(tmp_path / "note.png", "word/media/unlisted.png")
+        zf.writestr("word/_rels/footnotes.xml.rels", (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+            'Target="media/note.png"/></Relationships>'
+        ))
+    assert NativeDocxParser.body_media_parts(docx_path) == ["word/media/image1.png", "word/media/note.png"]
+
+    # Không cần pandoc: LaTeX như pandoc ghi khi không --extract-media
+    latex = (
+        r"Câu 1. \includegraphics{media/image1.png} x\footnote{\includegraphics{media/note.png}}"
+        "\nA. \\includegraphics{media/unlisted.png}\nB. y\n"
+    )
+    service = DocxService(pipelined=True, lazy_images=False)
+    monkeypatch.setattr(service, "convert_docx_to_latex", lambda *args, **kwargs: latex)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    questions, images_map = service._convert_pipelined(
+        docx_path, str(output_dir / "temp.tex"), str(output_dir), str(output_dir / "media"), lambda stage, fraction: None
+    )
+    assert images_map == {"image1.png": "image1.webp", "note.png": "note.webp", "unlisted.png": "unlisted.webp"}
+    assert sorted(os.listdir(output_dir)) == ["media"]
+    assert {"image1.webp", "note.webp", "unlisted.webp"} <= set(os.listdir(output_dir / "media"))
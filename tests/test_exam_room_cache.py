@@ -0,0 +1,41 @@
+import asyncio
+import time
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.models.database import Base
+from app.services.database_service import AsyncDatabaseService
+from app.services.exam_room_cache import ExamRoomCache, exam_room_cache
+
+def test_ttl_negative_entries_and_lru():
+    cache = ExamRoomCache(max_entries=2, ttl=60, negative_ttl=0.05)
+    assert cache.get("a") == (False, None)
+    cache.put("a", None)
+    assert cache.get("a") == (True, None)
+    time.sleep(0.06)
+    assert cache.get("a") == (False, None)  # negative entry expired
+
+    for name in ("a", "b", "c"):
+        cache.put(name, None if name == "a" else name)
+    assert len(cache) == 2 and cache.get("a") == (False, None)
+
+async def _run_scenario():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with session_factory() as db:
+        service = AsyncDatabaseService(db)
+        assert await service.get_test_exam_room_by_uuid("room-c") is None
+        assert exam_room_cache.get("room-c") == (True, None)
+
+        await service.create_test_exam_room("room-c", "teacher", "Exam", 45)
+        room = await service.get_test_exam_room_by_uuid("room-c")
+        assert room.title == "Exam" and room.time_limit == 45
+        assert exam_room_cache.get("room-c") == (True, room)
+
+        assert await service.delete_test_exam_room("room-c", "teacher")
+        assert await service.get_test_exam_room_by_uuid("room-c") is None
+    await engine.dispose()
+
+def test_service_reads_through_and_invalidates():
+    asyncio.run(_run_scenario())
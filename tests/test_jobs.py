@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+import uuid
+from fastapi.testclient import TestClient
+from app.main import app
+from app.models.database import SessionLocal
+from app.routes import docx_processor
+from app.services import job_service
+from app.services.database_service import DatabaseService
+from app.services.job_service import JobManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+client = TestClient(app)
+
+class StubDocxService:
+    """process_saved_docx without pandoc: reports a stage, waits for release, then fails or writes output.json"""
+    release = threading.Event()
+    fail = False
+
+    def process_saved_docx(self, request_uuid, progress=None, content_hash=None, engine="pandoc"):
+        progress("parsing", 0.3)
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("pandoc crashed")
+        with open(os.path.join("outputs", request_uuid, "output.json"), "w", encoding="utf-8") as f:
+            f.write('{"questions": []}')
+
+def _upload(request_uuid, **data):
+    with open(os.path.join(ROOT, "code", "test.docx"), "rb") as f:
+        return client.post(
+            "/api/v1/process-docx",
+            files={"file": ("test.docx", f)},
+            data={"request_uuid": request_uuid, "username": "teacher", "async_mode": "true", **data},
+        )
+
+def _wait(job_id):
+    for _ in range(100):
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def _setup(tmp_path, monkeypatch, max_pending=4):
+    monkeypatch.chdir(tmp_path)
+    manager = JobManager(max_workers=1, max_pending=max_pending)
+    monkeypatch.setattr(docx_processor, "job_manager", manager)
+    monkeypatch.setattr(job_service, "DocxService", StubDocxService)
+    StubDocxService.release = threading.Event()
+    StubDocxService.fail = False
+    return manager
+
+def _room(request_uuid):
+    db = SessionLocal()
+    try:
+        return DatabaseService(db).get_test_exam_room_by_uuid(request_uuid)
+    finally:
+        db.close()
+
+def test_async_upload_status_transitions_and_queue_full(tmp_path, monkeypatch):
+    manager = _setup(tmp_path, monkeypatch, max_pending=1)
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+
+    response = _upload(first)
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status_url"] == f"/api/v1/jobs/{job['job_id']}"
+
+    # Hàng đợi đầy: 503 và không để lại gì trong outputs/
+    assert _upload(second).status_code == 503
+    assert not (tmp_path / "outputs" / second).exists()
+    # Cùng UUID với upload đang chạy: 409, file đang xử lý không bị ghi đè
+    assert _upload(first).status_code == 409
+
+    StubDocxService.release.set()
+    done = _wait(job["job_id"])
+    assert (done["status"], done["stage"], done["progress"]) == ("succeeded", "done", 1.0)
+    assert _room(first) is not None
+    assert manager.active_uuids() == []
+    assert client.get("/api/v1/jobs/unknown").status_code == 404
+    manager.shutdown()
+
+def test_failed_job_removes_only_its_own_folder(tmp_path, monkeypatch):
+    manager = _setup(tmp_path, monkeypatch)
+    StubDocxService.fail = True
+    StubDocxService.release.set()
+
+    # Exam đã có: upload lại cùng UUID bị từ chối, dữ liệu giữ nguyên
+    existing = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        DatabaseService(db).create_test_exam_room(existing, "teacher")
+    finally:
+        db.close()
+    os.makedirs(tmp_path / "outputs" / existing)
+    (tmp_path / "outputs" / existing / "output.json").write_text('{"questions": [1]}')
+    assert _upload(existing).status_code == 409
+    assert (tmp_path / "outputs" / existing / "output.json").read_text() == '{"questions": [1]}'
+
+    # Thư mục còn sót (chưa có room) cũng không bị ghi đè
+    leftover = str(uuid.uuid4())
+    os.makedirs(tmp_path / "outputs" / leftover)
+    assert _upload(leftover).status_code == 409
+    assert (tmp_path / "outputs" / leftover).exists()
+
+    failing = str(uuid.uuid4())
+    job = _wait(_upload(failing).json()["job_id"])
+    assert job["status"] == "failed"
+    assert "pandoc crashed" in job["error"]
+    assert not (tmp_path / "outputs" / failing).exists()
+    assert _room(failing) is None
+    assert sorted(os.listdir(tmp_path / "outputs")) == sorted([existing, leftover])
+    manager.shutdown()
+
+def test_sync_upload_rejected_by_back_pressure_leaves_other_exams_alone(tmp_path, monkeypatch):
+    from app.services.docx_service import DocxService
+    from app.utils.conversion_scheduler import ConversionQueueFullError
+    monkeypatch.chdir(tmp_path)
+
+    def queue_full(self, *args, **kwargs):
+        raise ConversionQueueFullError("Image conversion queue is full, try again later")
+    monkeypatch.setattr(DocxService, "process_saved_docx", queue_full)
+
+    existing = str(uuid.uuid4())
+    os.makedirs(tmp_path / "outputs" / existing)
+    (tmp_path / "outputs" / existing / "temp.docx").write_bytes(b"exam being processed")
+    assert _upload(existing, async_mode="false").status_code == 409
+    assert (tmp_path / "outputs" / existing / "temp.docx").read_bytes() == b"exam being processed"
+
+    fresh = str(uuid.uuid4())
+    assert _upload(fresh, async_mode="false").status_code == 503
+    assert not (tmp_path / "outputs" / fresh).exists()
+    assert _room(fresh) is None
@@ -0,0 +1,61 @@
+import os
+import random
+import pytest
+from app.services.docx_service import DocxService
+from benchmarks.bench_latex_parser import synthetic_latex
+from tests import latex_parser_reference
+
+EDGE_CASES = [
+    "",
+    "no question header at all",
+    r"\textbf{Câu 1.} Câu hỏi không có đáp án $x$",
+    r"\textbf{Câu 1:} x \ul{A.}} 1 \textbf{B.} \textbf{\ul{C.}} D. D. trùng nhãn",
+    "Câu 1. A.B.C.D.\n\nCâu 2: \\underline{B.}\\textbf{}A. $a$ \\(b\\) \\[c\\] trailing}",
+    "Câu 1. \\item \\begin{enumerate}\\item A. {unbalanced} \\item B. text}\\end{enumerate}",
+    r"Câu 1. \pandocbounded{\includegraphics[keepaspectratio]{./media/image1.wmf}} x A. \includegraphics{media/a.png}",
+    # \pandocbounded{ chỉ bị bỏ sau khi đã tìm nhãn đáp án
+    r"Câu 1. x \underline{\pandocbounded{B. y} \textbf{\pandocbounded{C. z}",
+]
+
+# Các mảnh ghép ngẫu nhiên cho differential test
+FUZZ_TOKENS = [
+    "Câu 1.", "Câu 2:", r"\textbf{Câu 3.}", r"\textbf{", r"\ul{", r"\underline{", r"\pandocbounded{",
+    "A.", "B.", "C.", "D.", "}", "{", "$x$", "$", r"\(y\)", r"\[z\]", r"\includegraphics{media/a.png}",
+    r"\includegraphics[width=1in]{./media/b.wmf}", r"\begin{quote}", r"\end{quote}", r"\begin{enumerate}",
+    r"\end{enumerate}", r"\item", "text", " ", "\n", "\\", "Câu", "1", ".",
+]
+
+def _dump(questions):
+    return [q.model_dump() for q in questions]
+
+@pytest.mark.parametrize("latex", EDGE_CASES)
+def test_tokenizer_matches_reference_on_edge_cases(latex):
+    assert _dump(DocxService().parse_latex_to_json(latex)) == _dump(latex_parser_reference.parse_latex_to_json(latex))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tokenizer_matches_reference_on_synthetic_banks(seed):
+    latex = synthetic_latex(200, seed=seed)
+    assert _dump(DocxService().parse_latex_to_json(latex)) == _dump(latex_parser_reference.parse_latex_to_json(latex))
+
+def test_tokenizer_matches_reference_on_random_token_strings():
+    rng = random.Random(0)
+    service = DocxService()
+    for _ in range(5000):
+        latex = "".join(rng.choice(FUZZ_TOKENS) for _ in range(rng.randint(1, 30)))
+        assert _dump(service.parse_latex_to_json(latex)) == _dump(latex_parser_reference.parse_latex_to_json(latex)), latex
+
+def test_tokenizer_matches_reference_on_corpus(tmp_path):
+    pypandoc = pytest.importorskip("pypandoc")
+    try:
+        pypandoc.get_pandoc_version()
+    except OSError:
+        pytest.skip("pandoc is not installed")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    service = DocxService()
+    for name in ("test.docx", "thuvienhoclieu.com-40-Cau-trac-nghiem-nguyen-ham-giai-chi-tiet.docx"):
+        latex = service.convert_docx_to_latex(os.path.join(root, "code", name), str(tmp_path / "temp.tex"), str(tmp_path))
+        assert _dump(service.parse_latex_to_json(latex)) == _dump(latex_parser_reference.parse_latex_to_json(latex))
+
+def test_split_blocks_matches_reference():
+    text = r"a \pandocbounded{\includegraphics[keepaspectratio]{/abs/media/image2.emf}} b $x$ \(y\) c}"
+    assert DocxService().split_blocks(text) == latex_parser_reference.split_blocks(text)
@@ -0,0 +1,60 @@
+import os
+import threading
+from PIL import Image
+from app.utils.image_cache import image_cache
+from app.utils.image_utils import ImageUtils
+from app.utils.lazy_images import LazyImageConverter, mark_lazy, planned_images_map
+
+class CountingImageUtils(ImageUtils):
+    def __init__(self):
+        super().__init__(raster_engine="pillow", variants=False)
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def convert_extracted_images(self, image_dir="media"):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return super().convert_extracted_images(image_dir)
+
+def test_missing_webp_is_converted_once_on_demand(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, "enabled", False)
+    media = tmp_path / "media"
+    media.mkdir()
+    Image.new("RGB", (40, 20), "red").save(media / "image1.png")
+    Image.new("RGB", (40, 20), "blue").save(media / "image2.png")
+    assert planned_images_map(str(media)) == {"image1.png": "image1.webp", "image2.png": "image2.webp"}
+
+    utils = CountingImageUtils()
+    converter = LazyImageConverter(utils)
+    # Exam không xử lý ở lazy mode: không convert theo yêu cầu
+    assert converter.ensure_webp(str(media), "image1.webp") is None
+    mark_lazy(str(tmp_path), True)
+
+    served = []
+    requests = [
+        threading.Thread(target=lambda: served.append(converter.ensure_webp(str(media), "image1.webp")))
+        for _ in range(3)
+    ]
+    requests[0].start()
+    utils.started.wait(5)
+    for thread in requests[1:]:
+        thread.start()
+    utils.release.set()
+    for thread in requests:
+        thread.join(5)
+
+    # Ba request cùng lúc, một lần convert
+    assert utils.calls == 1
+    assert served == [str(media / "image1.webp")] * 3
+    assert sorted(os.listdir(media)) == ["image1.webp", "image2.png"]
+    assert converter.ensure_webp(str(media), "missing.webp") is None
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("outputs/exam")
+    os.rename(media, "outputs/exam/media")
+    mark_lazy("outputs/exam", True)
+    assert converter.prewarm("exam") == 1
+    assert sorted(os.listdir("outputs/exam/media")) == ["image1.webp", "image2.webp"]
+    converter.shutdown()
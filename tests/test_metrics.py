@@ -0,0 +1,22 @@
+import uuid
+from fastapi.testclient import TestClient
+from app.main import app
+from app.utils import metrics
+
+client = TestClient(app)
+
+def test_server_timing_and_route_histogram():
+    response = client.get(f"/api/v1/quiz/{uuid.uuid4()}")
+    assert response.status_code == 404
+    server_timing = response.headers["server-timing"]
+    assert "db_get_test_exam_room_by_uuid;dur=" in server_timing
+    assert "total;dur=" in server_timing
+
+    body = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/quiz/{quiz_uuid}",status="404"}' in body
+    assert "db_query_duration_seconds_count" in body
+
+def test_pipeline_stage_records_histogram_outside_requests():
+    with metrics.pipeline_stage("test_stage"):
+        pass
+    assert 'docx_pipeline_stage_duration_seconds_count{stage="test_stage"} 1.0' in client.get("/metrics").text
@@ -0,0 +1,67 @@
+import json
+import os
+from app.services.quiz_cache import ANSWER_KEY_FILE, PUBLIC_QUESTIONS_FILE, QuizCache, dump_answer_key, dump_public_questions
+
+def _write_quiz(path, correct):
+    data = {"questions": [{
+        "id": 1,
+        "blocks": [{"type": "text", "content": "1 + 1 = ?"}],
+        "options": [{"label": "A", "blocks": []}, {"label": "B", "blocks": []}],
+        "correct": correct,
+    }]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+def test_quiz_cache_strips_answers_and_reloads_on_change(tmp_path):
+    json_path = str(tmp_path / "output.json")
+    _write_quiz(json_path, "A")
+    cache = QuizCache(max_entries=2)
+
+    entry = cache.get("exam", json_path)
+    assert entry.answer_key == {1: "A"}
+    assert "correct" not in entry.questions[0]
+    assert cache.get("exam", json_path) is entry
+
+    _write_quiz(json_path, "B")
+    st = os.stat(json_path)
+    os.utime(json_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert cache.get("exam", json_path).answer_key == {1: "B"}
+
+def test_quiz_cache_lru_eviction_and_invalidate(tmp_path):
+    cache = QuizCache(max_entries=2)
+    paths = {}
+    for name in ("a", "b", "c"):
+        paths[name] = str(tmp_path / f"{name}.json")
+        _write_quiz(paths[name], "A")
+
+    cache.get("a", paths["a"])
+    cache.get("b", paths["b"])
+    cache.get("a", paths["a"])
+    cache.get("c", paths["c"])  # evicts "b", the least recently used
+    assert len(cache) == 2
+    assert "b" not in cache._entries
+
+    cache.invalidate("a")
+    assert "a" not in cache._entries
+    assert cache.get("missing", str(tmp_path / "missing.json")) is None
+
+def test_answer_key_artifact_with_output_json_fallback(tmp_path):
+    cache = QuizCache(max_entries=2)
+    _write_quiz(str(tmp_path / "output.json"), "A")
+    # Exam processed before answer_key.json existed
+    assert cache.get_answer_key("exam", str(tmp_path)) == {1: "A"}
+
+    questions = [{"id": 1, "correct": "B"}, {"id": 3, "correct": None}]
+    (tmp_path / ANSWER_KEY_FILE).write_text(dump_answer_key(questions), encoding="utf-8")
+    assert cache.get_answer_key("exam", str(tmp_path)) == {1: "B", 3: ""}
+    assert cache.get_answer_key("missing", str(tmp_path / "missing")) is None
+
+def test_public_questions_bytes_with_output_json_fallback(tmp_path):
+    cache = QuizCache(max_entries=2)
+    _write_quiz(str(tmp_path / "output.json"), "A")
+    legacy = cache.get_public_questions("exam", str(tmp_path))
+    assert b"correct" not in legacy.body
+
+    (tmp_path / PUBLIC_QUESTIONS_FILE).write_bytes(dump_public_questions(json.loads((tmp_path / "output.json").read_text())["questions"]))
+    public = cache.get_public_questions("exam", str(tmp_path))
+    assert public.body == legacy.body and public.digest == legacy.digest
@@ -0,0 +1,44 @@
+from PIL import Image, ImageDraw
+from app.utils.raster_webp import convert_raster_to_webp
+
+def test_pillow_raster_path_is_lossless_and_defers_unusual_modes(tmp_path):
+    image = Image.new("RGB", (90, 30), "white")
+    ImageDraw.Draw(image).text((4, 8), "x^2+1", fill="black")
+    image.save(tmp_path / "a.png")
+    image.convert("P").save(tmp_path / "b.png", transparency=0)
+    Image.new("I;16", (8, 8), 500).save(tmp_path / "c.png")
+
+    assert convert_raster_to_webp(str(tmp_path / "a.png"), str(tmp_path / "a.webp"))
+    with Image.open(tmp_path / "a.webp") as webp:
+        assert webp.format == "WEBP"
+        assert webp.convert("RGB").tobytes() == image.tobytes()
+
+    # Palette + transparency giữ kênh alpha
+    assert convert_raster_to_webp(str(tmp_path / "b.png"), str(tmp_path / "b.webp"))
+    with Image.open(tmp_path / "b.webp") as webp:
+        assert webp.mode == "RGBA"
+
+    # 16-bit: để ImageMagick xử lý, không để lại file dở
+    assert not convert_raster_to_webp(str(tmp_path / "c.png"), str(tmp_path / "c.webp"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.png", "a.webp", "b.png", "b.webp", "c.png"]
+
+def test_variants_are_downscaled_copies_described_for_blocks(tmp_path):
+    from app.utils.image_utils import IMAGE_VARIANTS, ImageUtils
+    from app.utils.raster_webp import write_variants
+    Image.new("RGB", (900, 300), "white").save(tmp_path / "big.webp", lossless=True)
+    Image.new("RGB", (300, 100), "white").save(tmp_path / "mid.webp", lossless=True)
+
+    assert write_variants(str(tmp_path / "big.webp"), IMAGE_VARIANTS) == {
+        "thumb": "big.thumb.webp", "mobile": "big.mobile.webp",
+    }
+    # Không phóng to: ảnh hẹp hơn bản mobile chỉ có thumb
+    assert write_variants(str(tmp_path / "mid.webp"), IMAGE_VARIANTS) == {"thumb": "mid.thumb.webp"}
+
+    assert ImageUtils.describe_image(str(tmp_path), "big.webp") == {
+        "width": 900, "height": 300,
+        "variants": [
+            {"name": "thumb", "filename": "big.thumb.webp", "width": 160, "height": 53},
+            {"name": "mobile", "filename": "big.mobile.webp", "width": 480, "height": 160},
+        ],
+    }
+    assert ImageUtils.describe_image(str(tmp_path), "missing.webp") is None
@@ -0,0 +1,51 @@
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.models.database import Base, recent_writes
+from app.services.database_service import AsyncDatabaseService
+from app.services.exam_room_cache import exam_room_cache
+
+async def _session_factory(path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+async def _run_scenario(tmp_path):
+    primary_engine, primary = await _session_factory(tmp_path / "primary.db")
+    replica_engine, replica = await _session_factory(tmp_path / "replica.db")
+
+    # Replica đang trễ: chỉ có room và một kết quả cũ
+    async with replica() as db:
+        service = AsyncDatabaseService(db)
+        await service.create_test_exam_room("room-r", "teacher", "Replica copy", 30)
+        await service.create_exam_result("room-r", "alice", 10, 1, 10.0)
+    async with primary() as db:
+        service = AsyncDatabaseService(db)
+        await service.create_test_exam_room("room-r", "teacher", "Primary copy", 30)
+        await service.create_exam_result("room-r", "alice", 10, 9, 90.0)
+        await service.create_exam_result("room-r", "bob", 10, 5, 50.0)
+
+    # Không có ghi gần đây trong process: đọc từ replica
+    recent_writes._expiry.clear()
+    exam_room_cache.clear()
+    async with primary() as db, replica() as read_db:
+        service = AsyncDatabaseService(db, read_db)
+        assert (await service.get_test_exam_room_by_uuid("room-r")).title == "Replica copy"
+        assert len(await service.get_exam_results_by_uuid("room-r")) == 1
+        assert (await service.get_student_exam_result("room-r", "alice")).score_percentage == 10.0
+        # Không có trên replica (chưa replicate): thử lại trên primary
+        assert (await service.get_student_exam_result("room-r", "bob")).score_percentage == 50.0
+
+    # Sau khi ghi (read-your-writes), đọc exam đó từ primary
+    async with primary() as db, replica() as read_db:
+        service = AsyncDatabaseService(db, read_db)
+        await service.create_exam_result("room-r", "carol", 10, 7, 70.0)
+        assert recent_writes.is_recent("room-r")
+        assert len(await service.get_exam_results_by_uuid("room-r")) == 3
+        assert (await service.get_student_exam_result("room-r", "alice")).score_percentage == 90.0
+
+    await primary_engine.dispose()
+    await replica_engine.dispose()
+
+def test_reads_use_replica_except_after_writes(tmp_path):
+    asyncio.run(_run_scenario(tmp_path))
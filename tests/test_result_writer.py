@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from app.models import database
+from app.models.database import AsyncSessionLocal, SessionLocal
+from app.services.database_service import AsyncDatabaseService, DatabaseService
+from app.services.result_writer import ResultWriter
+
+def _row(exam_uuid, username):
+    return {
+        "test_exam_uuid": exam_uuid, "student_username": username, "ip_address": "127.0.0.1",
+        "total_questions": 2, "correct_answers": 1, "score_percentage": 50.0,
+        "cheating_detected": False, "cheating_reason": None, "exam_cancelled": False,
+        "security_violation_detected": False, "activity_log": None, "suspicious_activity": None,
+    }
+
+def _results(exam_uuid):
+    db = SessionLocal()
+    try:
+        return DatabaseService(db).get_exam_results_by_uuid(exam_uuid)
+    finally:
+        db.close()
+
+def test_journal_replay_after_crash_is_idempotent(tmp_path):
+    exam_uuid = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        DatabaseService(db).create_test_exam_room(exam_uuid, "teacher")
+    finally:
+        db.close()
+    journal_dir = str(tmp_path / "journal")
+
+    writer = ResultWriter(journal_dir, batch_size=100, flush_interval=60, enabled=True)
+    assert writer.submit(_row(exam_uuid, "alice"))
+    assert not writer.submit(_row(exam_uuid, "alice"))
+    assert writer.submit_many([_row(exam_uuid, "bob"), _row(exam_uuid, "alice")]) == [True, False]
+    assert writer.is_pending(exam_uuid, "bob")
+    assert _results(exam_uuid) == []
+    # "Crash": the process dies without flushing, leaving its journal behind
+    writer._segment.close()
+    (segment_name,) = os.listdir(journal_dir)
+    with open(os.path.join(journal_dir, segment_name), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    with open(os.path.join(journal_dir, "results-0-0.jsonl"), "w", encoding="utf-8") as f:
+        f.write(lines[0] + "\n" + '{"truncated')  # alice again + a torn write
+
+    restarted = ResultWriter(journal_dir, batch_size=100, flush_interval=60, enabled=True)
+    restarted.start()
+    assert restarted.is_pending(exam_uuid, "alice")
+    restarted.stop()
+
+    results = _results(exam_uuid)
+    assert sorted(r.student_username for r in results) == ["alice", "bob"]
+    assert all(r.completed_at is not None for r in results)
+    assert os.listdir(journal_dir) == []
+
+def test_rejected_rows_are_quarantined_without_blocking_the_batch(tmp_path):
+    exam_uuid = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        DatabaseService(db).create_test_exam_room(exam_uuid, "teacher")
+    finally:
+        db.close()
+    journal_dir = str(tmp_path / "journal")
+
+    writer = ResultWriter(journal_dir, batch_size=100, flush_interval=60, enabled=True)
+    bad = {**_row(exam_uuid, "mallory"), "total_questions": None}  # NOT NULL: DB luôn từ chối
+    assert writer.submit_many([_row(exam_uuid, "alice"), bad, _row(exam_uuid, "bob")]) == [True, True, True]
+    assert writer.flush() == 2
+
+    assert sorted(r.student_username for r in _results(exam_uuid)) == ["alice", "bob"]
+    assert not writer.is_pending(exam_uuid, "mallory")
+    assert writer.flush() == 0
+    (quarantine,) = os.listdir(journal_dir)
+    assert quarantine.startswith("quarantine-")
+    with open(os.path.join(journal_dir, quarantine), encoding="utf-8") as f:
+        assert [json.loads(line)["student_username"] for line in f] == ["mallory"]
+
+def test_direct_and_buffered_results_share_one_clock(tmp_path, monkeypatch):
+    exam_uuid = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        DatabaseService(db).create_test_exam_room(exam_uuid, "teacher")
+    finally:
+        db.close()
+    writer = ResultWriter(str(tmp_path / "journal"), batch_size=100, flush_interval=60, enabled=True)
+
+    # Đồng hồ giả: mỗi lần đọc tiến 1 giây, khác hẳn giờ thật của DB
+    ticks = iter(datetime(2030, 1, 1, 8, 0, 0) + timedelta(seconds=i) for i in range(100))
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(ticks).replace(tzinfo=tz)
+    monkeypatch.setattr(database, "datetime", FakeDatetime)
+
+    # Nộp xen kẽ: ghi thẳng DB và qua write-behind (flush sau cùng, id lớn hơn)
+    for i, name in enumerate(["alice", "bob", "carol", "dave"]):
+        if i % 2 == 0:
+            db = SessionLocal()
+            try:
+                DatabaseService(db).create_exam_result(exam_uuid, name, 2, 1, 50.0)
+            finally:
+                db.close()
+        else:
+            assert writer.submit(_row(exam_uuid, name))
+    assert writer.flush() == 2
+
+    async def pages():
+        names, after = [], None
+        async with AsyncSessionLocal() as session:
+            service = AsyncDatabaseService(session)
+            while rows := await service.get_exam_results_page(exam_uuid, limit=1, after=after):
+                names.append((rows[0].student_username, rows[0].completed_at))
+                after = (rows[0].completed_at, rows[0].id)
+        return names
+
+    assert asyncio.run(pages()) == [
+        (name, datetime(2030, 1, 1, 8, 0, i)) for i, name in enumerate(["alice", "bob", "carol", "dave"])
+    ]
@@ -0,0 +1,31 @@
+from sqlalchemy import create_engine, inspect, text
+from app.models.database import upgrade_schema
+
+# exam_results như bản trước khi có keyset pagination và cột answers
+OLD_EXAM_RESULTS = """
+CREATE TABLE exam_results (
+    id INTEGER PRIMARY KEY, test_exam_uuid VARCHAR(36) NOT NULL, student_username VARCHAR(255) NOT NULL,
+    total_questions INTEGER NOT NULL, correct_answers INTEGER NOT NULL, score_percentage FLOAT NOT NULL,
+    ip_address VARCHAR(45), cheating_detected BOOLEAN NOT NULL, cheating_reason TEXT,
+    exam_cancelled BOOLEAN NOT NULL, security_violation_detected BOOLEAN NOT NULL,
+    activity_log JSON, suspicious_activity JSON, completed_at DATETIME DEFAULT (CURRENT_TIMESTAMP)
+)
+"""
+
+def test_upgrade_schema_brings_an_old_database_up_to_date(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(OLD_EXAM_RESULTS))
+        conn.execute(text(
+            "INSERT INTO exam_results (test_exam_uuid, student_username, total_questions, correct_answers, "
+            "score_percentage, cheating_detected, exam_cancelled, security_violation_detected, completed_at) "
+            "VALUES ('e', 'alice', 2, 1, 50, 0, 0, 0, '2025-01-02 03:04:05.123456')"
+        ))
+
+    upgrade_schema(engine)
+    upgrade_schema(engine)  # chạy lại ở mỗi lần start: không lỗi
+
+    assert "answers" in {c["name"] for c in inspect(engine).get_columns("exam_results")}
+    assert "ix_exam_results_exam_completed" in {ix["name"] for ix in inspect(engine).get_indexes("exam_results")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT completed_at FROM exam_results")).scalar() == "2025-01-02 03:04:05"
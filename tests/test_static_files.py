@@ -0,0 +1,60 @@
+import gzip
+import json
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.utils.precompress import write_precompressed
+from app.utils.static_files import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, OutputsStaticFiles, content_version
+
+def _client(tmp_path):
+    exam = tmp_path / "exam-1"
+    (exam / "media").mkdir(parents=True)
+    (exam / "media" / "image1.webp").write_bytes(bytes(range(256)) * 8)
+    (exam / "public.json").write_text(json.dumps({"questions": [{"id": i} for i in range(200)]}))
+    write_precompressed(str(exam / "public.json"))
+    (exam / "output.json").write_text(json.dumps({"questions": [{"id": i, "correct": "A"} for i in range(200)]}))
+    write_precompressed(str(exam / "output.json"))  # bản cũ còn file nén trên đĩa
+    (exam / "answer_key.json").write_text("{}")
+    (tmp_path / ".store").mkdir()
+    (tmp_path / ".store" / "secret.json").write_text("{}")
+    app = FastAPI()
+    app.mount("/outputs", OutputsStaticFiles(directory=str(tmp_path)))
+    return TestClient(app)
+
+def test_precompressed_json_and_conditional_requests(tmp_path):
+    client = _client(tmp_path)
+    plain = client.get("/outputs/exam-1/public.json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.headers["vary"] == "Accept-Encoding"
+
+    # requests/httpx giải nén trong suốt: so sánh nội dung và header
+    encoded = client.get("/outputs/exam-1/public.json", headers={"Accept-Encoding": "gzip"})
+    assert encoded.headers["content-encoding"] == "gzip"
+    assert encoded.content == plain.content
+    assert int(encoded.headers["content-length"]) == len(gzip.compress(plain.content, 9, mtime=0))
+    assert encoded.headers["etag"] != plain.headers["etag"]
+
+    not_modified = client.get(
+        "/outputs/exam-1/public.json",
+        headers={"Accept-Encoding": "identity", "If-None-Match": plain.headers["etag"]},
+    )
+    assert not_modified.status_code == 304
+
+def test_versioned_media_is_immutable_and_supports_ranges(tmp_path):
+    client = _client(tmp_path)
+    version = content_version(str(tmp_path / "exam-1" / "media" / "image1.webp"))
+    full = client.get(f"/outputs/exam-1/media/image1.webp?v={version}")
+    assert full.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert full.headers["etag"].startswith('"') and not full.headers["etag"].startswith("W/")
+    # Không có version, hoặc version của nội dung cũ: phải revalidate
+    assert client.get("/outputs/exam-1/media/image1.webp").headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    stale = client.get("/outputs/exam-1/media/image1.webp?v=0123456789abcdef")
+    assert stale.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+    partial = client.get("/outputs/exam-1/media/image1.webp", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206 and partial.content == full.content[10:20]
+
+def test_internal_files_are_not_served(tmp_path):
+    client = _client(tmp_path)
+    assert (tmp_path / "exam-1" / "output.json.gz").exists()
+    for name in ("answer_key.json", "output.json", "output.json.gz"):
+        assert client.get(f"/outputs/exam-1/{name}").status_code == 404
+    assert client.get("/outputs/.store/secret.json").status_code == 404
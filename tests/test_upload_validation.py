@@ -0,0 +1,48 @@
+import asyncio
+import hashlib
+import io
+import os
+import zipfile
+import pytest
+from fastapi import UploadFile
+from app.services.docx_service import DocxService, InvalidUploadError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _save(service, data, request_uuid):
+    return asyncio.run(service.save_upload(UploadFile(io.BytesIO(data), filename="exam.docx"), request_uuid))
+
+def _zip(names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in names:
+            archive.writestr(name, "<x/>")
+    return buffer.getvalue()
+
+def test_valid_docx_is_saved_and_hashed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(os.path.join(ROOT, "code", "test.docx"), "rb") as f:
+        data = f.read()
+    assert _save(DocxService(), data, "ok") == hashlib.sha256(data).hexdigest()
+    assert os.path.getsize(tmp_path / "outputs" / "ok" / "temp.docx") == len(data)
+
+@pytest.mark.parametrize("data, status_code", [
+    (b"not a zip at all", 400),
+    (_zip(["[Content_Types].xml", "xl/workbook.xml"]), 400),
+])
+def test_invalid_uploads_are_rejected_before_processing(tmp_path, monkeypatch, data, status_code):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(InvalidUploadError) as excinfo:
+        _save(DocxService(), data, "bad")
+    assert excinfo.value.status_code == status_code
+    assert not (tmp_path / "outputs" / "bad").exists()
+
+def test_upload_over_the_size_limit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = DocxService()
+    service.max_upload_bytes = 1024 * 1024
+    data = _zip(["[Content_Types].xml", "word/document.xml"]) + b"\0" * (2 * 1024 * 1024)
+    with pytest.raises(InvalidUploadError) as excinfo:
+        _save(service, data, "big")
+    assert excinfo.value.status_code == 413
+    assert not (tmp_path / "outputs" / "big").exists()